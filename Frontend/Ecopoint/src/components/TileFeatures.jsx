@@ -0,0 +1,67 @@
+import React, { useCallback, useEffect, useRef, useState } from "react";
+import { useMapEvents } from "react-leaflet";
+
+// Tile numbers of a longitude/latitude at zoom z (same scheme as the exported pyramid)
+const tileX = (lon, z) => Math.floor(((lon + 180) / 360) * 2 ** z);
+const tileY = (lat, z) => {
+  const rad = (Math.max(Math.min(lat, 85.0511), -85.0511) * Math.PI) / 180;
+  return Math.floor(((1 - Math.log(Math.tan(rad) + 1 / Math.cos(rad)) / Math.PI) / 2) * 2 ** z);
+};
+
+// Loads only the tiles of the pyramid at `url` that cover the visible part of the map,
+// and renders every feature once with children(feature)
+const TileFeatures = ({ url, children }) => {
+  const [info, setInfo] = useState(null);
+  const [features, setFeatures] = useState([]);
+  const cache = useRef(new Map());
+
+  const load = useCallback(async (map) => {
+    if (!info || !info.bounds) return;
+    const z = Math.min(Math.max(Math.round(map.getZoom()), info.min_zoom), info.max_zoom);
+    const view = map.getBounds();
+    const [west, south, east, north] = info.bounds;
+    const x0 = tileX(Math.max(view.getWest(), west), z);
+    const x1 = tileX(Math.min(view.getEast(), east), z);
+    const y0 = tileY(Math.min(view.getNorth(), north), z);
+    const y1 = tileY(Math.max(view.getSouth(), south), z);
+
+    const tiles = [];
+    for (let x = x0; x <= x1; x++) {
+      for (let y = y0; y <= y1; y++) {
+        const key = `${z}/${x}/${y}`;
+        if (!cache.current.has(key)) {
+          // A missing tile simply has no features
+          cache.current.set(key, fetch(`${url}/${key}.json`)
+            .then((response) => (response.ok ? response.json() : { features: [] }))
+            .catch(() => ({ features: [] })));
+        }
+        tiles.push(cache.current.get(key));
+      }
+    }
+
+    // A feature crossing several tiles is kept once
+    const visible = new Map();
+    for (const tile of await Promise.all(tiles)) {
+      tile.features.forEach((feature) => visible.set(feature.id, feature));
+    }
+    setFeatures([...visible.values()]);
+  }, [info, url]);
+
+  const map = useMapEvents({ moveend: () => load(map) });
+
+  useEffect(() => {
+    cache.current = new Map();
+    fetch(`${url}/tiles.json`)
+      .then((response) => response.json())
+      .then(setInfo)
+      .catch((error) => console.error("Error fetching tiles:", error));
+  }, [url]);
+
+  useEffect(() => {
+    load(map);
+  }, [load, map]);
+
+  return <>{features.map((feature) => children(feature))}</>;
+};
+
+export default TileFeatures;
@@ -1,6 +1,8 @@
 import Road from "../models/roadModel.js";
 import CollectingPoint from "../models/collectingPointModel.js";
 import Neighborhood from "../models/neighbourhoodModel.js";
+import SuggestedBin from "../models/suggestedBinModel.js";
+import LowDensityArea from "../models/lowDensityAreaModel.js";
 import { roadType, binFrequency } from "../constants/enums.js";
 
 const getDensity = async (req, res) => {
@@ -27,9 +29,12 @@ const getNearestRoad = async (req, res) => {
 
     }
 }
+// Precomputed by saturation_update/suggest_bins.py; ?name= restricts to one neighborhood
 const getLowDensityArea = async (req, res) => {
     try {
-
+        const filter = req.query.name ? { 'attributes.name': req.query.name } : {};
+        const areas = await LowDensityArea.find(filter).sort({ 'attributes.gap_share': -1 });
+        res.status(200).json(areas);
     } catch (error) {
         res.status(500).json({ error: "Internal Server Error : getLowDensityArea" });
 
@@ -44,9 +49,12 @@ const getBinToPopulationRatio = async (req, res) => {
     }
 }
 
+// Precomputed by saturation_update/suggest_bins.py, best locations of each neighborhood first
 const getSuggestedBinLocation = async (req, res) => {
     try {
-
+        const filter = req.query.name ? { 'attributes.name': req.query.name } : {};
+        const bins = await SuggestedBin.find(filter).sort({ 'attributes.name': 1, 'attributes.rank': 1 });
+        res.status(200).json(bins);
     } catch (error) {
         res.status(500).json({ error: "Internal Server Error : getSuggestedBinLocation" });
     }
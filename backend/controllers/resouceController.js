@@ -12,6 +12,12 @@ import {
 } from "../constants/enums.js";
 import updateSaturationAndGenerateShapefile from "../saturation_update/update_saturation.js";
 import updateOptimalRoutes from "../saturation_update/update_chemin_optimal.js";
+import updatePointSaturation from "../saturation_update/update_point_saturation.js";
+
+// Saturation of the neighborhoods a changed collecting point belongs to, updated in the background
+function refreshPointSaturation(id) {
+    updatePointSaturation([id]).catch(error => console.error("Error updating saturation:", error));
+}
 
 // Controller functions for handling requests related to roads, collecting points, and neighborhoods
 //get all roads, collecting points, and neighborhoods
@@ -191,6 +197,7 @@ const addCollectingPoint = async (req, res) => {
         // Save to DB
         const collectingPoint = new CollectingPoint(collectingPointData);
         await collectingPoint.save();
+        refreshPointSaturation(collectingPoint._id);
 
         res.status(201).json(collectingPoint);
     } catch (error) {
@@ -271,6 +278,7 @@ const deleteCollectingPoint = async (req, res) => {
         if (!collectingPoint) {
             return res.status(404).json({ message: "Collecting point not found" });
         }
+        refreshPointSaturation(collectingPoint._id);
         res.status(200).json({ message: "Collecting point deleted successfully" });
     } catch (error) {
         console.error(error);
@@ -381,6 +389,9 @@ const updateCollectingPoint = async (req, res) => {
         if (!collectingPoint) {
             return res.status(404).json({ message: "Collecting point not found" });
         }
+        if (updateFields["attributes.route"] !== undefined || updateFields["geometry.x"] !== undefined) {
+            refreshPointSaturation(collectingPoint._id);
+        }
 
         res.status(200).json(collectingPoint);
     } catch (error) {
@@ -0,0 +1,22 @@
+import mongoose from 'mongoose';
+
+// Written by saturation_update/suggest_bins.py
+const AttributesSchema = new mongoose.Schema({
+    name: String,
+    gap_km2: Number,
+    gap_share: Number
+});
+
+const LowDensityAreaSchema = new mongoose.Schema({
+    attributes: AttributesSchema,
+    geometry: {
+        rings: {
+            type: [[[Number]]], // 3D array to store polygon coordinates
+            required: true
+        }
+    }
+});
+
+const LowDensityArea = mongoose.model('LowDensityArea', LowDensityAreaSchema);
+
+export default LowDensityArea;
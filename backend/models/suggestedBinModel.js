@@ -0,0 +1,21 @@
+import mongoose from 'mongoose';
+
+// Written by saturation_update/suggest_bins.py
+const AttributesSchema = new mongoose.Schema({
+    name: String,
+    rank: Number,
+    route: Number,
+    gain_km2: Number
+});
+
+const SuggestedBinSchema = new mongoose.Schema({
+    attributes: AttributesSchema,
+    geometry: {
+        x: Number,
+        y: Number
+    }
+});
+
+const SuggestedBin = mongoose.model('SuggestedBin', SuggestedBinSchema);
+
+export default SuggestedBin;
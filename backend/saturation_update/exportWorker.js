@@ -0,0 +1,53 @@
+import { exec } from 'child_process';
+
+// Local worker started with `python saturation_update/export_worker.py`
+const EXPORT_WORKER_URL = process.env.EXPORT_WORKER_URL || 'http://127.0.0.1:5001';
+
+// Run a one-off Python process (cold start) when the worker is not running
+function runCommand(command) {
+    return new Promise((resolve, reject) => {
+        exec(command, (error, stdout, stderr) => {
+            if (error) {
+                console.error(`Error executing Python script: ${error.message}`);
+                return reject(error);
+            }
+            if (stderr) {
+                console.error(`Python script stderr: ${stderr}`);
+            }
+            console.log(`Python script output: ${stdout}`);
+            resolve();
+        });
+    });
+}
+
+// One-off processes run one after the other, as the jobs of the worker do: two
+// saturation syncs at once would count the same point twice
+let commandQueue = Promise.resolve();
+
+function enqueueCommand(command) {
+    const job = commandQueue.then(() => runCommand(command));
+    commandQueue = job.catch(() => {});
+    return job;
+}
+
+// Run an export job (saturation, points or roads) on the warm worker, falling back to command
+export async function runExportJob(kind, options, command) {
+    try {
+        const response = await fetch(`${EXPORT_WORKER_URL}/jobs/${kind}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(options),
+        });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(`Export worker: ${result.error}`);
+        }
+        console.log(`Export worker: ${kind} done in ${result.seconds.toFixed(3)}s`);
+        return;
+    } catch (error) {
+        if (error.cause?.code !== 'ECONNREFUSED') {
+            throw error;
+        }
+    }
+    await enqueueCommand(command);
+}
@@ -0,0 +1,178 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from geoprocessing.formats import write_layer_chunks
+from geoprocessing.instrumentation import iterate, span
+
+# Number of documents pulled from MongoDB and written to disk per chunk
+BATCH_SIZE = 5000
+
+# (column in the shapefile, attribute in MongoDB, default value, dtype); integer
+# attributes are nullable "Int64" so that they stay Integer fields with missing values
+POINT_COLUMNS = [
+    ("id", "id", "unknown", "object"),
+    ("amenity", "amenity", "unknown", "object"),
+    ("route", "route", None, "Int64"),
+    ("dsatur", "dsatur", None, "float64"),
+    ("esatur", "esatur", None, "object"),
+    ("estime", "estime", False, "bool"),  # Include the "ideal" flag
+]
+
+ROAD_COLUMNS = [
+    ("FID", "FID", None, "Int64"),
+    ("osm_id", "osm_id", None, "Int64"),
+    ("code", "code", None, "Int64"),
+    ("fclass", "fclass", None, "object"),
+    ("name", "name", None, "object"),
+    ("ref", "ref", None, "object"),
+    ("oneway", "oneway", None, "object"),
+    ("maxspeed", "maxspeed", None, "Int64"),
+    ("layer", "layer", None, "Int64"),
+    ("bridge", "bridge", None, "object"),
+    ("tunnel", "tunnel", None, "object"),
+    ("Cartier", "Cartier", None, "object"),
+    ("chemin_opt", "chemin_optimal", False, "bool"),
+]
+
+
+def attribute_projection(columns, geometry_fields):
+    """
+    Server-side projection returning only the needed attributes and geometry fields.
+    """
+    projection = {f"attributes.{attribute}": 1 for _, attribute, _, _ in columns}
+    projection.update(geometry_fields)
+    return projection
+
+
+def attribute_columns(docs, columns):
+    """
+    Convert the attributes of a batch of documents into one preallocated array per column,
+    of the column's dtype when every value fits it.
+    """
+    data = {}
+    for column, attribute, default, dtype in columns:
+        values = np.empty(len(docs), dtype=object)
+        for i, doc in enumerate(docs):
+            # The default only stands in for a missing attribute: a stored None stays None
+            values[i] = doc["attributes"].get(attribute, default)
+        if dtype != "object":
+            try:
+                if dtype == "bool" and pd.isna(values).any():
+                    # astype would turn a stored None into False
+                    raise ValueError("bool cannot hold a missing value")
+                converted = pd.Series(values).astype(dtype)
+            except (TypeError, ValueError):
+                # Some documents hold another type (e.g. a string): keep the values
+                # as stored, as a GeoDataFrame built from the documents would
+                print(f"Keeping {column} as stored: not all values are {dtype}")
+            else:
+                values = converted.array if isinstance(converted.dtype, pd.api.extensions.ExtensionDtype) \
+                    else converted.to_numpy()
+        data[column] = values
+    return data
+
+
+def _batches(cursor, batch_size):
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def point_query(query=None):
+    """
+    Query selecting the collecting points that belong in the exported layer.
+    """
+    # Validate geometry and attributes on the server
+    query = dict(query or {})
+    query.update({
+        "geometry.x": {"$exists": True},
+        "geometry.y": {"$exists": True},
+        "attributes": {"$exists": True},
+    })
+    return query
+
+
+def road_query(query=None):
+    """
+    Query selecting the roads that have at least one path.
+    """
+    query = dict(query or {})
+    query["geometry.paths.0"] = {"$exists": True}
+    return query
+
+
+def point_chunks(collection, batch_size=BATCH_SIZE, query=None):
+    """
+    Stream collecting points from MongoDB as GeoDataFrame chunks indexed by document _id.
+    """
+    query = point_query(query)
+    projection = attribute_projection(POINT_COLUMNS, {"geometry.x": 1, "geometry.y": 1})
+    cursor = collection.find(query, projection, batch_size=batch_size)
+
+    for docs in iterate("mongo_fetch", _batches(cursor, batch_size)):
+        with span("build_points", rows=len(docs)):
+            xy = np.empty((len(docs), 2), dtype="float64")
+            for i, doc in enumerate(docs):
+                xy[i, 0] = doc["geometry"]["x"]
+                xy[i, 1] = doc["geometry"]["y"]
+
+            data = attribute_columns(docs, POINT_COLUMNS)
+            index = pd.Index([str(doc["_id"]) for doc in docs], name="_id")
+            chunk = gpd.GeoDataFrame(data, geometry=shapely.points(xy), index=index, crs="EPSG:4326")
+        yield chunk
+
+
+def road_chunks(collection, batch_size=BATCH_SIZE, query=None):
+    """
+    Stream roads from MongoDB as GeoDataFrame chunks indexed by document _id,
+    using the first path of each road.
+    """
+    query = road_query(query)
+    projection = attribute_projection(ROAD_COLUMNS, {"geometry.paths": 1})
+    cursor = collection.find(query, projection, batch_size=batch_size)
+
+    for docs in iterate("mongo_fetch", _batches(cursor, batch_size)):
+        valid = []
+        for doc in docs:
+            paths = doc.get("geometry", {}).get("paths")
+            if isinstance(paths, list) and paths and len(paths[0]) >= 2 and "attributes" in doc:
+                valid.append(doc)
+            else:
+                print(f"Skipping road with invalid paths: {doc.get('_id')}")
+        if not valid:
+            continue
+
+        with span("build_lines", rows=len(valid)):
+            # Concatenate every path into one coordinate array with a line index
+            counts = np.fromiter((len(doc["geometry"]["paths"][0]) for doc in valid), dtype="int64", count=len(valid))
+            coords = np.empty((counts.sum(), 2), dtype="float64")
+            offset = 0
+            for doc, count in zip(valid, counts):
+                coords[offset:offset + count] = np.asarray(doc["geometry"]["paths"][0], dtype="float64")[:, :2]
+                offset += count
+            line_index = np.repeat(np.arange(len(valid)), counts)
+
+            data = attribute_columns(valid, ROAD_COLUMNS)
+            geometry = shapely.linestrings(coords, indices=line_index)
+            index = pd.Index([str(doc["_id"]) for doc in valid], name="_id")
+            chunk = gpd.GeoDataFrame(data, geometry=geometry, index=index, crs="EPSG:4326")
+        yield chunk
+
+
+def write_chunks(chunks, output_path, fmt="shapefile", append=False, on_chunk=None):
+    """
+    Write GeoDataFrame chunks to a single layer, appending after the first one.
+    Returns the number of features written (no chunk leaves any existing file untouched).
+    on_chunk is called with every chunk once it is on disk.
+    """
+    return write_layer_chunks(chunks, output_path, fmt, append=append, on_chunk=on_chunk)
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from saturation_job import MONGODB_URI, get_client, refresh_saturation
+from write_shapefile import create_collecting_points_shapefile
+from write_shapefile_roads import create_optimal_route_shapefile
+from route_job import refresh_optimal_route
+from incremental_saturation import sync_points
+from suggest_bins import refresh_coverage_gaps
+from geoprocessing.formats import FORMATS
+
+# Local address the backend posts export jobs to
+HOST = "127.0.0.1"
+PORT = int(os.environ.get("EXPORT_WORKER_PORT", 5001))
+
+# Job kinds and what they run on the database
+JOBS = {
+    "saturation": lambda db, options: refresh_saturation(db, **options),
+    "points": lambda db, options: create_collecting_points_shapefile(db, **options),
+    "roads": lambda db, options: create_optimal_route_shapefile(db, **options),
+    "route": lambda db, options: refresh_optimal_route(db, **options),
+    "point_saturation": lambda db, options: sync_points(db, **options),
+    "gaps": lambda db, options: refresh_coverage_gaps(db),
+}
+
+
+class Job:
+    def __init__(self, kind, options):
+        self.kind = kind
+        self.options = options
+        self.done = threading.Event()
+        self.error = None
+        self.seconds = None
+        self.requests = 1
+
+
+class JobQueue:
+    """
+    Runs the export jobs one at a time on a single thread.
+
+    A job asked for while an identical one (same kind and options) is still waiting
+    is merged into it: both callers get the result of one run. A job that has already
+    started is not reused, since the data may have changed after it read it.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, kind, options):
+        key = (kind, json.dumps(options, sort_keys=True))
+        with self.condition:
+            job = self.pending.get(key)
+            if job is not None:
+                job.requests += 1
+            else:
+                job = self.pending[key] = Job(kind, options)
+                self.condition.notify()
+        return job
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                _, job = self.pending.popitem(last=False)
+
+            start = time.perf_counter()
+            try:
+                JOBS[job.kind](self.db, job.options)
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+            job.seconds = time.perf_counter() - start
+            print(f"{job.kind} {job.options}: {job.seconds:.3f}s for {job.requests} request(s)"
+                  + (f", failed: {job.error}" if job.error else ""))
+            job.done.set()
+
+
+def make_handler(queue):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                return self._reply(200, {"status": "ok"})
+            self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            # POST /jobs/<kind> with {"incremental": bool, "fmt": "shapefile"} (point_saturation
+            # also takes "points": the ids of the points that changed); answers once done
+            kind = self.path.rstrip("/").split("/")[-1]
+            if not self.path.startswith("/jobs/") or kind not in JOBS:
+                return self._reply(404, {"error": f"unknown job: {self.path}"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                options = {"incremental": bool(body.get("incremental", False)),
+                           "fmt": body.get("fmt", "shapefile")}
+                if options["fmt"] not in FORMATS:
+                    raise ValueError(f"unknown format: {options['fmt']}")
+                if kind == "point_saturation":
+                    if not isinstance(body.get("points"), list):
+                        raise ValueError("point_saturation needs the list of changed points")
+                    options["points"] = [str(point) for point in body["points"]]
+            except ValueError as e:
+                return self._reply(400, {"error": str(e)})
+
+            job = queue.submit(kind, options)
+            job.done.wait()
+            if job.error:
+                return self._reply(500, {"error": job.error})
+            self._reply(200, {"job": kind, "seconds": job.seconds, "coalesced": job.requests})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the MongoDB exporters warm and run their jobs on request.")
+    parser.add_argument("--uri", default=MONGODB_URI, help="MongoDB connection URI")
+    parser.add_argument("--port", type=int, default=PORT, help="local port to listen on")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    server = ThreadingHTTPServer((HOST, args.port), make_handler(JobQueue(client.get_default_database("sig"))))
+    print(f"Export worker listening on http://{HOST}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        client.close()
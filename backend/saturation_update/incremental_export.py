@@ -0,0 +1,350 @@
+import os
+import json
+import hashlib
+import math
+import numpy as np
+import pandas as pd
+import shapely
+from bson import ObjectId, json_util
+from pymongo.errors import OperationFailure
+from export_pipeline import (
+    BATCH_SIZE, POINT_COLUMNS, ROAD_COLUMNS,
+    attribute_columns, point_chunks, point_query, road_chunks, road_query, write_chunks,
+)
+
+def _point_coordinates(doc):
+    return np.array([[doc["geometry"]["x"], doc["geometry"]["y"]]], dtype="float64")
+
+
+def _road_coordinates(doc):
+    # First path, as road_chunks exports it; None for a road it skips
+    paths = doc.get("geometry", {}).get("paths")
+    if not (isinstance(paths, list) and paths and len(paths[0]) >= 2):
+        return None
+    return np.asarray(paths[0], dtype="float64")[:, :2]
+
+
+# What each exported layer contains: every exported attribute and the geometry are
+# fingerprinted, so that polling sees moved features as well as edited attributes
+LAYERS = {
+    "points": {
+        "chunks": point_chunks,
+        "query": point_query,
+        "filter": None,
+        "columns": POINT_COLUMNS,
+        "geometry": {"geometry.x": 1, "geometry.y": 1},
+        "coordinates": _point_coordinates,
+    },
+    "roads": {
+        "chunks": road_chunks,
+        "query": road_query,
+        "filter": {"attributes.chemin_optimal": True},
+        "columns": ROAD_COLUMNS,
+        "geometry": {"geometry.paths": 1},
+        "coordinates": _road_coordinates,
+    },
+}
+
+# Version of the fingerprints kept in the export state; older states get a full export
+STATE_VERSION = 2
+
+# Errors meaning "no change streams here": standalone mongod, or mongomock (no watch method)
+CHANGE_STREAM_UNAVAILABLE = (OperationFailure, NotImplementedError, TypeError)
+
+# Rewrite the whole layer once more than this share of its records are deleted
+MAX_DELETED_RATIO = 0.5
+
+
+class DbfFile:
+    """
+    Minimal in-place editor for the .dbf part of a shapefile.
+    """
+
+    def __init__(self, shapefile):
+        base = os.path.splitext(shapefile)[0]
+        self.encoding = "utf-8"
+        if os.path.exists(base + ".cpg"):
+            with open(base + ".cpg") as cpg:
+                self.encoding = cpg.read().strip() or self.encoding
+        self.file = open(base + ".dbf", "r+b")
+        header = self.file.read(32)
+        self.count = int.from_bytes(header[4:8], "little")
+        self.header_length = int.from_bytes(header[8:10], "little")
+        self.record_length = int.from_bytes(header[10:12], "little")
+
+        # Field descriptors: name, type, length, decimals; values start after the deletion flag
+        self.fields = {}
+        offset = 1
+        while True:
+            descriptor = self.file.read(32)
+            if descriptor[:1] == b"\r":
+                break
+            name = descriptor[:11].split(b"\0")[0].decode("ascii")
+            length, decimals = descriptor[16], descriptor[17]
+            self.fields[name] = (offset, chr(descriptor[11]), length, decimals)
+            offset += length
+
+    def _seek(self, record, offset=0):
+        self.file.seek(self.header_length + record * self.record_length + offset)
+
+    def delete(self, record):
+        self._seek(record)
+        self.file.write(b"*")
+
+    def set(self, record, field, value):
+        offset, kind, length, decimals = self.fields[field]
+        missing = value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value))
+        if kind in ("N", "F"):
+            if missing:
+                raw = b" " * length
+            elif decimals:
+                raw = f"{value:>{length}.{decimals}f}".encode("ascii")
+            else:
+                raw = f"{int(value):>{length}d}".encode("ascii")
+            if len(raw) > length:
+                raise ValueError(f"Value {value!r} does not fit in field {field}")
+        elif kind == "L":
+            raw = b"?" if missing else (b"T" if value else b"F")
+        else:
+            raw = b"" if missing else str(value).encode(self.encoding)[:length]
+            raw = raw.ljust(length, b" ")
+        self._seek(record, offset)
+        self.file.write(raw)
+
+    def close(self):
+        self.file.close()
+
+
+def _state_path(output_path):
+    return os.path.splitext(output_path)[0] + ".state.json"
+
+
+def _load_state(output_path):
+    path = _state_path(output_path)
+    if not os.path.exists(path) or not os.path.exists(output_path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    state["resume_token"] = json_util.loads(state["resume_token"]) if state["resume_token"] else None
+    return state
+
+
+def _save_state(output_path, state):
+    path = _state_path(output_path)
+    data = dict(state)
+    data["resume_token"] = json_util.dumps(state["resume_token"]) if state["resume_token"] else None
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def _plain(value):
+    # Same JSON for a value read from the documents and from an exported chunk
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def _fingerprints(ids, data, columns, coordinates):
+    # "<attributes hash>:<geometry hash>" of every document
+    values = [np.asarray(data[column], dtype=object) for column, _, _, _ in columns]
+    fingerprints = {}
+    for i, doc_id in enumerate(ids):
+        row = json.dumps([_plain(v[i]) for v in values], default=str)
+        fingerprints[doc_id] = f"{_digest(row.encode())}:{_digest(np.ascontiguousarray(coordinates[i]).tobytes())}"
+    return fingerprints
+
+
+def _chunk_fingerprints(chunk, spec):
+    # Fingerprints of an exported chunk, from its columns and geometries
+    coords, index = shapely.get_coordinates(chunk.geometry.values, return_index=True)
+    coordinates = np.split(coords, np.flatnonzero(np.diff(index)) + 1)
+    return _fingerprints(chunk.index, chunk, spec["columns"], coordinates)
+
+
+def _current_fingerprints(collection, spec, query=None):
+    # Fetch only _id, the exported attributes and the geometry of the documents in the layer
+    query = spec["query"](dict(spec["filter"] or {}, **(query or {})))
+    projection = {f"attributes.{attribute}": 1 for _, attribute, _, _ in spec["columns"]}
+    projection.update(spec["geometry"])
+    fingerprints, raw_ids, batch, coordinates = {}, {}, [], []
+
+    def flush():
+        ids = [str(doc["_id"]) for doc in batch]
+        raw_ids.update(zip(ids, (doc["_id"] for doc in batch)))
+        fingerprints.update(_fingerprints(ids, attribute_columns(batch, spec["columns"]), spec["columns"], coordinates))
+        batch.clear()
+        coordinates.clear()
+
+    for doc in collection.find(query, projection, batch_size=BATCH_SIZE):
+        # Documents the export skips are not part of the layer
+        xy = spec["coordinates"](doc) if "attributes" in doc else None
+        if xy is None:
+            continue
+        batch.append(doc)
+        coordinates.append(xy)
+        if len(batch) == BATCH_SIZE:
+            flush()
+    flush()
+    return fingerprints, raw_ids
+
+
+def _open_resume_token(collection):
+    """
+    Resume token marking "now" on the collection, or None on a standalone mongod.
+    """
+    try:
+        with collection.watch() as stream:
+            stream.try_next()
+            return stream.resume_token
+    except CHANGE_STREAM_UNAVAILABLE:
+        return None
+
+
+def _changes_since(collection, resume_token):
+    """
+    Ids touched since resume_token, ids whose geometry changed, and the new token.
+    Returns None when change streams are unavailable or the history is lost.
+    """
+    if resume_token is None:
+        return None
+    touched, moved = {}, set()
+    try:
+        with collection.watch(resume_after=resume_token) as stream:
+            while True:
+                change = stream.try_next()
+                if change is None:
+                    break
+                raw_id = change["documentKey"]["_id"]
+                touched[str(raw_id)] = raw_id
+                update = change.get("updateDescription", {})
+                fields = list(update.get("updatedFields", {})) + list(update.get("removedFields", []))
+                if change["operationType"] == "replace" or any(f.startswith("geometry") for f in fields):
+                    moved.add(str(raw_id))
+            return touched, moved, stream.resume_token
+    except CHANGE_STREAM_UNAVAILABLE:
+        return None
+
+
+def full_export(collection, layer, output_path, batch_size=BATCH_SIZE):
+    """
+    Rewrite the whole layer and record the state needed for the next incremental run.
+    """
+    spec = LAYERS[layer]
+    # Take the high-water mark first so that changes made during the export are replayed
+    resume_token = _open_resume_token(collection)
+    records, fingerprints = [], {}
+
+    def remember(chunk):
+        records.extend(chunk.index)
+        fingerprints.update(_chunk_fingerprints(chunk, spec))
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    chunks = spec["chunks"](collection, batch_size=batch_size, query=spec["filter"])
+    written = write_chunks(chunks, output_path, on_chunk=remember)
+    if written:
+        _save_state(output_path, {
+            "layer": layer, "version": STATE_VERSION, "resume_token": resume_token,
+            "records": records, "fingerprints": fingerprints,
+        })
+    return written
+
+
+def incremental_export(collection, layer, output_path, batch_size=BATCH_SIZE, on_patch=None):
+    """
+    Patch the exported layer with what changed since the previous run.
+
+    Changed attributes are rewritten in place in the .dbf, removed features are
+    flagged as deleted and new ones are appended; a feature whose geometry changed is
+    deleted and appended again. Changes are read from a change stream when available
+    and found otherwise by polling the fingerprints of every exported attribute and of
+    the geometry. Returns the number of features touched.
+
+    on_patch, if given, gets the _ids of every feature added, changed or removed once
+    the layer is patched; it is not called when the whole layer is rewritten instead.
+    """
+    spec = LAYERS[layer]
+    state = _load_state(output_path)
+    if state is None or state["layer"] != layer or state.get("version") != STATE_VERSION:
+        print("No previous export state, writing the full layer")
+        return full_export(collection, layer, output_path, batch_size)
+
+    previous = state["fingerprints"]
+    changes = _changes_since(collection, state["resume_token"])
+    if changes is None:
+        print("Change streams unavailable, polling the exported attributes and geometries")
+        current, raw_ids = _current_fingerprints(collection, spec)
+        candidates, moved, resume_token = set(previous) | set(current), set(), _open_resume_token(collection)
+    else:
+        touched, moved, resume_token = changes
+        current, raw_ids = _current_fingerprints(collection, spec, {"_id": {"$in": list(touched.values())}})
+        candidates = set(touched)
+        raw_ids = dict(touched, **raw_ids)
+
+    removed = {i for i in candidates if i in previous and i not in current}
+    added = {i for i in candidates if i in current and i not in previous}
+    changed = {i for i in candidates if i in previous and i in current and previous[i] != current[i]}
+    # A moved feature (its geometry hash differs) is replaced by a new record
+    moved |= {i for i in changed if previous[i].split(":")[1] != current[i].split(":")[1]}
+    moved &= set(previous) & set(current)
+    removed |= moved
+    added |= moved
+    changed -= moved
+
+    records = state["records"]
+    deleted = sum(1 for r in records if r is None) + len(removed)
+    if records and deleted > MAX_DELETED_RATIO * len(records):
+        print("Too many deleted records, rewriting the full layer")
+        return full_export(collection, layer, output_path, batch_size)
+
+    record_of = {doc_id: i for i, doc_id in enumerate(records) if doc_id is not None}
+    dbf = DbfFile(output_path)
+    try:
+        if dbf.count != len(records):
+            raise ValueError("Layer on disk does not match the export state")
+
+        for doc_id in removed:
+            dbf.delete(record_of[doc_id])
+            records[record_of[doc_id]] = None
+            previous.pop(doc_id)
+
+        if changed:
+            projection = {f"attributes.{attribute}": 1 for _, attribute, _, _ in spec["columns"]}
+            projection.update(spec["geometry"])
+            docs = list(collection.find({"_id": {"$in": [raw_ids[i] for i in changed]}}, projection))
+            ids = [str(doc["_id"]) for doc in docs]
+            data = attribute_columns(docs, spec["columns"])
+            for column, _, _, _ in spec["columns"]:
+                for doc_id, value in zip(ids, data[column]):
+                    dbf.set(record_of[doc_id], column, value)
+            previous.update(_fingerprints(ids, data, spec["columns"], [spec["coordinates"](doc) for doc in docs]))
+    except (ValueError, KeyError) as e:
+        dbf.close()
+        print(f"Cannot patch layer in place ({e}), rewriting the full layer")
+        return full_export(collection, layer, output_path, batch_size)
+    dbf.close()
+
+    def remember(chunk):
+        records.extend(chunk.index)
+        previous.update(_chunk_fingerprints(chunk, spec))
+
+    if added:
+        query = dict(spec["filter"] or {}, _id={"$in": [raw_ids[i] for i in added]})
+        write_chunks(spec["chunks"](collection, batch_size=batch_size, query=query),
+                     output_path, append=True, on_chunk=remember)
+
+    state.update(version=STATE_VERSION, resume_token=resume_token, records=records, fingerprints=previous)
+    _save_state(output_path, state)
+
+    if on_patch is not None:
+        # Removed features may only be known by their exported id
+        on_patch([raw_ids[i] if i in raw_ids else ObjectId(i) if ObjectId.is_valid(i) else i
+                  for i in removed | added | changed])
+
+    touched = len(removed) + len(added) + len(changed)
+    print(f"Incremental export: {len(changed)} updated, {len(added)} added, {len(removed)} removed")
+    return touched
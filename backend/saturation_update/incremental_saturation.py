@@ -0,0 +1,254 @@
+import sys
+import math
+import argparse
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from pymongo import DeleteMany, UpdateMany, UpdateOne
+from export_pipeline import point_query
+from saturation_job import (MONGODB_URI, NEIGHBORHOOD_COLUMNS, POINT_COLUMNS, ROAD_COLUMNS, assign_neighborhoods,
+                            compute_saturation, get_client, load_frame)
+from write_shapefile import create_collecting_points_shapefile
+from geoprocessing.formats import FORMATS
+from geoprocessing.instrumentation import span
+from geoprocessing.saturation import haversine_km, pairwise_haversine_sum, weighted_saturation
+
+# Running aggregates kept between runs: one document per quartier (_id: its name, count,
+# distance_sum: km between every unordered pair of its points) and one per point they
+# count (_id: the point's, quartier, x, y as counted)
+AGGREGATES = "saturationaggregates"
+MEMBERS = "saturationmembers"
+
+# Relative difference to a full recompute still accepted by verify_aggregates
+TOLERANCE = 1e-9
+
+
+def _document_id(value):
+    # Ids come as strings from the command line and the API
+    return ObjectId(value) if isinstance(value, str) and ObjectId.is_valid(value) else value
+
+
+def load_tables(db, point_ids=None):
+    """
+    The counted points (all of them, or those among point_ids) with their quartier,
+    and the neighborhoods indexed by name, as the full refresh sees them.
+    """
+    query = point_query({"_id": {"$in": list(point_ids)}} if point_ids is not None else None)
+    points = load_frame(db["collectingpoints"], POINT_COLUMNS, query=query, xy=True)
+    roads_query = {"attributes.FID": {"$in": points["route"].dropna().tolist()}} if point_ids is not None else None
+    roads = load_frame(db["roads"], ROAD_COLUMNS, query=roads_query)
+    neighborhoods = load_frame(db["neighborhoods"], NEIGHBORHOOD_COLUMNS)
+    return points, roads, neighborhoods
+
+
+def full_aggregates(points):
+    """
+    Count and sum of pairwise distances of every quartier, from the points of assign_neighborhoods.
+    """
+    groups = points.groupby("Cartier", sort=False)
+    return pd.DataFrame({
+        "count": groups.size(),
+        "distance_sum": pd.Series({name: pairwise_haversine_sum(g["x"].to_numpy(), g["y"].to_numpy())
+                                   for name, g in groups}, dtype="float64"),
+    })
+
+
+def rebuild_aggregates(db):
+    """
+    Recompute every aggregate from scratch and replace the stored ones.
+    """
+    with span("rebuild") as s:
+        points, roads, neighborhoods = load_tables(db)
+        points, _ = assign_neighborhoods(points, roads, neighborhoods)
+        aggregates = full_aggregates(points)
+        s.rows = len(points)
+
+    db[MEMBERS].delete_many({})
+    db[AGGREGATES].delete_many({})
+    if len(points):
+        db[MEMBERS].insert_many([
+            {"_id": _id, "quartier": quartier, "x": float(x), "y": float(y)}
+            for _id, quartier, x, y in zip(points["_id"], points["Cartier"], points["x"], points["y"])
+        ])
+        db[AGGREGATES].insert_many([
+            {"_id": name, "count": int(count), "distance_sum": float(distance_sum)}
+            for name, count, distance_sum in zip(aggregates.index, aggregates["count"], aggregates["distance_sum"])
+        ])
+    db[MEMBERS].create_index("quartier")
+    print(f"Saturation aggregates rebuilt: {len(aggregates)} quartiers, {len(points)} points")
+    return aggregates
+
+
+def _distance_to_members(db, quartier, x, y, exclude):
+    # Sum of the distances (km) from (x, y) to the other points counted in the quartier
+    members = [m for m in db[MEMBERS].find({"quartier": quartier}, {"x": 1, "y": 1}) if m["_id"] != exclude]
+    if not members:
+        return 0.0
+    xs = np.fromiter((m["x"] for m in members), dtype="float64", count=len(members))
+    ys = np.fromiter((m["y"] for m in members), dtype="float64", count=len(members))
+    return math.fsum(haversine_km(x, y, xs, ys))
+
+
+def _add(db, _id, quartier, x, y):
+    # An upsert: a point another sync counted in the meantime is moved, not counted twice
+    previous = db[MEMBERS].find_one_and_replace({"_id": _id}, {"quartier": quartier, "x": float(x), "y": float(y)},
+                                                upsert=True)
+    if previous is not None:
+        _uncount(db, previous)
+    distance = _distance_to_members(db, quartier, x, y, _id)
+    db[AGGREGATES].update_one({"_id": quartier}, {"$inc": {"count": 1, "distance_sum": distance}}, upsert=True)
+
+
+def _remove(db, member):
+    if db[MEMBERS].delete_one({"_id": member["_id"]}).deleted_count:
+        _uncount(db, member)
+
+
+def _uncount(db, member):
+    # Take a point no longer counted out of the aggregate of its quartier
+    distance = _distance_to_members(db, member["quartier"], member["x"], member["y"], member["_id"])
+    db[AGGREGATES].bulk_write([
+        UpdateOne({"_id": member["quartier"]}, {"$inc": {"count": -1, "distance_sum": -distance}}),
+        # A quartier down to one point has no pair left: drop the rounding left in the sum
+        UpdateOne({"_id": member["quartier"], "count": {"$lte": 1}}, {"$set": {"distance_sum": 0.0}}),
+        DeleteMany({"_id": member["quartier"], "count": {"$lte": 0}}),
+    ], ordered=True)
+
+
+def _aggregate_saturation(aggregates, neighborhoods):
+    # dsatur / esatur of every stored aggregate, as compute_saturation gives them
+    count = aggregates["count"].to_numpy(dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(count >= 2, 2 * aggregates["distance_sum"].to_numpy(dtype="float64") / (count * (count - 1)),
+                        np.inf)
+    ideal = neighborhoods.reindex(aggregates.index)
+    return weighted_saturation(ideal["ideal_pts"].to_numpy(), count, ideal["ideal_dist"].to_numpy(), mean)
+
+
+def refresh_quartiers(db, quartiers, neighborhoods):
+    """
+    dsatur / esatur of the given quartiers from their stored aggregates, set on every
+    point they count with one UpdateMany per quartier. Returns the points modified.
+    """
+    aggregates = pd.DataFrame(list(db[AGGREGATES].find({"_id": {"$in": list(quartiers)}})),
+                              columns=["_id", "count", "distance_sum"]).set_index("_id")
+    aggregates = aggregates[aggregates.index.isin(neighborhoods.index)]
+    if aggregates.empty:
+        return 0
+    dsatur, esatur = _aggregate_saturation(aggregates, neighborhoods)
+    requests = [
+        UpdateMany({"_id": {"$in": [m["_id"] for m in db[MEMBERS].find({"quartier": name}, {"_id": 1})]}},
+                   {"$set": {"attributes.dsatur": float(d), "attributes.esatur": str(e)}})
+        for name, d, e in zip(aggregates.index, dsatur, esatur)
+    ]
+    return db["collectingpoints"].bulk_write(requests, ordered=False).modified_count
+
+
+def sync_points(db, points, export=True, incremental=False, fmt="shapefile"):
+    """
+    Bring the aggregates up to date after the given collecting points were added, moved
+    (or given another road) or deleted, then recompute the saturation of the affected
+    quartiers only. Every point costs O(points of its quartier), whatever the total.
+    Builds the aggregates first if there are none yet, and then refreshes every quartier.
+    """
+    ids = [_document_id(point) for point in points]
+    # A rebuild already counts the points as they are now, but the points of its
+    # quartiers still hold the saturation of the last full refresh
+    affected = set()
+    if db[AGGREGATES].estimated_document_count() == 0 and db[MEMBERS].estimated_document_count() == 0:
+        affected.update(rebuild_aggregates(db).index)
+
+    with span("sync", rows=len(ids)):
+        current, roads, neighborhoods = load_tables(db, ids)
+        current, neighborhoods = assign_neighborhoods(current, roads, neighborhoods)
+        current = current.set_index("_id")
+        counted = {member["_id"]: member for member in db[MEMBERS].find({"_id": {"$in": ids}})}
+
+        for _id in dict.fromkeys(ids):
+            old = counted.get(_id)
+            new = current.loc[_id] if _id in current.index else None
+            if old is not None and new is not None and \
+                    (old["quartier"], old["x"], old["y"]) == (new["Cartier"], new["x"], new["y"]):
+                continue
+            if old is not None:
+                _remove(db, old)
+                affected.add(old["quartier"])
+            if new is not None:
+                _add(db, _id, new["Cartier"], new["x"], new["y"])
+                affected.add(new["Cartier"])
+
+    with span("write_back", rows=len(affected)):
+        modified = refresh_quartiers(db, affected, neighborhoods)
+    print(f"Saturation updated for {len(affected)} quartier(s): {modified} collecting points changed")
+
+    # The given points changed in MongoDB (moved, edited, deleted) even when no
+    # saturation did: the layer needs them either way
+    if export:
+        create_collecting_points_shapefile(db, incremental=incremental, fmt=fmt)
+    return affected
+
+
+def verify_aggregates(db, tolerance=TOLERANCE):
+    """
+    Compare the stored aggregates, and the saturation they give, with a full recompute.
+    Returns one row per quartier in either; ok is False where they disagree.
+    """
+    points, roads, neighborhoods = load_tables(db)
+    expected_saturation, _ = compute_saturation(points, roads, neighborhoods)
+    points, neighborhoods = assign_neighborhoods(points, roads, neighborhoods)
+    expected = full_aggregates(points)
+
+    stored = pd.DataFrame(list(db[AGGREGATES].find()), columns=["_id", "count", "distance_sum"]).set_index("_id")
+    report = stored.join(expected, how="outer", rsuffix="_expected")
+    report["dsatur"], _ = _aggregate_saturation(report[["count", "distance_sum"]].fillna(0), neighborhoods)
+    report["dsatur_expected"] = expected_saturation["dsatur"].reindex(report.index)
+
+    def close(a, b):
+        a, b = report[a].to_numpy(dtype="float64"), report[b].to_numpy(dtype="float64")
+        with np.errstate(invalid="ignore"):
+            return (np.abs(a - b) <= tolerance * np.maximum(1, np.abs(b))) | (a == b) | (np.isnan(a) & np.isnan(b))
+
+    report["ok"] = close("count", "count_expected") & close("distance_sum", "distance_sum_expected") \
+        & close("dsatur", "dsatur_expected")
+
+    # Every counted point must be a member, at its current quartier and place
+    members = pd.DataFrame(list(db[MEMBERS].find()), columns=["_id", "quartier", "x", "y"])
+    merged = members.merge(points[["_id", "Cartier", "x", "y"]], on="_id", how="outer", suffixes=("", "_expected"))
+    stale = merged[(merged["quartier"] != merged["Cartier"]) | (merged["x"] != merged["x_expected"])
+                   | (merged["y"] != merged["y_expected"])]
+    for quartier in set(stale["quartier"].dropna()) | set(stale["Cartier"].dropna()):
+        if quartier in report.index:
+            report.loc[quartier, "ok"] = False
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the saturation up to date point by point.")
+    parser.add_argument("--uri", default=MONGODB_URI, help="MongoDB connection URI")
+    parser.add_argument("--points", nargs="+", default=[],
+                        help="ids of the collecting points added, moved or deleted since the last update")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the stored aggregates from scratch")
+    parser.add_argument("--verify", action="store_true",
+                        help="check the stored aggregates against a full recompute (exit status 1 if they differ)")
+    parser.add_argument("--no-export", action="store_true", help="only update MongoDB, do not write the points layer")
+    parser.add_argument("--incremental", action="store_true",
+                        help="patch the existing shapefile with the points changed since the last export")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile", help="format of the points layer")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    try:
+        db = client.get_default_database("sig")
+        if args.rebuild:
+            rebuild_aggregates(db)
+        if args.points:
+            sync_points(db, args.points, export=not args.no_export, incremental=args.incremental, fmt=args.format)
+        if args.verify:
+            report = verify_aggregates(db)
+            print(report.to_string())
+            if not report["ok"].all():
+                print(f"{(~report['ok']).sum()} quartier(s) differ from a full recompute; run with --rebuild")
+                sys.exit(1)
+            print("Saturation aggregates match a full recompute")
+    finally:
+        client.close()
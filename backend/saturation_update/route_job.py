@@ -0,0 +1,108 @@
+import argparse
+import numpy as np
+import pandas as pd
+from pymongo import UpdateMany
+from export_pipeline import point_query, road_chunks, road_query
+from saturation_job import MONGODB_URI, get_client, load_frame
+from write_shapefile_roads import create_optimal_route_shapefile
+from geoprocessing.formats import FORMATS
+from geoprocessing.instrumentation import span
+from geoprocessing.road_graph import road_graph
+from geoprocessing.routing import plan_route
+
+# (column, attribute in MongoDB, default value, dtype), as in export_pipeline
+POINT_COLUMNS = [
+    ("route", "route", None, "Int64"),
+]
+
+ROAD_COLUMNS = [
+    ("FID", "FID", None, "Int64"),
+    ("Cartier", "Cartier", None, "object"),
+    ("chemin_optimal", "chemin_optimal", False, "bool"),
+]
+
+
+def load_roads(collection):
+    """
+    Roads with their _id, FID, Cartier and current chemin_optimal flag, and the
+    geometry of their first path (None for a road without a usable one).
+    """
+    roads = load_frame(collection, ROAD_COLUMNS, query=road_query())
+    chunks = list(road_chunks(collection))
+    geometry = pd.concat(chunks).geometry if chunks else pd.Series(dtype=object)
+    roads["geometry"] = geometry.reindex(roads["_id"].astype(str)).to_numpy()
+    return roads
+
+
+def write_optimal_route(collection, route_ids):
+    """
+    Set chemin_optimal on the roads of the route and clear it on all the others, in
+    one unordered bulk_write that only touches the roads whose flag changes.
+    Returns the number of roads modified.
+    """
+    route_ids = list(route_ids)
+    requests = [
+        UpdateMany({"_id": {"$in": route_ids}, "attributes.chemin_optimal": {"$ne": True}},
+                   {"$set": {"attributes.chemin_optimal": True}}),
+        UpdateMany({"_id": {"$nin": route_ids}, "attributes.chemin_optimal": {"$ne": False}},
+                   {"$set": {"attributes.chemin_optimal": False}}),
+    ]
+    return collection.bulk_write(requests, ordered=False).modified_count
+
+
+def refresh_optimal_route(db, by_quartier=False, export=True, incremental=False, fmt="shapefile"):
+    """
+    Plan the collection route through every collecting point along the roads, flag
+    its roads with chemin_optimal, then export the route layer over the same connection.
+
+    The roads of the route are those of every leg between two stops plus the roads
+    the collecting points are on. With by_quartier, the points of every quartier
+    (through their road's Cartier) get their own tour.
+    """
+    with span("load") as s:
+        points = load_frame(db["collectingpoints"], POINT_COLUMNS, query=point_query(), xy=True)
+        roads = load_roads(db["roads"])
+        s.rows = len(points) + len(roads)
+
+    with span("road_graph", rows=len(roads)):
+        graph = road_graph(roads["geometry"].to_numpy())
+
+    cartier = roads.drop_duplicates("FID").set_index("FID")["Cartier"]
+    groups = points["route"].map(cartier).to_numpy() if by_quartier else None
+    with span("plan", rows=len(points)):
+        route, lines = plan_route(graph, points["x"].to_numpy(), points["y"].to_numpy(), groups)
+
+    on_route = np.zeros(len(roads), dtype=bool)
+    on_route[lines] = True
+    on_route |= roads["FID"].isin(points["route"]).to_numpy()
+    reachable = route["leg_km"].replace(np.inf, np.nan)
+    print(f"Route through {len(route)} collecting points in {route['tour'].nunique()} tour(s): "
+          f"{reachable.sum():.2f} km along {on_route.sum()} roads")
+    if reachable.isna().any():
+        print(f"Warning: {reachable.isna().sum()} collecting points cannot be reached by road from the previous one")
+
+    with span("write_back", rows=int(on_route.sum())):
+        modified = write_optimal_route(db["roads"], roads["_id"].to_numpy()[on_route])
+    print(f"Optimal route updated: {modified} roads changed")
+
+    if export:
+        create_optimal_route_shapefile(db, incremental=incremental, fmt=fmt)
+    return route
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the collection route and flag its roads in MongoDB.")
+    parser.add_argument("--uri", default=MONGODB_URI, help="MongoDB connection URI")
+    parser.add_argument("--by-quartier", action="store_true", help="one tour per quartier instead of a single one")
+    parser.add_argument("--no-export", action="store_true", help="only update MongoDB, do not write the route layer")
+    parser.add_argument("--incremental", action="store_true",
+                        help="patch the existing shapefile with the roads changed since the last export")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile", help="format of the route layer")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    try:
+        refresh_optimal_route(client.get_default_database("sig"), by_quartier=args.by_quartier,
+                              export=not args.no_export, incremental=args.incremental, fmt=args.format)
+    finally:
+        client.close()
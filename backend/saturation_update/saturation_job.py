@@ -0,0 +1,177 @@
+import argparse
+import functools
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient, UpdateOne
+from export_pipeline import BATCH_SIZE, _batches, attribute_columns, attribute_projection, point_query
+from write_shapefile import create_collecting_points_shapefile
+from geoprocessing.formats import FORMATS
+from geoprocessing.instrumentation import iterate, span
+from geoprocessing.saturation import average_distance_by_group, weighted_saturation
+
+# MongoDB connection URI
+MONGODB_URI = "mongodb://localhost:27017/sig"
+
+# Connections kept open by the pool, and updates sent per bulk_write
+MAX_POOL_SIZE = 20
+WRITE_BATCH_SIZE = 1000
+
+# (column, attribute in MongoDB, default value, dtype), as in export_pipeline
+POINT_COLUMNS = [
+    ("route", "route", None, "Int64"),
+    ("dsatur", "dsatur", None, "float64"),
+    ("esatur", "esatur", None, "object"),
+]
+
+ROAD_COLUMNS = [
+    ("FID", "FID", None, "Int64"),
+    ("Cartier", "Cartier", None, "object"),
+]
+
+NEIGHBORHOOD_COLUMNS = [
+    ("name", "name", None, "object"),
+    ("ideal_pts", "ideal_pts", 0, "float64"),
+    ("ideal_dist", "ideal_dist", 0, "float64"),
+]
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(uri=MONGODB_URI):
+    """
+    One MongoClient, and so one connection pool, per URI for the whole process.
+    """
+    return MongoClient(uri, maxPoolSize=MAX_POOL_SIZE)
+
+
+def load_frame(collection, columns, query=None, xy=False, batch_size=BATCH_SIZE):
+    """
+    Only the given attributes of a collection (plus _id, and geometry x/y if xy), as a DataFrame.
+    """
+    geometry_fields = {"geometry.x": 1, "geometry.y": 1} if xy else {}
+    cursor = collection.find(query or {}, attribute_projection(columns, geometry_fields), batch_size=batch_size)
+
+    frames = []
+    for docs in iterate("mongo_fetch", _batches(cursor, batch_size), collection=collection.name):
+        data = {"_id": np.array([doc["_id"] for doc in docs], dtype=object)}
+        if xy:
+            data["x"] = np.fromiter((doc["geometry"]["x"] for doc in docs), dtype="float64", count=len(docs))
+            data["y"] = np.fromiter((doc["geometry"]["y"] for doc in docs), dtype="float64", count=len(docs))
+        data.update(attribute_columns(docs, columns))
+        frames.append(pd.DataFrame(data))
+
+    if not frames:
+        names = ["_id"] + (["x", "y"] if xy else []) + [column for column, _, _, _ in columns]
+        return pd.DataFrame(columns=names)
+    return pd.concat(frames, ignore_index=True)
+
+
+def assign_neighborhoods(points, roads, neighborhoods):
+    """
+    The points that count for the saturation, with the quartier of each in "Cartier",
+    and the neighborhoods indexed by name.
+    """
+    # Quartier of every point through its road (the first road with that FID)
+    cartier = roads.drop_duplicates("FID").set_index("FID")["Cartier"]
+    points = points.assign(Cartier=points["route"].map(cartier))
+
+    # A neighborhood defined twice keeps its last definition
+    neighborhoods = neighborhoods.drop_duplicates("name", keep="last").set_index("name")
+    return points[points["Cartier"].isin(neighborhoods.index)], neighborhoods
+
+
+def compute_saturation(points, roads, neighborhoods):
+    """
+    Saturation of every neighborhood that has collecting points, and the new dsatur/esatur
+    of those points. points needs route, x and y; roads FID and Cartier; neighborhoods
+    name, ideal_pts and ideal_dist. Returns (per neighborhood, per point) DataFrames.
+    """
+    points, neighborhoods = assign_neighborhoods(points, roads, neighborhoods)
+
+    # Counts and mean great-circle distance (km) of every quartier in one groupby pass
+    actual_pts = points.groupby("Cartier", sort=False).size()
+    actual_dist = average_distance_by_group(points, "Cartier", "x", "y", mode="haversine")
+    ideal = neighborhoods.loc[actual_pts.index]
+    dsatur, esatur = weighted_saturation(
+        ideal["ideal_pts"].to_numpy(), actual_pts.to_numpy(),
+        ideal["ideal_dist"].to_numpy(), actual_dist[actual_pts.index].to_numpy(),
+    )
+
+    quartiers = pd.DataFrame({
+        "ideal_pts": ideal["ideal_pts"].to_numpy(),
+        "actual_pts": actual_pts.to_numpy(),
+        "ideal_dist": ideal["ideal_dist"].to_numpy(),
+        "actual_dist": actual_dist[actual_pts.index].to_numpy(),
+        "dsatur": dsatur,
+        "esatur": esatur,
+    }, index=actual_pts.index)
+
+    updates = pd.DataFrame({
+        "_id": points["_id"].to_numpy(),
+        "Cartier": points["Cartier"].to_numpy(),
+        "dsatur": quartiers["dsatur"].reindex(points["Cartier"]).to_numpy(),
+        "esatur": quartiers["esatur"].reindex(points["Cartier"]).to_numpy(),
+    }, index=points.index)
+    return quartiers, updates
+
+
+def write_saturation(collection, updates, batch_size=WRITE_BATCH_SIZE):
+    """
+    Set dsatur/esatur with unordered bulk_write batches of UpdateOne.
+    Returns the number of documents modified.
+    """
+    requests = (
+        UpdateOne({"_id": _id}, {"$set": {"attributes.dsatur": float(dsatur), "attributes.esatur": esatur}})
+        for _id, dsatur, esatur in zip(updates["_id"], updates["dsatur"], updates["esatur"])
+    )
+    modified = 0
+    for batch in _batches(requests, batch_size):
+        modified += collection.bulk_write(batch, ordered=False).modified_count
+    return modified
+
+
+def refresh_saturation(db, export=True, incremental=False, fmt="shapefile"):
+    """
+    Recompute the saturation of every collecting point, write back the values that
+    changed, then export the points layer over the same connection.
+    """
+    with span("load") as s:
+        points = load_frame(db["collectingpoints"], POINT_COLUMNS, query=point_query(), xy=True)
+        roads = load_frame(db["roads"], ROAD_COLUMNS)
+        neighborhoods = load_frame(db["neighborhoods"], NEIGHBORHOOD_COLUMNS)
+        s.rows = len(points) + len(roads) + len(neighborhoods)
+
+    with span("compute", rows=len(points)):
+        quartiers, updates = compute_saturation(points, roads, neighborhoods)
+    for name in neighborhoods["name"].drop_duplicates():
+        if name not in quartiers.index:
+            print(f"No points found for neighborhood: {name}")
+    print(quartiers.to_string())
+
+    # Only the points whose values changed are sent (NaN == NaN here)
+    current = points.loc[updates.index]
+    same_dsatur = (current["dsatur"] == updates["dsatur"]) | (current["dsatur"].isna() & updates["dsatur"].isna())
+    changed = updates[~(same_dsatur & (current["esatur"] == updates["esatur"]))]
+    with span("write_back", rows=len(changed)):
+        modified = write_saturation(db["collectingpoints"], changed)
+    print(f"Saturation refreshed: {modified} of {len(updates)} collecting points updated")
+
+    if export:
+        create_collecting_points_shapefile(db, incremental=incremental, fmt=fmt)
+    return quartiers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the saturation of the collecting points in MongoDB.")
+    parser.add_argument("--uri", default=MONGODB_URI, help="MongoDB connection URI")
+    parser.add_argument("--no-export", action="store_true", help="only update MongoDB, do not write the points layer")
+    parser.add_argument("--incremental", action="store_true",
+                        help="patch the existing shapefile with the points changed since the last export")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile", help="format of the points layer")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    try:
+        refresh_saturation(client.get_default_database("sig"), export=not args.no_export,
+                           incremental=args.incremental, fmt=args.format)
+    finally:
+        client.close()
@@ -0,0 +1,119 @@
+import os
+import argparse
+import pandas as pd
+import geopandas as gpd
+import shapely
+from export_pipeline import road_chunks
+from saturation_job import MONGODB_URI, NEIGHBORHOOD_COLUMNS, get_client, load_frame
+from geoprocessing.coverage import coverage_gaps
+from geoprocessing.formats import write_layer
+
+# Collections the analysis API reads the precomputed results from
+SUGGESTED_BINS = "suggestedbins"
+LOW_DENSITY_AREAS = "lowdensityareas"
+
+
+def _polygon(rings):
+    """
+    (Multi)Polygon of ESRI-style rings, in any order: a ring inside an odd number of the
+    others is a hole of the smallest ring around it, every other ring an exterior.
+    """
+    shells = [shapely.Polygon(ring) for ring in rings if len(ring) >= 3]
+    inside = [[j for j, other in enumerate(shells) if j != i and other.area > shell.area
+               and other.contains(shell.representative_point())] for i, shell in enumerate(shells)]
+    outer = [i for i in range(len(shells)) if len(inside[i]) % 2 == 0]
+    holes = {i: [] for i in outer}
+    for i in range(len(shells)):
+        if i not in holes:
+            parent = min((j for j in inside[i] if j in holes), key=lambda j: shells[j].area)
+            holes[parent].append(shells[i].exterior)
+    parts = [shapely.Polygon(shells[i].exterior, holes[i]) for i in outer]
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else shapely.MultiPolygon(parts)
+
+
+def load_neighborhoods(collection):
+    """
+    Neighborhoods with their ideal values, rings turned into (multi)polygons.
+    """
+    frame = load_frame(collection, NEIGHBORHOOD_COLUMNS)
+    rings = {doc["_id"]: doc.get("geometry", {}).get("rings") or []
+             for doc in collection.find({}, {"geometry.rings": 1})}
+    polygons = [_polygon(rings[_id]) for _id in frame["_id"]]
+    gdf = gpd.GeoDataFrame(frame, geometry=polygons, crs="EPSG:4326")
+    return gdf[gdf.geometry.notna() & (gdf["ideal_dist"] > 0)]
+
+
+def load_points(collection):
+    frame = load_frame(collection, [], query={"geometry.x": {"$exists": True}, "geometry.y": {"$exists": True}}, xy=True)
+    return gpd.GeoDataFrame(frame, geometry=shapely.points(frame["x"], frame["y"]), crs="EPSG:4326")
+
+
+def load_roads(collection):
+    # Indexed by FID, the id collecting points use in their "route" attribute
+    chunks = list(road_chunks(collection))
+    if not chunks:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    return pd.concat(chunks).set_index("FID")
+
+
+def _rings(geometry):
+    # ESRI-style rings: every exterior and interior ring of every polygon part
+    return [shapely.get_coordinates(ring).tolist()
+            for part in shapely.get_parts(geometry)
+            for ring in shapely.get_rings(part)]
+
+
+def write_results(db, low_density, bins):
+    """
+    Replace the stored analysis results with the new ones.
+    """
+    db[LOW_DENSITY_AREAS].delete_many({})
+    if len(low_density):
+        db[LOW_DENSITY_AREAS].insert_many([
+            {"attributes": {"name": row.name, "gap_km2": float(row.gap_km2), "gap_share": float(row.gap_share)},
+             "geometry": {"rings": _rings(row.geometry)}}
+            for row in low_density.itertuples()
+        ])
+    db[SUGGESTED_BINS].delete_many({})
+    if len(bins):
+        db[SUGGESTED_BINS].insert_many([
+            {"attributes": {"name": row.name, "rank": int(row.rank),
+                            "route": None if pd.isna(row.route) else float(row.route),
+                            "gain_km2": float(row.gain_km2)},
+             "geometry": {"x": float(row.longitude), "y": float(row.latitude)}}
+            for row in bins.itertuples()
+        ])
+
+
+def refresh_coverage_gaps(db, output_dir=None):
+    """
+    Compute the low density areas and suggested bin locations of every neighborhood
+    in one batch and store them in MongoDB, or as GeoParquet files in output_dir.
+    """
+    low_density, bins = coverage_gaps(
+        load_neighborhoods(db["neighborhoods"]), load_points(db["collectingpoints"]), load_roads(db["roads"])
+    )
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        write_layer(low_density, os.path.join(output_dir, "low_density_areas.parquet"), "geoparquet")
+        write_layer(bins, os.path.join(output_dir, "suggested_bins.parquet"), "geoparquet")
+    else:
+        write_results(db, low_density, bins)
+    print(f"{len(low_density)} low density areas, {len(bins)} suggested bin locations")
+    return low_density, bins
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find coverage gaps and suggest new collecting point locations.")
+    parser.add_argument("--uri", default=MONGODB_URI, help="MongoDB connection URI")
+    parser.add_argument("--output", default=None,
+                        help="directory to write GeoParquet files to instead of storing the results in MongoDB")
+    args = parser.parse_args()
+
+    client = get_client(args.uri)
+    try:
+        refresh_coverage_gaps(client.get_default_database("sig"), output_dir=args.output)
+    finally:
+        client.close()
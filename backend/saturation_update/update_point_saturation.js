@@ -0,0 +1,14 @@
+import { runExportJob } from './exportWorker.js';
+
+// incremental_saturation.py keeps the point count and the sum of pairwise distances of
+// every neighborhood in MongoDB: a point added, moved or deleted only updates its own
+// neighborhood(s), in O(points of the neighborhood), and their points' saturation.
+const POINT_SATURATION_JOB = 'python saturation_update/incremental_saturation.py --incremental --points';
+
+// Update the saturation after the given collecting points (ids) changed
+async function updatePointSaturation(ids) {
+    const points = ids.map(id => id.toString());
+    await runExportJob('point_saturation', { incremental: true, points }, `${POINT_SATURATION_JOB} ${points.join(' ')}`);
+}
+
+export default updatePointSaturation;
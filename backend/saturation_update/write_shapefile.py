@@ -1,48 +1,82 @@
 import os
-import geopandas as gpd
+import argparse
+import pandas as pd
 from pymongo import MongoClient
-from shapely.geometry import Point
+from export_pipeline import point_chunks, write_chunks
+from incremental_export import incremental_export
+from geoprocessing.formats import FORMATS, with_format
+from geoprocessing.instrumentation import span
+from geoprocessing.pyramid import patch_pyramid, write_pyramid
 
 # MongoDB connection URI
 MONGODB_URI = "mongodb://localhost:27017/sig"
 
-# Connect to MongoDB
-client = MongoClient(MONGODB_URI)
-db = client["sig"]
-collecting_points = db["collectingpoints"]
-
-# Fetch updated points from MongoDB
-points = list(collecting_points.find())
-
-# Convert points to GeoDataFrame
-data = []
-for point in points:
-    # Validate geometry and attributes
-    if "geometry" in point and "x" in point["geometry"] and "y" in point["geometry"]:
-        if "attributes" in point:
-            data.append({
-                "id": point["attributes"].get("id", "unknown"),
-                "amenity": point["attributes"].get("amenity", "unknown"),
-                "route": point["attributes"].get("route", None),
-                "dsatur": point["attributes"].get("dsatur", None),
-                "esatur": point["attributes"].get("esatur", None),
-                "estime": point["attributes"].get("estime", False),  # Include the "ideal" flag
-                "geometry": Point(point["geometry"]["x"], point["geometry"]["y"])
-            })
-
-# Check if there are valid points
-if not data:
-    print("No valid points found in the database.")
-    exit()
-
-# Create GeoDataFrame
-gdf = gpd.GeoDataFrame(data, crs="EPSG:4326")  # Set CRS to WGS84 (EPSG:4326)
-
-# Ensure the output directory exists
+# Output directory
 output_dir = "../region files/shape"
-os.makedirs(output_dir, exist_ok=True)
-
-# Write to ESRI Shapefile
 output_path = os.path.join(output_dir, "collecting points babz.shp")
-gdf.to_file(output_path, driver="ESRI Shapefile")
-print(f"Shapefile saved to {output_path}")
\ No newline at end of file
+
+# Tile pyramid the map loads the points from
+TILES_DIR = "../region files/tiles/points"
+TILE_PROPERTIES = ["id", "amenity", "dsatur", "esatur"]
+
+def write_point_tiles(collection, tiles_dir=TILES_DIR, ids=None):
+    # Given the ids of the points an incremental export patched, only those are read
+    # and only their tiles rewritten; otherwise (or without a pyramid yet) every point is
+    with span("tiles") as s:
+        if ids is not None:
+            chunks = list(point_chunks(collection, query={"_id": {"$in": list(ids)}})) if ids else []
+            written = patch_pyramid(pd.concat(chunks) if chunks else None, [str(i) for i in ids],
+                                    tiles_dir, TILE_PROPERTIES)
+            if written is not None:
+                s.rows = len(ids)
+                print(f"{written} point tiles written to {tiles_dir}")
+                return written
+        chunks = list(point_chunks(collection))
+        if not chunks:
+            return 0
+        points = pd.concat(chunks)
+        written = write_pyramid(points, tiles_dir, TILE_PROPERTIES)
+        s.rows = len(points)
+    print(f"{written} point tiles written to {tiles_dir}")
+    return written
+
+def create_collecting_points_shapefile(db, output_path=output_path, incremental=False, fmt="shapefile", tiles=True):
+    with span("export_points", fmt=fmt, incremental=incremental) as s:
+        patched = []
+        if incremental and fmt == "shapefile":
+            # Only patch the points whose saturation changed since the last export
+            written = incremental_export(db["collectingpoints"], "points", output_path, on_patch=patched.append)
+        else:
+            # Stream points from MongoDB and write them chunk by chunk
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            written = write_chunks(point_chunks(db["collectingpoints"]), with_format(output_path, fmt), fmt)
+
+        if tiles:
+            # The tiles follow the points the export patched, or are all rewritten with it
+            write_point_tiles(db["collectingpoints"], ids=patched[0] if patched else None)
+        s.rows = written
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export collecting points from MongoDB to a shapefile.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="patch the existing shapefile with the points changed since the last export")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile",
+                        help="output format (incremental export is only available for shapefiles)")
+    parser.add_argument("--no-tiles", action="store_true", help="do not update the map tile pyramid")
+    args = parser.parse_args()
+
+    # Connect to MongoDB
+    client = MongoClient(MONGODB_URI)
+    try:
+        written = create_collecting_points_shapefile(client["sig"], incremental=args.incremental, fmt=args.format,
+                                                     tiles=not args.no_tiles)
+    finally:
+        client.close()
+
+    # Check if there are valid points
+    if not written and not args.incremental:
+        print("No valid points found in the database.")
+        exit()
+
+    print(f"Shapefile saved to {with_format(output_path, args.format)}")
@@ -1,89 +1,96 @@
 import os
 import pymongo
-import geopandas as gpd
-from shapely.geometry import LineString
 import sys
-
-# Connect to MongoDB
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["sig"]
-roads_collection = db["roads"]
+import argparse
+import pandas as pd
+from export_pipeline import road_chunks, write_chunks
+from incremental_export import incremental_export
+from geoprocessing.formats import FORMATS, with_format
+from geoprocessing.instrumentation import span
+from geoprocessing.pyramid import patch_pyramid, write_pyramid
 
 # Output directory
 output_dir = "../region files/shape"
-os.makedirs(output_dir, exist_ok=True)
 
 # Generate timestamp for unique filename
 output_shapefile = os.path.join(output_dir, f"chemin_optimal_babz.shp")
 
-def create_optimal_route_shapefile():
+# Tile pyramid of the whole network, with the optimal route flagged
+TILES_DIR = "../region files/tiles/roads"
+TILE_PROPERTIES = ["FID", "fclass", "name", "chemin_opt"]
+
+def write_road_tiles(collection, tiles_dir=TILES_DIR, ids=None):
+    # Given the ids of the roads an incremental export patched (their chemin_optimal
+    # flag changed), only those are read and their tiles rewritten; otherwise every road is
+    with span("tiles") as s:
+        if ids is not None:
+            chunks = list(road_chunks(collection, query={"_id": {"$in": list(ids)}})) if ids else []
+            written = patch_pyramid(pd.concat(chunks) if chunks else None, [str(i) for i in ids],
+                                    tiles_dir, TILE_PROPERTIES)
+            if written is not None:
+                s.rows = len(ids)
+                print(f"{written} road tiles written to {tiles_dir}")
+                return written
+        chunks = list(road_chunks(collection))
+        if not chunks:
+            return 0
+        roads = pd.concat(chunks)
+        written = write_pyramid(roads, tiles_dir, TILE_PROPERTIES)
+        s.rows = len(roads)
+    print(f"{written} road tiles written to {tiles_dir}")
+    return written
+
+def create_optimal_route_shapefile(db, output_shapefile=output_shapefile, incremental=False, fmt="shapefile", tiles=True):
+    with span("export_roads", fmt=fmt, incremental=incremental) as s:
+        patched = []
+        written = _write_optimal_route(db, output_shapefile, incremental, fmt, on_patch=patched.append)
+        if tiles:
+            # The tiles follow the roads the export patched, or are all rewritten with it
+            write_road_tiles(db["roads"], ids=patched[0] if patched else None)
+        s.rows = written
+    return written
+
+def _write_optimal_route(db, output_shapefile, incremental, fmt, on_patch=None):
+    if incremental and fmt == "shapefile":
+        # Only add or remove the roads whose chemin_optimal flag changed since the last export
+        print("Updating optimal route shapefile...")
+        return incremental_export(db["roads"], "roads", output_shapefile, on_patch=on_patch)
+
     print("Creating optimal route shapefile...")
-    
-    # Query roads with chemin_optimal = true
-    optimal_roads = list(roads_collection.find({"attributes.chemin_optimal": True}))
-    
-    if not optimal_roads:
-        print("No optimal roads found in database")
-        return
-    
-    # Create lists to store data for GeoDataFrame
-    geometries = []
-    attributes = []
-    
-    # Process each road
-    for road in optimal_roads:
-        try:
-            # Extract coordinates for LineString from paths
-            if "geometry" in road and "paths" in road["geometry"]:
-                paths = road["geometry"]["paths"]
-                if isinstance(paths, list) and len(paths) > 0:
-                    coords = paths[0]  # Use the first path
-                    line = LineString(coords)
-                    
-                    # Extract attributes
-                    road_attrs = {
-                        "FID": road["attributes"].get("FID", None),
-                        "osm_id": road["attributes"].get("osm_id", None),
-                        "code": road["attributes"].get("code", None),
-                        "fclass": road["attributes"].get("fclass", None),
-                        "name": road["attributes"].get("name", None),
-                        "ref": road["attributes"].get("ref", None),
-                        "oneway": road["attributes"].get("oneway", None),
-                        "maxspeed": road["attributes"].get("maxspeed", None),
-                        "layer": road["attributes"].get("layer", None),
-                        "bridge": road["attributes"].get("bridge", None),
-                        "tunnel": road["attributes"].get("tunnel", None),
-                        "Cartier": road["attributes"].get("Cartier", None),
-                        "chemin_opt": road["attributes"].get("chemin_optimal", False)
-                    }
-                    
-                    # Add to lists
-                    geometries.append(line)
-                    attributes.append(road_attrs)
-                else:
-                    print(f"Skipping road with invalid paths: {road.get('_id')}")
-            else:
-                print(f"Skipping road with missing geometry or paths: {road.get('_id')}")
-        
-        except Exception as e:
-            print(f"Error processing road {road.get('_id')}: {str(e)}")
-    
-    # Create GeoDataFrame
-    if geometries:
-        gdf = gpd.GeoDataFrame(attributes, geometry=geometries, crs="EPSG:4326")
-        
-        # Write to shapefile
-        gdf.to_file(output_shapefile)
+    os.makedirs(os.path.dirname(output_shapefile), exist_ok=True)
+
+    # Stream roads with chemin_optimal = true and write them chunk by chunk
+    chunks = road_chunks(db["roads"], query={"attributes.chemin_optimal": True})
+    if fmt != "shapefile":
+        # Only shapefiles need the field name cut to 10 characters
+        chunks = (chunk.rename(columns={"chemin_opt": "chemin_optimal"}) for chunk in chunks)
+    output_shapefile = with_format(output_shapefile, fmt)
+    written = write_chunks(chunks, output_shapefile, fmt)
+
+    if written:
         print(f"Optimal route shapefile created: {output_shapefile}")
-        print(f"Total roads in optimal route: {len(geometries)}")
+        print(f"Total roads in optimal route: {written}")
     else:
-        print("No valid road geometries found to create shapefile")
+        print("No optimal roads found in database")
+    return written
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the optimal route from MongoDB to a shapefile.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="patch the existing shapefile with the roads changed since the last export")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile",
+                        help="output format (incremental export is only available for shapefiles)")
+    parser.add_argument("--no-tiles", action="store_true", help="do not update the map tile pyramid")
+    args = parser.parse_args()
+
+    # Connect to MongoDB
+    client = pymongo.MongoClient("mongodb://localhost:27017/")
     try:
-        create_optimal_route_shapefile()
+        create_optimal_route_shapefile(client["sig"], incremental=args.incremental, fmt=args.format,
+                                       tiles=not args.no_tiles)
     except Exception as e:
         print(f"Error creating shapefile: {str(e)}")
         sys.exit(1)
     finally:
         # Close MongoDB connection
-        client.close()
\ No newline at end of file
+        client.close()
@@ -23,6 +23,9 @@ app.use(cors());
 app.use('/api/resources', resouceRoutes);
 app.use('/api/analysis', analysisRoutes);
 
+// Map tile pyramids written by the Python exporters
+app.use('/tiles', express.static('../region files/tiles'));
+
 
 app.listen(PORT, () => {
     console.log(`Server is running on port ${PORT}`);
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.wkt import loads
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.formats import FORMATS, read_layer, write_layer
+
+
+def synthetic_roads(n, seed=0):
+    """
+    Random short road segments around Bab Ezzouar.
+    """
+    rng = np.random.default_rng(seed)
+    start = np.column_stack([rng.uniform(3.16, 3.22, n), rng.uniform(36.70, 36.74, n)])
+    coords = np.stack([start, start + rng.normal(0, 0.001, (n, 2)), start + rng.normal(0, 0.002, (n, 2))], axis=1)
+    return gpd.GeoDataFrame({
+        "FID": np.arange(n),
+        "fclass": rng.choice(["residential", "primary", "service"], n),
+        "name": [f"Rue {i}" for i in range(n)],
+        "Cartier": rng.choice([f"Cite {i}" for i in range(40)], n),
+    }, geometry=shapely.linestrings(coords), crs="EPSG:4326")
+
+
+def _size(path):
+    # A shapefile is spread over several sidecar files
+    if path.endswith(FORMATS["shapefile"]):
+        base = os.path.splitext(path)[0]
+        return sum(os.path.getsize(base + ext) for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg")
+                   if os.path.exists(base + ext))
+    return os.path.getsize(path)
+
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def run(n, workdir):
+    gdf = synthetic_roads(n)
+    bbox = (3.18, 36.71, 3.19, 36.72)
+    results = []
+
+    # Today's interchange: WKT in a CSV, re-parsed row by row
+    csv_path = os.path.join(workdir, "roads.csv")
+    write_time, _ = _timed(lambda: gdf.to_csv(csv_path, index=False))
+
+    def read_csv():
+        frame = pd.read_csv(csv_path)
+        frame["geometry"] = frame["geometry"].apply(loads)
+        return gpd.GeoDataFrame(frame, geometry="geometry", crs="EPSG:4326")
+
+    read_time, _ = _timed(read_csv)
+    bbox_time, subset = _timed(lambda: read_csv().cx[bbox[0]:bbox[2], bbox[1]:bbox[3]])
+    results.append({"format": "csv (wkt)", "write_s": write_time, "read_s": read_time,
+                    "bbox_read_s": bbox_time, "bbox_rows": len(subset), "size_bytes": os.path.getsize(csv_path)})
+
+    for fmt, extension in FORMATS.items():
+        path = os.path.join(workdir, "roads" + extension)
+        write_time, _ = _timed(lambda: write_layer(gdf, path, fmt))
+        read_time, _ = _timed(lambda: read_layer(path))
+        bbox_time, subset = _timed(lambda: read_layer(path, bbox=bbox))
+        results.append({"format": fmt, "write_s": write_time, "read_s": read_time,
+                        "bbox_read_s": bbox_time, "bbox_rows": len(subset), "size_bytes": _size(path)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare write/read time and size of the output formats.")
+    parser.add_argument("--rows", type=int, default=100_000, help="number of synthetic roads")
+    parser.add_argument("--output", help="optional JSON file for the results")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_formats_")
+    try:
+        results = run(args.rows, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": args.rows, "results": results}, f, indent=2)
@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import shapely
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "backend", "saturation_update"))
+from synthetic_city import synthetic_city
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCRIPTS_DIR = os.path.join(ROOT, "shape to csv")
+DEFAULT_SCALES = [1_000, 10_000, 100_000]
+
+# Database the exporter benchmarks fill on a real mongod (never the application one)
+BENCH_DATABASE = "sig_bench"
+
+# A benchmark slower than its baseline by more than this factor is reported as a regression
+TOLERANCE = 1.2
+
+# Collecting points the route benchmark plans a tour through, whatever the scale
+ROUTE_STOPS = 500
+
+# What-if scenarios the scenario benchmark evaluates, and changes (added / removed points) in each
+SCENARIOS = 1_000
+SCENARIO_CHANGES = 5
+
+
+def load_script(name):
+    # The scripts live in a directory with a space and have no package
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(SCRIPTS_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _point_docs(points):
+    rng = np.random.default_rng(0)
+    dsatur = rng.uniform(0, 100, len(points))
+    return [
+        {"attributes": {"id": f"p{i}", "amenity": amenity, "route": float(route), "dsatur": float(d),
+                        "esatur": "T" if d > 50 else "F", "estime": False},
+         "geometry": {"x": float(x), "y": float(y)}}
+        for i, amenity, route, d, x, y in zip(points["id"], points["amenity"], points["route"], dsatur,
+                                               points["longitude"], points["latitude"])
+    ]
+
+
+def _road_docs(routes):
+    coords, line = shapely.get_coordinates(routes.geometry.values, return_index=True)
+    paths = np.split(coords, np.flatnonzero(np.diff(line)) + 1)
+    return [
+        {"attributes": {"FID": int(fid), "osm_id": int(osm_id), "fclass": fclass, "name": name,
+                        "Cartier": cartier, "chemin_optimal": bool(fid % 3 == 0)},
+         "geometry": {"paths": [path.tolist()]}}
+        for fid, osm_id, fclass, name, cartier, path in zip(routes["id"], routes["osm_id"], routes["fclass"],
+                                                            routes["name"], routes["Cartier"], paths)
+    ]
+
+
+def _database(uri, quartiers, routes, points):
+    if uri:
+        from pymongo import MongoClient
+
+        db = MongoClient(uri)[BENCH_DATABASE]
+    else:
+        import mongomock
+
+        db = mongomock.MongoClient()[BENCH_DATABASE]
+    db["collectingpoints"].drop()
+    db["roads"].drop()
+    db["collectingpoints"].insert_many(_point_docs(points))
+    db["roads"].insert_many(_road_docs(routes))
+    return db
+
+
+# Every benchmark: setup(city, options) -> (timed function, number of items it handles, cleanup)
+
+def setup_average_distance(city, options):
+    quartiers, routes, points = city
+    saturation = load_script("update_saturation")
+    merged = points.merge(routes[["id", "Cartier"]], how="left", left_on="route", right_on="id")
+    groups = [group for _, group in merged[merged["Cartier"] != " "].groupby("Cartier")]
+
+    def run():
+        return [saturation.calculate_actual_average_distance(group, options["mode"]) for group in groups]
+    return run, len(points), None
+
+
+def setup_assign_quartiers(city, options):
+    quartiers, routes, _ = city
+    relate = load_script("relate_routes_quartiers")
+    return lambda: relate.assign_quartiers(routes, quartiers), len(routes), None
+
+
+def setup_ideal_points(city, options):
+    quartiers = city[0].copy()
+    ideal = load_script("update_ideal_distance-number_pointspy")
+    return lambda: ideal.compute_ideal_points(quartiers), len(quartiers), None
+
+
+def setup_saturation(city, options):
+    quartiers, routes, points = city
+    saturation = load_script("update_saturation")
+    ideal = load_script("update_ideal_distance-number_pointspy").compute_ideal_points(quartiers.copy())
+    quartiers = pd.DataFrame(ideal.drop(columns="geometry"))
+    routes = pd.DataFrame(routes.drop(columns="geometry"))
+    return lambda: saturation.compute_saturation(points, routes, quartiers, options["mode"]), len(points), None
+
+
+def setup_route_plan(city, options):
+    from geoprocessing.road_graph import build_road_graph
+    from geoprocessing.routing import plan_route
+
+    _, routes, points = city
+    graph = build_road_graph(routes.geometry.values)
+    stops = points.sample(min(ROUTE_STOPS, len(points)), random_state=options["seed"])
+    x, y = stops["longitude"].to_numpy(), stops["latitude"].to_numpy()
+    return lambda: plan_route(graph, x, y), len(stops), None
+
+
+def setup_scenarios(city, options):
+    from geoprocessing.scenarios import ScenarioBase, evaluate_scenarios
+
+    quartiers, routes, points = city
+    ideal = load_script("update_ideal_distance-number_pointspy").compute_ideal_points(quartiers.copy())
+    points = points.assign(Cartier=points["route"].map(routes.drop_duplicates("id").set_index("id")["Cartier"]))
+    base = ScenarioBase(points, pd.DataFrame(ideal.drop(columns="geometry")))
+
+    # Every scenario removes and adds points at random, added points next to existing ones
+    rng = np.random.default_rng(options["seed"])
+    n = SCENARIOS * SCENARIO_CHANGES
+    near = points.iloc[rng.integers(0, len(points), n)]
+    remove = rng.random(n) < 0.5
+    changes = pd.DataFrame({
+        "scenario": np.repeat(np.arange(SCENARIOS), SCENARIO_CHANGES),
+        "action": np.where(remove, "remove", "add"),
+        "id": np.where(remove, points["id"].to_numpy()[rng.integers(0, len(points), n)], None),
+        "longitude": near["longitude"].to_numpy() + rng.normal(0, 1e-3, n),
+        "latitude": near["latitude"].to_numpy() + rng.normal(0, 1e-3, n),
+        "Cartier": near["Cartier"].to_numpy(),
+    })
+    return lambda: evaluate_scenarios(base, changes, workers=1), SCENARIOS, None
+
+
+def setup_export_points(city, options):
+    from write_shapefile import create_collecting_points_shapefile
+
+    db = _database(options["uri"], *city)
+    workdir = tempfile.mkdtemp(prefix="bench_points_")
+    output = os.path.join(workdir, "collecting points.shp")
+    run = lambda: create_collecting_points_shapefile(db, output_path=output, tiles=False)
+    return run, len(city[2]), lambda: (shutil.rmtree(workdir), db.client.drop_database(BENCH_DATABASE))
+
+
+def setup_export_roads(city, options):
+    from write_shapefile_roads import create_optimal_route_shapefile
+
+    db = _database(options["uri"], *city)
+    workdir = tempfile.mkdtemp(prefix="bench_roads_")
+    output = os.path.join(workdir, "chemin_optimal.shp")
+    run = lambda: create_optimal_route_shapefile(db, output_shapefile=output, tiles=False)
+    return run, len(city[1]), lambda: (shutil.rmtree(workdir), db.client.drop_database(BENCH_DATABASE))
+
+
+BENCHMARKS = {
+    "average_distance": setup_average_distance,
+    "assign_quartiers": setup_assign_quartiers,
+    "ideal_points": setup_ideal_points,
+    "saturation": setup_saturation,
+    "route_plan": setup_route_plan,
+    "scenarios": setup_scenarios,
+    "export_points": setup_export_points,
+    "export_roads": setup_export_roads,
+}
+
+
+def run_case(name, n_points, options):
+    """
+    Run one benchmark at one scale and return its measurements. Meant to run in a
+    fresh process, so that the peak RSS belongs to this case alone.
+    """
+    city = synthetic_city(n_points, seed=options["seed"])
+    run, items, cleanup = BENCHMARKS[name](city, options)
+    setup_rss = _peak_rss_mb()
+    try:
+        times = []
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    finally:
+        if cleanup:
+            cleanup()
+    wall = min(times)
+    return {
+        "benchmark": name, "points": n_points, "items": items, "wall_s": wall,
+        "throughput_per_s": items / wall if wall > 0 else None,
+        "setup_rss_mb": setup_rss, "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Wall time of every result against the baseline run; returns the regressions.
+    """
+    before = {(r["benchmark"], r["points"]): r for r in baseline["results"]}
+    rows, regressions = [], []
+    for r in results:
+        old = before.get((r["benchmark"], r["points"]))
+        if old is None:
+            continue
+        ratio = r["wall_s"] / old["wall_s"] if old["wall_s"] else float("inf")
+        rows.append({"benchmark": r["benchmark"], "points": r["points"], "baseline_s": old["wall_s"],
+                     "wall_s": r["wall_s"], "ratio": ratio})
+        if ratio > tolerance:
+            regressions.append(rows[-1])
+    if rows:
+        print(f"\nAgainst {baseline.get('version')}:")
+        print(pd.DataFrame(rows).to_string(index=False))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the GIS pipeline on synthetic cities of growing size.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="numbers of collecting points of the generated cities")
+    parser.add_argument("--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                        help="benchmarks to run (default: all)")
+    parser.add_argument("--mode", default="pairwise", help="distance mode of the saturation benchmarks")
+    parser.add_argument("--uri", default=None,
+                        help=f"MongoDB URI of a local mongod for the exporters (default: mongomock); "
+                             f"uses the {BENCH_DATABASE} database")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest one is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic cities")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="slowdown factor reported as a regression by --compare")
+    args = parser.parse_args()
+
+    options = {"mode": args.mode, "uri": args.uri, "repeat": args.repeat, "seed": args.seed}
+    results = []
+    for n_points in args.scales:
+        for name in args.benchmarks:
+            # A new process per case: peak RSS is per process and only ever grows
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results.append(pool.submit(run_case, name, n_points, options).result())
+            r = results[-1]
+            print(f"{name:<18} {n_points:>9} points: {r['wall_s']:.3f}s, {r['peak_rss_mb'] or 0:.0f} MB peak")
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+    report = {
+        "version": _version(), "python": platform.python_version(), "machine": platform.machine(),
+        "cpus": os.cpu_count(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "options": options,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance}x")
+            sys.exit(1)
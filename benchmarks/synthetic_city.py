@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Centre of the generated city (Bab Ezzouar) and kilometres per degree around it
+CENTER = (3.185, 36.725)
+KM_PER_DEGREE_LAT = 111.32
+KM_PER_DEGREE_LON = KM_PER_DEGREE_LAT * np.cos(np.radians(CENTER[1]))
+
+# Densities kept constant whatever the scale, so only the size of the city grows
+POINTS_PER_KM2 = 40
+POINTS_PER_QUARTIER = 250
+ROADS_PER_POINT = 1
+ROAD_LENGTH_KM = 0.15
+
+FCLASSES = ["residential", "service", "secondary", "primary", "footway"]
+AMENITIES = ["waste_basket", "waste_disposal", "recycling"]
+
+
+def city_box(n_points):
+    """
+    (west, south, east, north) of a square city holding n_points at POINTS_PER_KM2.
+    """
+    half_km = (n_points / POINTS_PER_KM2) ** 0.5 / 2
+    dx, dy = half_km / KM_PER_DEGREE_LON, half_km / KM_PER_DEGREE_LAT
+    return CENTER[0] - dx, CENTER[1] - dy, CENTER[0] + dx, CENTER[1] + dy
+
+
+def synthetic_quartiers(n_quartiers, box, rng):
+    """
+    Voronoi quartiers of random seeds, clipped to the city, with the columns of
+    quartiers_bab_ezzouar.csv before the ideal values are computed.
+    """
+    west, south, east, north = box
+    seeds = shapely.multipoints(np.column_stack([rng.uniform(west, east, n_quartiers),
+                                                 rng.uniform(south, north, n_quartiers)]))
+    bounds = shapely.box(*box)
+    cells = shapely.intersection(shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=bounds)), bounds)
+    centroids = shapely.centroid(cells)
+    return gpd.GeoDataFrame({
+        "name": [f"Cite {i}" for i in range(len(cells))],
+        "superficie": shapely.area(cells) * KM_PER_DEGREE_LON * KM_PER_DEGREE_LAT,
+        "population": rng.integers(2_000, 20_000, len(cells)),
+        "longitude": shapely.get_x(centroids),
+        "latitude": shapely.get_y(centroids),
+    }, geometry=cells, crs="EPSG:4326")
+
+
+def synthetic_routes(n_roads, box, quartiers, rng):
+    """
+    Short two-segment roads with the columns of routes_bab_ezzouar.csv; Cartier is
+    the quartier holding their first vertex.
+    """
+    west, south, east, north = box
+    start = np.column_stack([rng.uniform(west, east, n_roads), rng.uniform(south, north, n_roads)])
+    step = ROAD_LENGTH_KM / 2 / np.array([KM_PER_DEGREE_LON, KM_PER_DEGREE_LAT])
+    middle = start + rng.normal(0, 1, (n_roads, 2)) * step
+    end = middle + rng.normal(0, 1, (n_roads, 2)) * step
+    lines = shapely.linestrings(np.stack([start, middle, end], axis=1))
+
+    cartier = np.full(n_roads, " ", dtype=object)
+    road_idx, quartier_idx = shapely.STRtree(quartiers.geometry.values).query(
+        shapely.points(start), predicate="within"
+    )
+    cartier[road_idx] = quartiers["name"].to_numpy()[quartier_idx]
+    return gpd.GeoDataFrame({
+        "id": np.arange(n_roads),
+        "osm_id": np.arange(n_roads) + 1_000_000,
+        "fclass": rng.choice(FCLASSES, n_roads),
+        "name": [f"Rue {i}" for i in range(n_roads)],
+        "Cartier": cartier,
+    }, geometry=lines, crs="EPSG:4326")
+
+
+def synthetic_points(n_points, routes, rng):
+    """
+    Collecting points placed along random roads, with the columns of point_ramassage.csv.
+    """
+    route = rng.integers(0, len(routes), n_points)
+    positions = shapely.line_interpolate_point(routes.geometry.values[route], rng.uniform(0, 1, n_points),
+                                               normalized=True)
+    return pd.DataFrame({
+        "id": np.arange(n_points),
+        "longitude": shapely.get_x(positions),
+        "latitude": shapely.get_y(positions),
+        "amenity": rng.choice(AMENITIES, n_points),
+        "route": routes["id"].to_numpy()[route],
+    })
+
+
+def synthetic_city(n_points, seed=0):
+    """
+    Deterministic (quartiers, routes, points) of a city holding n_points collecting
+    points, at the densities above. The same n_points and seed give the same city.
+    """
+    rng = np.random.default_rng(seed)
+    box = city_box(n_points)
+    quartiers = synthetic_quartiers(max(4, n_points // POINTS_PER_QUARTIER), box, rng)
+    routes = synthetic_routes(max(1, n_points * ROADS_PER_POINT), box, quartiers, rng)
+    points = synthetic_points(n_points, routes, rng)
+    return quartiers, routes, points
@@ -0,0 +1,4 @@
+"""
+Shared geoprocessing helpers used by the "shape to csv" preprocessing scripts
+and the Python exporters in backend/saturation_update.
+"""
@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Cache entries live next to the file they were built from
+CACHE_DIR_NAME = ".geocache"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    sha256 of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _manifest_path(path, options):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+    key = hashlib.sha256(json.dumps([os.path.basename(path), options]).encode()).hexdigest()[:16]
+    return cache_dir, os.path.join(cache_dir, key + ".json")
+
+
+def source_digest(path, manifest=None):
+    """
+    Content hash of path; only recomputed when its size or mtime moved since manifest.
+    """
+    stat = os.stat(path)
+    if manifest and manifest["size"] == stat.st_size and manifest["mtime_ns"] == stat.st_mtime_ns:
+        return manifest["sha256"], stat
+    return file_digest(path), stat
+
+
+def _read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_frame(frame, path):
+    """
+    Write a (Geo)DataFrame to an uncompressed Arrow IPC file that can be memory-mapped,
+    with the geometries stored as WKB.
+    """
+    import pyarrow as pa
+
+    geometry = frame.geometry.name if isinstance(frame, gpd.GeoDataFrame) else None
+    attributes = pd.DataFrame(frame.drop(columns=[geometry])) if geometry else pd.DataFrame(frame)
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    if geometry:
+        wkb = shapely.to_wkb(np.asarray(frame[geometry]))
+        table = table.add_column(list(frame.columns).index(geometry), geometry, pa.array(wkb, type=pa.binary()))
+        metadata[b"geometry"] = geometry.encode()
+        if frame.crs is not None:
+            metadata[b"crs"] = frame.crs.to_string().encode()
+    table = table.replace_schema_metadata(metadata)
+
+    with pa.OSFile(path + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+
+def read_frame(path):
+    """
+    Read a file written by write_frame back into a (Geo)DataFrame.
+    """
+    import pyarrow as pa
+
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    metadata = table.schema.metadata or {}
+    geometry = metadata.get(b"geometry", b"").decode()
+    if not geometry:
+        return table.to_pandas()
+
+    columns = table.column_names
+    frame = table.drop_columns([geometry]).to_pandas()
+    frame[geometry] = shapely.from_wkb(table.column(geometry).to_numpy(zero_copy_only=False))
+    crs = metadata.get(b"crs", b"").decode() or None
+    return gpd.GeoDataFrame(frame[columns], geometry=geometry, crs=crs)
+
+
+def _store(frame, path, options, digest, stat):
+    cache_dir, manifest_path = _manifest_path(path, options)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    entry = os.path.join(cache_dir, f"{digest[:16]}-{os.path.basename(manifest_path)[:-5]}.arrow")
+    write_frame(frame, entry)
+
+    previous = _read_manifest(manifest_path)
+    manifest = {
+        "source": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest, "entry": os.path.basename(entry),
+    }
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # Drop the entry built from an older version of the file
+    if previous and previous["entry"] != manifest["entry"]:
+        stale = os.path.join(cache_dir, previous["entry"])
+        if os.path.exists(stale):
+            os.remove(stale)
+
+
+def _parse_csv(path, geometry, crs):
+    frame = pd.read_csv(path)
+    if not geometry:
+        return frame
+    frame[geometry] = shapely.from_wkt(frame[geometry].to_numpy())
+    return gpd.GeoDataFrame(frame, geometry=geometry, crs=crs)
+
+
+def load_csv(path, geometry="geometry", crs="EPSG:4326"):
+    """
+    Load a CSV with a WKT geometry column as a GeoDataFrame (or a plain DataFrame
+    when geometry is None), through the on-disk cache.
+
+    The cache is keyed by the file's content hash and is rebuilt automatically
+    when the CSV changes. Without pyarrow the CSV is simply parsed every time.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return _parse_csv(path, geometry, crs)
+
+    options = {"geometry": geometry, "crs": crs}
+    cache_dir, manifest_path = _manifest_path(path, options)
+    manifest = _read_manifest(manifest_path)
+    digest, stat = source_digest(path, manifest)
+
+    if manifest and manifest["sha256"] == digest and os.path.exists(os.path.join(cache_dir, manifest["entry"])):
+        if manifest["size"] != stat.st_size or manifest["mtime_ns"] != stat.st_mtime_ns:
+            # Same content, only touched: remember the new mtime
+            manifest.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f)
+        return read_frame(os.path.join(cache_dir, manifest["entry"]))
+
+    frame = _parse_csv(path, geometry, crs)
+    try:
+        _store(frame, path, options, digest, stat)
+    except (ValueError, TypeError) as e:
+        # Mixed-type columns that Arrow cannot store: just skip caching this file
+        print(f"Not caching {path}: {e}")
+    return frame
+
+
+def save_csv(frame, path):
+    """
+    Write frame to a CSV (geometry as WKT) and prime the cache with it, so that the
+    next stage reading this file does not have to parse the WKT again.
+    """
+    frame.to_csv(path, index=False)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return
+
+    # Same key as the load_csv call that would read this file back
+    if isinstance(frame, gpd.GeoDataFrame):
+        options = {"geometry": frame.geometry.name, "crs": frame.crs.to_string() if frame.crs else None}
+    else:
+        options = {"geometry": None, "crs": "EPSG:4326"}
+    digest, stat = source_digest(path)
+    try:
+        # Cache the file as read back, not frame: a parse of the CSV infers other dtypes
+        _store(_parse_csv(path, options["geometry"], options["crs"]), path, options, digest, stat)
+    except (ValueError, TypeError) as e:
+        print(f"Not caching {path}: {e}")
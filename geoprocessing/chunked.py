@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+
+# Rows read, processed and written at a time by the chunked stages
+CHUNK_ROWS = 100_000
+
+# Spill files a grouped column set is hashed into: memory stays at about 1/PARTITIONS of it
+PARTITIONS = 64
+
+
+def read_csv_chunks(path, columns=None, chunk_rows=CHUNK_ROWS, **options):
+    """
+    Stream a CSV as DataFrames of chunk_rows rows, reading only the given columns;
+    options go to pandas.read_csv.
+    """
+    with pd.read_csv(path, usecols=columns, chunksize=chunk_rows, **options) as reader:
+        yield from reader
+
+
+def lookup(path, key, value, chunk_rows=CHUNK_ROWS):
+    """
+    Small dimension index key -> value read from two columns of a CSV, chunk by chunk.
+    A key present several times keeps its first value (a left merge would instead
+    repeat the rows it is merged into once per duplicate).
+    """
+    parts = [chunk.drop_duplicates(key) for chunk in read_csv_chunks(path, [key, value], chunk_rows)]
+    if not parts:
+        return pd.Series(dtype=object)
+    index = pd.concat(parts).drop_duplicates(key)
+    return index.set_index(key)[value]
+
+
+class AtomicCsvWriter:
+    """
+    Appends DataFrame chunks to a temporary file next to path (path.<pid>.tmp, so that
+    two processes writing the same path do not share it); it only replaces path once
+    commit() is called, so a crash part-way leaves the previous file untouched.
+    """
+
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.columns = columns
+        self.tmp = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp, "w", newline="", encoding="utf-8")
+        self.rows = 0
+        self.header = False
+
+    def write(self, frame):
+        if self.columns is not None:
+            frame = frame[self.columns]
+        frame.to_csv(self.file, header=not self.header, index=False)
+        self.header = True
+        self.rows += len(frame)
+
+    def append_csv(self, path, rows):
+        """
+        Append a headerless CSV written by to_csv with the same columns, byte for byte.
+        """
+        if not self.header:
+            pd.DataFrame(columns=self.columns).to_csv(self.file, index=False)
+            self.header = True
+        with open(path, newline="", encoding="utf-8") as f:
+            shutil.copyfileobj(f, self.file)
+        self.rows += rows
+
+    def commit(self):
+        if not self.header and self.columns is not None:
+            # No rows at all: still a valid CSV with its header
+            pd.DataFrame(columns=self.columns).to_csv(self.file, index=False)
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+@contextlib.contextmanager
+def atomic_csv(path, columns=None):
+    """
+    AtomicCsvWriter committed when the block ends normally, discarded on an exception.
+    """
+    writer = AtomicCsvWriter(path, columns)
+    try:
+        yield writer
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit()
+
+
+class Partitions:
+    """
+    Numeric columns spilled to PARTITIONS temporary files by group code, so that every
+    group can later be processed whole while only one partition is in memory.
+    """
+
+    def __init__(self, columns, partitions=PARTITIONS, directory=None):
+        self.columns = list(columns)
+        self.partitions = partitions
+        self.directory = tempfile.mkdtemp(prefix="partitions_", dir=directory)
+        self.dtype = np.dtype([("group", "int64")] + [(column, "float64") for column in self.columns])
+
+    def _path(self, partition):
+        return os.path.join(self.directory, f"{partition}.bin")
+
+    def append(self, groups, frame):
+        records = np.empty(len(frame), dtype=self.dtype)
+        records["group"] = groups
+        for column in self.columns:
+            records[column] = frame[column].to_numpy(dtype="float64")
+        partition = records["group"] % self.partitions
+        for p in np.unique(partition):
+            with open(self._path(p), "ab") as f:
+                records[partition == p].tofile(f)
+
+    def __iter__(self):
+        # One DataFrame per non-empty partition, rows in the order they were appended
+        for p in range(self.partitions):
+            if os.path.exists(self._path(p)):
+                yield pd.DataFrame(np.fromfile(self._path(p), dtype=self.dtype))
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
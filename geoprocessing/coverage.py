@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# A collecting point serves the cells within ideal_dist * COVERAGE_RATIO of it: the
+# half-diagonal of the ideal_dist x ideal_dist square each point is meant to serve
+COVERAGE_RATIO = 0.5 * 2 ** 0.5
+
+# Demand grid: cells of a third of the coverage radius, at most MAX_CELLS per quartier
+CELLS_PER_RADIUS = 3
+MAX_CELLS = 20_000
+
+# A suggested bin must cover at least this share of its quartier that nobody reaches yet
+MIN_GAIN_SHARE = 0.02
+
+
+def _grid(quartiers, radius):
+    # Cell centres of every quartier in one batch, tagged with their quartier position
+    bounds = shapely.bounds(quartiers.geometry.values)
+    areas = quartiers.geometry.area.to_numpy()
+    steps = np.maximum(radius / CELLS_PER_RADIUS, np.sqrt(areas / MAX_CELLS))
+
+    owners, xs, ys = [], [], []
+    for i, ((xmin, ymin, xmax, ymax), step) in enumerate(zip(bounds, steps)):
+        if not np.isfinite(step) or step <= 0 or not np.isfinite(xmin):
+            continue
+        gx, gy = np.meshgrid(np.arange(xmin + step / 2, xmax, step), np.arange(ymin + step / 2, ymax, step))
+        owners.append(np.full(gx.size, i))
+        xs.append(gx.ravel())
+        ys.append(gy.ravel())
+    if not owners:
+        return np.empty(0, dtype="int64"), np.empty(0), np.empty(0), steps
+
+    owner, x, y = np.concatenate(owners), np.concatenate(xs), np.concatenate(ys)
+    inside = shapely.contains_xy(quartiers.geometry.values[owner], x, y)
+    return owner[inside], x[inside], y[inside], steps
+
+
+def _candidates(roads, quartiers, steps):
+    # Sites along the roads, one every grid step, with the road and quartier they belong to
+    parts, road_idx = shapely.get_parts(roads.geometry.values, return_index=True)
+    tree = shapely.STRtree(quartiers.geometry.values)
+    line_idx, quartier_idx = tree.query(parts, predicate="intersects")
+    usable = np.isfinite(steps[quartier_idx])
+    line_idx, quartier_idx = line_idx[usable], quartier_idx[usable]
+    pieces = shapely.intersection(parts[line_idx], quartiers.geometry.values[quartier_idx])
+    pieces = shapely.segmentize(pieces, steps[quartier_idx])
+    coords, piece = shapely.get_coordinates(pieces, return_index=True)
+    return coords[:, 0], coords[:, 1], quartier_idx[piece], road_idx[line_idx[piece]]
+
+
+def _ranges(starts, stops):
+    # Concatenation of np.arange(start, stop) for every pair, without a Python loop
+    lengths = stops - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+def _greedy(gain_pairs, n_candidates, n_cells, budget, min_gain=1):
+    """
+    Greedy max-coverage: repeatedly take the candidate covering most uncovered cells,
+    while it covers at least min_gain of them. gain_pairs are (candidate, cell) pairs.
+    Returns [(candidate, cells gained)].
+    """
+    candidate, cell = gain_pairs
+    by_cell = np.argsort(cell, kind="stable")
+    cell_start = np.searchsorted(cell[by_cell], np.arange(n_cells + 1))
+    by_candidate = np.argsort(candidate, kind="stable")
+    candidate_start = np.searchsorted(candidate[by_candidate], np.arange(n_candidates + 1))
+
+    gains = np.bincount(candidate, minlength=n_candidates)
+    covered = np.zeros(n_cells, dtype=bool)
+    chosen = []
+    while len(chosen) < budget and gains.size and gains.max() >= max(min_gain, 1):
+        best = int(np.argmax(gains))
+        cells = cell[by_candidate[candidate_start[best]:candidate_start[best + 1]]]
+        cells = cells[~covered[cells]]
+        covered[cells] = True
+        chosen.append((best, len(cells)))
+        # Those cells no longer count for the other candidates covering them
+        np.subtract.at(gains, candidate[by_cell[_ranges(cell_start[cells], cell_start[cells + 1])]], 1)
+    return chosen
+
+
+def coverage_gaps(quartiers, points, roads):
+    """
+    Coverage gaps of every quartier and the bin locations that would close them.
+
+    quartiers: GeoDataFrame with name, ideal_pts and ideal_dist (km); points: GeoDataFrame
+    of the existing collecting points; roads: GeoDataFrame of road lines. All quartiers
+    are handled in one batch in a local metric CRS.
+
+    Returns (low density areas, suggested bins) GeoDataFrames in EPSG:4326:
+    - one area per quartier with uncovered cells: its uncovered part, gap_km2, gap_share;
+    - suggested bins on the roads, best first, as long as each one reaches at least
+      MIN_GAIN_SHARE of its quartier still uncovered and at most ideal_pts per quartier;
+      gain_km2 is the uncovered area each one adds.
+    """
+    crs = quartiers.estimate_utm_crs()
+    quartiers = quartiers.to_crs(crs).reset_index(drop=True)
+    points = points.to_crs(crs)
+    roads = roads.to_crs(crs)
+    radius = quartiers["ideal_dist"].to_numpy(dtype="float64") * 1000 * COVERAGE_RATIO
+
+    # Demand cells, and those already within reach of a collecting point
+    owner, x, y, steps = _grid(quartiers, radius)
+    cells = shapely.points(x, y)
+    reached, _ = shapely.STRtree(points.geometry.values).query(cells, predicate="dwithin", distance=radius[owner])
+    uncovered = np.ones(len(cells), dtype=bool)
+    uncovered[reached] = False
+
+    # Low density areas: uncovered cells dissolved per quartier
+    cell_area = steps[owner] ** 2
+    squares = shapely.box(x - steps[owner] / 2, y - steps[owner] / 2, x + steps[owner] / 2, y + steps[owner] / 2)
+    gap = pd.DataFrame({"owner": owner[uncovered], "area": cell_area[uncovered]})
+    total = pd.Series(cell_area).groupby(owner).sum()
+    areas = []
+    for i, group in gap.groupby("owner", sort=True):
+        squares_i = squares[uncovered][(gap["owner"] == i).to_numpy()]
+        shape = shapely.intersection(shapely.union_all(squares_i), quartiers.geometry.values[i])
+        areas.append({
+            "name": quartiers["name"].iloc[i], "gap_km2": group["area"].sum() / 1e6,
+            "gap_share": group["area"].sum() / total[i], "geometry": shape,
+        })
+    low_density = gpd.GeoDataFrame(areas, columns=["name", "gap_km2", "gap_share", "geometry"], geometry="geometry", crs=crs)
+
+    # Candidate sites on the roads and the uncovered cells of their quartier they would reach
+    cx, cy, c_owner, c_road = _candidates(roads, quartiers, steps)
+    gap_idx = np.flatnonzero(uncovered)
+    site_idx, gap_pos = shapely.STRtree(cells[gap_idx]).query(
+        shapely.points(cx, cy), predicate="dwithin", distance=radius[c_owner]
+    )
+    same = c_owner[site_idx] == owner[gap_idx[gap_pos]]
+    site_idx, gap_pos = site_idx[same], gap_pos[same]
+
+    budget = quartiers["ideal_pts"].fillna(0).to_numpy().astype(int)
+    cells_per_quartier = np.bincount(owner, minlength=len(quartiers))
+
+    suggestions = []
+    for i in np.flatnonzero(budget):
+        mine = c_owner[site_idx] == i
+        if not mine.any():
+            continue
+        sites, site_local = np.unique(site_idx[mine], return_inverse=True)
+        gaps, gap_local = np.unique(gap_pos[mine], return_inverse=True)
+        chosen = _greedy((site_local, gap_local), len(sites), len(gaps), budget[i],
+                         min_gain=MIN_GAIN_SHARE * cells_per_quartier[i])
+        for rank, (site, gained) in enumerate(chosen, 1):
+            s = sites[site]
+            suggestions.append({
+                "name": quartiers["name"].iloc[i], "rank": rank, "route": roads.index[c_road[s]],
+                "gain_km2": gained * steps[i] ** 2 / 1e6, "geometry": shapely.Point(cx[s], cy[s]),
+            })
+    bins = gpd.GeoDataFrame(suggestions, columns=["name", "rank", "route", "gain_km2", "geometry"],
+                            geometry="geometry", crs=crs)
+
+    low_density, bins = low_density.to_crs(epsg=4326), bins.to_crs(epsg=4326)
+    bins["longitude"], bins["latitude"] = bins.geometry.x, bins.geometry.y
+    return low_density, bins
@@ -0,0 +1,198 @@
+import os
+import json
+import itertools
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pyogrio
+
+from geoprocessing.instrumentation import span
+
+# Output formats and the extension used for each of them
+FORMATS = {
+    "shapefile": ".shp",
+    "geoparquet": ".parquet",
+    "flatgeobuf": ".fgb",
+}
+
+# Rows per GeoParquet row group: small enough for the bbox covering statistics of a
+# spatially sorted chunk to let readers skip most groups of a bounding box query
+ROW_GROUP_SIZE = 10_000
+
+
+def with_format(path, fmt):
+    """
+    Same output path with the extension of the chosen format.
+    """
+    return os.path.splitext(path)[0] + FORMATS[fmt]
+
+
+def _attribute_table(chunk):
+    import pyarrow as pa
+
+    # Object columns may be all None in one chunk and strings in the next: keep them strings
+    attributes = pd.DataFrame(chunk.drop(columns=chunk.geometry.name))
+    for column in attributes.columns:
+        if attributes[column].dtype == object or pd.api.types.is_string_dtype(attributes[column]):
+            attributes[column] = attributes[column].astype("string")
+    return pa.Table.from_pandas(attributes, preserve_index=False)
+
+
+def _arrow_table(chunk, covering_bbox=False):
+    import pyarrow as pa
+
+    table = _attribute_table(chunk)
+    geometry = np.asarray(chunk.geometry)
+    table = table.append_column(chunk.geometry.name, pa.array(shapely.to_wkb(geometry), type=pa.binary()))
+    if covering_bbox:
+        # Per-row bounding boxes let readers skip row groups outside a bbox
+        bounds = shapely.bounds(geometry)
+        table = table.append_column("bbox", pa.StructArray.from_arrays(
+            [pa.array(bounds[:, i]) for i in range(4)], names=["xmin", "ymin", "xmax", "ymax"]
+        ))
+    return table
+
+
+def _geo_metadata(chunk):
+    # GeoParquet 1.1 file metadata
+    column = {
+        "encoding": "WKB",
+        "geometry_types": sorted(set(chunk.geom_type.dropna())),
+        "covering": {"bbox": {k: ["bbox", k] for k in ("xmin", "ymin", "xmax", "ymax")}},
+    }
+    if chunk.crs is not None:
+        column["crs"] = chunk.crs.to_json_dict()
+    return {"version": "1.1.0", "primary_column": chunk.geometry.name, "columns": {chunk.geometry.name: column}}
+
+
+def _sorted_spatially(chunk):
+    # Hilbert order keeps neighbouring features in the same row groups / index nodes
+    if len(chunk) < 2 or chunk.geometry.isna().any() or chunk.geometry.is_empty.any():
+        return chunk
+    return chunk.iloc[np.argsort(chunk.geometry.hilbert_distance(), kind="stable")]
+
+
+def _write_geoparquet(chunks, path, on_chunk):
+    import pyarrow.parquet as pq
+
+    writer, written = None, 0
+    try:
+        for chunk in chunks:
+            with span("write", rows=len(chunk), fmt="geoparquet"):
+                chunk = _sorted_spatially(chunk)
+                table = _arrow_table(chunk, covering_bbox=True)
+                if writer is None:
+                    metadata = dict(table.schema.metadata or {}, geo=json.dumps(_geo_metadata(chunk)))
+                    schema = table.schema.with_metadata(metadata)
+                    writer = pq.ParquetWriter(path, schema, compression="zstd")
+                writer.write_table(table.cast(writer.schema), row_group_size=ROW_GROUP_SIZE)
+            written += len(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+def _write_flatgeobuf(chunks, path, on_chunk):
+    import pyarrow as pa
+
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return 0
+    first_table = _arrow_table(first)
+    schema = first_table.schema.set(
+        first_table.schema.get_field_index(first.geometry.name),
+        pa.field(first.geometry.name, pa.binary(), metadata={"ARROW:extension:name": "geoarrow.wkb"}),
+    )
+    geometry_types = set(first.geom_type.dropna())
+    written = [0]
+
+    def batches():
+        for chunk in itertools.chain([first], chunks):
+            table = _arrow_table(chunk).cast(schema)
+            written[0] += len(chunk)
+            yield from table.to_batches()
+            if on_chunk is not None:
+                on_chunk(chunk)
+
+    # One streaming write; GDAL builds the packed Hilbert R-tree when the file is closed.
+    # Its span also holds the reads of the chunks it pulls (reported as child spans)
+    reader = pa.RecordBatchReader.from_batches(schema, batches())
+    with span("write", fmt="flatgeobuf") as s:
+        pyogrio.write_arrow(
+            reader, path, driver="FlatGeobuf", geometry_name=first.geometry.name,
+            geometry_type=geometry_types.pop() if len(geometry_types) == 1 else "Unknown",
+            crs=first.crs.to_wkt() if first.crs is not None else None,
+            layer_options={"SPATIAL_INDEX": "YES"},
+        )
+        s.rows = written[0]
+    return written[0]
+
+
+def _write_chunks(chunks, path, fmt, append, on_chunk):
+    if fmt == "shapefile":
+        written = 0
+        for chunk in chunks:
+            with span("write", rows=len(chunk), fmt=fmt):
+                pyogrio.write_dataframe(chunk, path, driver="ESRI Shapefile", append=append or written > 0)
+            written += len(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+        return written
+
+    if append:
+        raise ValueError(f"{fmt} layers cannot be appended to")
+    if fmt == "geoparquet":
+        return _write_geoparquet(chunks, path, on_chunk)
+    if fmt == "flatgeobuf":
+        return _write_flatgeobuf(chunks, path, on_chunk)
+    raise ValueError(f"Unknown output format: {fmt}")
+
+
+def write_layer_chunks(chunks, path, fmt="shapefile", append=False, on_chunk=None):
+    """
+    Write GeoDataFrame chunks to a single layer in the chosen format.
+    Returns the number of features written. When all the chunks are empty the layer is
+    replaced by an empty one with their columns; appending, or no chunk at all, leaves
+    any existing file untouched.
+    on_chunk is called with every chunk once it has been handed to the writer.
+    """
+    schema = []
+
+    def non_empty():
+        # Empty chunks are skipped, the last one kept for its columns
+        for chunk in chunks:
+            if chunk.empty:
+                schema[:] = [chunk]
+            else:
+                yield chunk
+
+    written = _write_chunks(non_empty(), path, fmt, append, on_chunk)
+    if written == 0 and schema and not append:
+        _write_chunks(schema, path, fmt, False, None)
+    return written
+
+
+def write_layer(gdf, path, fmt="shapefile"):
+    """
+    Write a whole GeoDataFrame in the chosen format.
+    """
+    return write_layer_chunks([gdf], path, fmt)
+
+
+def read_layer(path, bbox=None, columns=None):
+    """
+    Read a layer written by write_layer, optionally only the features intersecting
+    bbox (xmin, ymin, xmax, ymax). FlatGeobuf answers it from its R-tree and
+    GeoParquet from the per-row bbox column (so on feature bounding boxes).
+    """
+    if path.endswith(FORMATS["geoparquet"]):
+        if columns is not None:
+            columns = list(columns) + ["geometry"]
+        gdf = gpd.read_parquet(path, columns=columns, bbox=bbox)
+        return gdf.drop(columns="bbox", errors="ignore")
+    return pyogrio.read_dataframe(path, bbox=bbox, columns=columns)
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import atexit
+import threading
+import tracemalloc
+
+# Spans are only recorded once GEOPROCESSING_TRACE names an output file: a *.prom
+# path gives a Prometheus textfile, anything else one JSON line per span
+TRACE_ENV = "GEOPROCESSING_TRACE"
+
+# tracemalloc slows allocation-heavy code down; set this to 0 to time spans only
+TRACE_MEMORY_ENV = "GEOPROCESSING_TRACE_MEMORY"
+
+METRIC_PREFIX = "geoprocessing_span"
+
+_sink = None
+_memory = False
+_local = threading.local()
+
+# Spans open and spans entered so far, across every thread: tracemalloc has a single
+# peak per process, which a span of another thread resets
+_lock = threading.Lock()
+_open = 0
+_entered = 0
+
+
+class _NullSpan:
+    """
+    What span() returns while tracing is off: entering, leaving and setting rows do nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def rows(self):
+        return None
+
+    @rows.setter
+    def rows(self, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    One timed stage. Nested spans get a path ("export_points/write"), and the time of
+    a span not spent in its children is reported as self_s. With memory tracing,
+    memory_peak_bytes is the tracemalloc peak reached inside the span above what was
+    allocated when it started; a span that overlaps one of another thread reports none,
+    as that peak is shared by every thread.
+    """
+    __slots__ = ("name", "rows", "labels", "path", "parent", "start", "children_s", "memory_start", "peak",
+                 "entered", "shared")
+
+    def __init__(self, name, rows=None, labels=None):
+        self.name = name
+        self.rows = rows
+        self.labels = labels or {}
+
+    def __enter__(self):
+        global _open, _entered
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        self.path = f"{self.parent.path}/{self.name}" if self.parent else self.name
+        self.children_s = 0.0
+        if _memory:
+            with _lock:
+                self.shared = _open > len(stack)
+                _open += 1
+                _entered += 1
+                _local.entered = getattr(_local, "entered", 0) + 1
+                self.entered = (_entered, _local.entered)
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = self.peak = current
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _open
+        duration = time.perf_counter() - self.start
+        _stack().pop()
+        record = {
+            "time": time.time(), "pid": os.getpid(), "span": self.path, "duration_s": duration,
+            "self_s": duration - self.children_s, "rows": self.rows,
+        }
+        if _memory:
+            with _lock:
+                _open -= 1
+                # Another thread entered a span meanwhile if not every span entered was ours
+                shared = self.shared or _entered - self.entered[0] != _local.entered - self.entered[1]
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if not shared:
+                record["memory_peak_bytes"] = self.peak - self.memory_start
+        if self.parent is not None:
+            self.parent.children_s += duration
+            if _memory:
+                self.parent.peak = max(self.parent.peak, self.peak)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(self.labels)
+
+        sink = _sink
+        if sink is not None:
+            sink.emit(record, self.parent is None)
+        return False
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def emit(self, record, top_level):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock, open(self.path, "a") as f:
+            f.write(line)
+
+    def close(self):
+        pass
+
+
+class PrometheusSink:
+    """
+    Totals per span path, rewritten to a textfile (for the node exporter textfile
+    collector) whenever a top-level span ends and at exit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def emit(self, record, top_level):
+        with self.lock:
+            total = self.totals.setdefault(record["span"], {"calls": 0, "seconds": 0.0, "self_seconds": 0.0,
+                                                            "rows": 0, "errors": 0, "memory_peak_bytes": 0})
+            total["calls"] += 1
+            total["seconds"] += record["duration_s"]
+            total["self_seconds"] += record["self_s"]
+            total["rows"] += record["rows"] or 0
+            total["errors"] += "error" in record
+            total["memory_peak_bytes"] = max(total["memory_peak_bytes"], record.get("memory_peak_bytes", 0))
+        if top_level:
+            self.close()
+
+    def close(self):
+        metrics = [
+            ("calls_total", "counter", "Times the span was entered", "calls"),
+            ("seconds_total", "counter", "Wall time spent in the span", "seconds"),
+            ("self_seconds_total", "counter", "Wall time spent in the span outside its child spans", "self_seconds"),
+            ("rows_total", "counter", "Rows the span processed", "rows"),
+            ("errors_total", "counter", "Times the span ended with an exception", "errors"),
+            ("memory_peak_bytes", "gauge", "Largest tracemalloc peak of the span above its start", "memory_peak_bytes"),
+        ]
+        with self.lock:
+            lines = []
+            for suffix, kind, help_text, key in metrics:
+                name = f"{METRIC_PREFIX}_{suffix}"
+                lines += [f"# HELP {name} {help_text}.", f"# TYPE {name} {kind}"]
+                for path, total in sorted(self.totals.items()):
+                    label = path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                    lines.append(f'{name}{{span="{label}"}} {total[key]}')
+            # Written aside and renamed, so the collector never reads half a file
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp, self.path)
+
+
+def configure(path=None, memory=True):
+    """
+    Send spans to path (see TRACE_ENV), or turn tracing off with None.
+    """
+    global _sink, _memory
+    if _sink is not None:
+        _sink.close()
+    _sink = None
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+    if not path:
+        return
+    _sink = PrometheusSink(path) if path.endswith(".prom") else JsonLinesSink(path)
+    if memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _memory = True
+
+
+def enabled():
+    return _sink is not None
+
+
+def span(name, rows=None, **labels):
+    """
+    Context manager timing a stage; set .rows on it when the count is only known inside.
+
+        with span("write", fmt=fmt) as s:
+            s.rows = write(...)
+
+    Costs one global lookup while tracing is off.
+    """
+    if _sink is None:
+        return _NULL_SPAN
+    return Span(name, rows, labels)
+
+
+def iterate(name, iterable, rows=len, **labels):
+    """
+    Iterate while timing every step in its own span, e.g. every batch pulled from a
+    cursor; rows(item) gives the rows of each one. Returns iterable itself while
+    tracing is off.
+    """
+    if _sink is None:
+        return iterable
+    return _iterate(name, iter(iterable), rows, labels)
+
+
+def _iterate(name, iterator, rows, labels):
+    end = object()
+    while True:
+        with span(name, **labels) as s:
+            item = next(iterator, end)
+            s.rows = rows(item) if item is not end else 0
+        if item is end:
+            return
+        yield item
+
+
+configure(os.environ.get(TRACE_ENV), memory=os.environ.get(TRACE_MEMORY_ENV, "1") != "0")
+atexit.register(lambda: _sink.close() if _sink is not None else None)
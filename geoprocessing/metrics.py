@@ -0,0 +1,80 @@
+import functools
+import numpy as np
+import shapely
+from pyproj import Geod, Transformer
+
+WGS84 = "EPSG:4326"
+GEOD = Geod(ellps="WGS84")
+
+# The equal-area projection is centred on the data, rounded so that nearby layers
+# share one cached transformer
+CENTER_DECIMALS = 2
+
+
+@functools.lru_cache(maxsize=None)
+def transformer(from_crs, to_crs):
+    """
+    Transformer between two CRS (x = longitude / easting), built once per pair.
+    """
+    return Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+
+def reproject(geometries, from_crs, to_crs):
+    """
+    Array of geometries reprojected in one call over all their coordinates.
+    """
+    project = transformer(from_crs, to_crs)
+    return shapely.transform(
+        np.asarray(geometries), lambda xy: np.column_stack(project.transform(xy[:, 0], xy[:, 1]))
+    )
+
+
+def equal_area_crs(geometries):
+    """
+    Lambert azimuthal equal-area projection on the WGS84 ellipsoid, centred on the
+    longitude/latitude geometries. Areas measured in it are the ellipsoidal ones.
+    """
+    xmin, ymin, xmax, ymax = shapely.total_bounds(np.asarray(geometries))
+    lon = round((xmin + xmax) / 2, CENTER_DECIMALS) if np.isfinite(xmin) else 0.0
+    lat = round((ymin + ymax) / 2, CENTER_DECIMALS) if np.isfinite(ymin) else 0.0
+    return f"+proj=laea +lat_0={lat} +lon_0={lon} +ellps=WGS84 +units=m +no_defs"
+
+
+def area_and_centroid(geometries):
+    """
+    Ellipsoidal area (km²) and centroid longitude/latitude of longitude/latitude
+    geometries, from a single projection of their coordinates.
+    """
+    geometries = np.asarray(geometries)
+    crs = equal_area_crs(geometries)
+    projected = reproject(geometries, WGS84, crs)
+    centroids = shapely.centroid(projected)
+    lon, lat = transformer(crs, WGS84).transform(shapely.get_x(centroids), shapely.get_y(centroids))
+    return shapely.area(projected) / 1e6, np.asarray(lon), np.asarray(lat)
+
+
+def area_km2(geometries):
+    """
+    Ellipsoidal area (km²) of longitude/latitude geometries.
+    """
+    geometries = np.asarray(geometries)
+    return shapely.area(reproject(geometries, WGS84, equal_area_crs(geometries))) / 1e6
+
+
+def length_km(geometries):
+    """
+    Geodesic length (km) of longitude/latitude lines (perimeter for polygons), every
+    segment of every geometry measured in one vectorized call.
+    """
+    geometries = np.asarray(geometries)
+    lines = np.where(shapely.get_dimensions(geometries) == 2, shapely.boundary(geometries), geometries)
+    parts, owner = shapely.get_parts(lines, return_index=True)
+    coords, part = shapely.get_coordinates(parts, return_index=True)
+
+    # Consecutive vertices of the same part are a segment
+    segment = part[1:] == part[:-1]
+    _, _, distance = GEOD.inv(coords[:-1, 0][segment], coords[:-1, 1][segment],
+                              coords[1:, 0][segment], coords[1:, 1][segment])
+    per_part = np.bincount(part[1:][segment], weights=distance, minlength=len(parts))
+    length = np.bincount(owner, weights=per_part, minlength=len(geometries)) / 1000
+    return np.where(shapely.is_missing(geometries), np.nan, length)
@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+
+from geoprocessing.cache import CACHE_DIR_NAME, read_frame, source_digest, write_frame
+
+# Layer of GDAL's OSM driver holding areas (closed ways and multipolygon relations);
+# a GeoPackage snapshot is that layer copied as is:
+#   ogr2ogr -f GPKG snapshot.gpkg extract.osm.pbf multipolygons
+OSM_LAYER = "multipolygons"
+
+# Tags that may name a place besides "name"
+NAME_TAGS = ("name:fr", "name:en", "short_name", "official_name", "alt_name")
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _other_tag(key, value):
+    # GDAL keeps the tags without a column of their own as hstore text: "key"=>"value"
+    return f'other_tags LIKE {_quote(f"%{json.dumps(key)}=>{json.dumps(value, ensure_ascii=False)}%")}'
+
+
+def _place_name(place):
+    # "USTHB, Bab Ezzouar, Algérie" is looked up as "USTHB"
+    return place.split(",")[0].strip()
+
+
+def _features_frame(gdf, tags):
+    # Same columns whatever the provider: name, the queried tags, geometry
+    columns = ["name"] + [key for key in tags if key != "name"]
+    gdf = gdf.reindex(columns=columns + [gdf.geometry.name])
+    gdf = gdf.rename_geometry("geometry") if gdf.geometry.name != "geometry" else gdf
+    for column in columns:
+        gdf[column] = gdf[column].astype(object).where(gdf[column].notna(), None)
+    return gdf.to_crs(epsg=4326).reset_index(drop=True)
+
+
+class OsmnxProvider:
+    """
+    Live queries to Nominatim / Overpass through osmnx.
+    """
+
+    def __init__(self):
+        self.identity = "osmnx"
+
+    def boundary(self, place):
+        import osmnx as ox
+
+        gdf = ox.geocode_to_gdf(place)
+        return _features_frame(gdf.assign(name=_place_name(place)), {})
+
+    def features(self, place, tags):
+        import osmnx as ox
+
+        return _features_frame(ox.features_from_place(place, tags), tags)
+
+
+class OsmFileProvider:
+    """
+    Boundaries and features read from a local .osm.pbf (or .osm) extract, streamed
+    by GDAL's OSM driver, or from a GeoPackage snapshot of its multipolygons layer.
+    """
+
+    def __init__(self, path, layer=OSM_LAYER):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"OSM source not found: {path}")
+        self.path = path
+        self.layer = layer
+        self.identity = None
+        self._fields = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            import pyogrio
+
+            self._fields = set(pyogrio.read_info(self.path, layer=self.layer)["fields"])
+        return self._fields
+
+    def _read(self, where, mask=None, columns=None):
+        import pyogrio
+
+        return pyogrio.read_dataframe(self.path, layer=self.layer, where=where, mask=mask, columns=columns)
+
+    def _tag_filter(self, key, value):
+        if value is True:
+            if key in self.fields:
+                return f'"{key}" IS NOT NULL'
+            return f'other_tags LIKE {_quote("%" + json.dumps(key) + "=>%")}'
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        if key in self.fields:
+            return f'"{key}" IN ({", ".join(_quote(v) for v in values)})'
+        return "(" + " OR ".join(_other_tag(key, v) for v in values) + ")"
+
+    def boundary(self, place):
+        name = _place_name(place)
+        clauses = [f"name = {_quote(name)}"]
+        if "other_tags" in self.fields:
+            clauses += [_other_tag(tag, name) for tag in NAME_TAGS]
+        columns = [column for column in ("name", "boundary") if column in self.fields]
+        candidates = self._read(" OR ".join(clauses), columns=columns).reindex(columns=["name", "boundary", "geometry"])
+        if candidates.empty:
+            raise LookupError(f"No area named {name!r} in {self.path}")
+
+        # Prefer an administrative boundary, then the largest area
+        administrative = candidates["boundary"] == "administrative"
+        candidates = candidates.assign(administrative=administrative, area=candidates.geometry.area)
+        best = candidates.sort_values(["administrative", "area"], ascending=False).iloc[[0]]
+        return _features_frame(best.assign(name=name), {})
+
+    def features(self, place, tags):
+        polygon = self.boundary(place).geometry.iloc[0]
+        where = " OR ".join(self._tag_filter(key, value) for key, value in tags.items())
+        columns = [key for key in ["name", *tags] if key in self.fields]
+        return _features_frame(self._read(where, mask=polygon, columns=columns), tags)
+
+
+class CachedProvider:
+    """
+    Stores every boundary/features result on disk, addressed by a hash of the query
+    and of the source content, so repeated runs do not fetch or parse it again.
+    """
+
+    def __init__(self, provider, cache_dir=None):
+        self.provider = provider
+        self.cache_dir = cache_dir or os.path.join(CACHE_DIR_NAME, "osm")
+
+    def _source_identity(self):
+        if self.provider.identity is None:
+            # Local file: its content hash, only recomputed when size or mtime move
+            manifest_path = os.path.join(self.cache_dir, "sources.json")
+            manifests = {}
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    manifests = json.load(f)
+            source = os.path.abspath(self.provider.path)
+            digest, stat = source_digest(source, manifests.get(source))
+            manifests[source] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(manifest_path + ".tmp", "w") as f:
+                json.dump(manifests, f)
+            os.replace(manifest_path + ".tmp", manifest_path)
+            self.provider.identity = f"{self.provider.layer}:{digest}"
+        return self.provider.identity
+
+    def _cached(self, query, compute):
+        key = hashlib.sha256(json.dumps([self._source_identity(), query], ensure_ascii=False).encode()).hexdigest()
+        entry = os.path.join(self.cache_dir, key + ".arrow")
+        if os.path.exists(entry):
+            return read_frame(entry)
+
+        result = compute()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_frame(result, entry)
+        return result
+
+    def boundary(self, place):
+        return self._cached(["boundary", place], lambda: self.provider.boundary(place))
+
+    def features(self, place, tags):
+        tags = {key: sorted(value) if isinstance(value, (list, tuple, set)) else value for key, value in tags.items()}
+        return self._cached(["features", place, tags], lambda: self.provider.features(place, tags))
+
+
+def open_provider(source=None, cache=True):
+    """
+    Provider for the given .osm.pbf / .osm / .gpkg file, or live osmnx queries when
+    source is None; results are cached on disk unless cache is False.
+    """
+    provider = OsmnxProvider() if source is None else OsmFileProvider(source)
+    return CachedProvider(provider) if cache else provider
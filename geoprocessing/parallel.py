@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from geoprocessing.saturation import DISTANCE_MODES, average_distance_by_group
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def _group_cost(size, mode):
+    # pairwise distances grow with the square of the quartier size, the others close to linearly
+    return size * size if mode in ("pairwise", "haversine") else size * max(np.log2(size), 1)
+
+
+def _shards(sizes, mode, workers):
+    """
+    Split group positions into `workers` shards of similar cost (largest groups first).
+    """
+    order = np.argsort([-_group_cost(size, mode) for size in sizes], kind="stable")
+    shards = [[] for _ in range(workers)]
+    loads = np.zeros(workers)
+    for group in order:
+        target = int(np.argmin(loads))
+        shards[target].append(int(group))
+        loads[target] += _group_cost(sizes[group], mode)
+    return [shard for shard in shards if shard]
+
+
+def _shard_distances(shm_name, n, mode, ranges):
+    # Runs in a worker process: the coordinates are read from shared memory, not pickled
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        xy = np.ndarray((2, n), dtype="float64", buffer=shm.buf)
+        distance = DISTANCE_MODES[mode]
+        return [distance(xy[0, start:stop], xy[1, start:stop]) for start, stop in ranges]
+    finally:
+        del xy
+        shm.close()
+
+
+def parallel_distance_by_group(frame, group_column, x_column, y_column, mode="pairwise", workers=None):
+    """
+    Same result as saturation.average_distance_by_group, with the groups spread over
+    a ProcessPoolExecutor. The coordinates are copied once, sorted by group, into a
+    shared-memory block that every worker maps; each worker gets only (start, stop)
+    ranges. Every group is computed by one worker with the same code as the serial
+    version, so the values do not depend on the number of workers.
+    """
+    workers = default_workers() if workers is None else workers
+    frame = frame[frame[group_column].notna()]
+    if workers <= 1 or frame[group_column].nunique() <= 1:
+        return average_distance_by_group(frame, group_column, x_column, y_column, mode=mode)
+
+    # Rows of a group next to each other, groups in order of first appearance
+    codes, names = pd.factorize(frame[group_column], sort=False)
+    order = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes, minlength=len(names))
+    stops = np.cumsum(sizes)
+    starts = stops - sizes
+
+    n = len(order)
+    shm = shared_memory.SharedMemory(create=True, size=max(2 * n * 8, 1))
+    try:
+        xy = np.ndarray((2, n), dtype="float64", buffer=shm.buf)
+        xy[0] = frame[x_column].to_numpy(dtype="float64")[order]
+        xy[1] = frame[y_column].to_numpy(dtype="float64")[order]
+
+        shards = _shards(sizes, mode, workers)
+        distances = np.empty(len(names))
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [
+                executor.submit(_shard_distances, shm.name, n, mode, [(starts[g], stops[g]) for g in shard])
+                for shard in shards
+            ]
+            # Results go back to their group's position, whatever order the shards finish in
+            for shard, future in zip(shards, futures):
+                distances[shard] = future.result()
+        del xy
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.Series(distances, index=names, dtype="float64")
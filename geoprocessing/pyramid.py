@@ -0,0 +1,278 @@
+import os
+import json
+import math
+import shutil
+import hashlib
+import numpy as np
+import shapely
+
+# Zoom levels written by default (the map opens at zoom 14)
+MIN_ZOOM = 10
+MAX_ZOOM = 16
+
+TILE_SIZE = 256
+
+# Douglas-Peucker tolerance and coordinate grid, in pixels of the zoom level
+SIMPLIFY_PIXELS = 0.5
+QUANTIZE_PIXELS = 0.25
+
+# Lines and polygons smaller than this on screen are left out of a zoom level
+MIN_FEATURE_PIXELS = 1
+
+# Features are clipped slightly beyond their tile so that lines do not show seams
+TILE_BUFFER = 1 / 64
+
+# State of the last run, and the small description the map reads
+MANIFEST = "manifest.json"
+TILEJSON = "tiles.json"
+
+
+def _tile_range(lon, lat, z):
+    # Slippy map tile numbers of longitude/latitude degrees at zoom z
+    n = 2 ** z
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = np.floor((np.asarray(lon) + 180) / 360 * n)
+    y = np.floor((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * n)
+    return np.clip(x, 0, n - 1).astype(int), np.clip(y, 0, n - 1).astype(int)
+
+
+def tile_bounds(z, x, y):
+    """
+    (west, south, east, north) of tiles in degrees; x and y may be arrays.
+    """
+    n = 2 ** z
+    lat = lambda t: np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(t) / n))))
+    return np.asarray(x) / n * 360 - 180, lat(y + 1), (np.asarray(x) + 1) / n * 360 - 180, lat(y)
+
+
+def _pixel_degrees(z):
+    return 360 / (TILE_SIZE * 2 ** z)
+
+
+def _round(coords, decimals):
+    if isinstance(coords[0], (list, tuple)):
+        return [_round(c, decimals) for c in coords]
+    return [round(c, decimals) for c in coords]
+
+
+def _geometry_digests(gdf):
+    return {
+        str(key): hashlib.blake2b(wkb or b"", digest_size=8).hexdigest()
+        for key, wkb in zip(gdf.index, shapely.to_wkb(gdf.geometry.values))
+    }
+
+
+def _attribute_digests(gdf, properties):
+    return {
+        str(key): hashlib.blake2b(json.dumps(values, default=str).encode(), digest_size=8).hexdigest()
+        for key, values in zip(gdf.index, gdf[properties].itertuples(index=False, name=None))
+    }
+
+
+def _properties(gdf, properties):
+    # JSON-ready attributes of every feature, keyed by feature id
+    records = gdf[properties].astype(object).where(gdf[properties].notna(), None)
+    return {str(key): dict(zip(properties, values))
+            for key, values in zip(gdf.index, records.itertuples(index=False, name=None))}
+
+
+def _tile_features(gdf, z):
+    """
+    {(x, y): [(feature id, GeoJSON geometry)]} of one zoom level: geometries simplified
+    to half a pixel, clipped to their tiles and rounded to a quarter pixel.
+    """
+    geometries = gdf.geometry.values
+    pixel = _pixel_degrees(z)
+    simplified = shapely.simplify(geometries, SIMPLIFY_PIXELS * pixel, preserve_topology=False)
+    decimals = max(0, math.ceil(-math.log10(QUANTIZE_PIXELS * pixel)))
+
+    # Every (feature, tile) pair the bounding box of a visible feature touches
+    bounds = shapely.bounds(simplified)
+    size = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+    visible = (shapely.get_dimensions(simplified) == 0) | (size >= MIN_FEATURE_PIXELS * pixel)
+    shown = np.flatnonzero(visible)
+    x0, y0 = _tile_range(bounds[shown, 0], bounds[shown, 3], z)
+    x1, y1 = _tile_range(bounds[shown, 2], bounds[shown, 1], z)
+    counts = (x1 - x0 + 1) * (y1 - y0 + 1)
+    pair = np.repeat(np.arange(len(shown)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    width = (x1 - x0 + 1)[pair]
+    feature, tx, ty = shown[pair], x0[pair] + offset % width, y0[pair] + offset // width
+
+    # Clip the features of each tile to the (slightly enlarged) tile in one call
+    ids = gdf.index.astype(str).to_numpy()
+    order = np.lexsort((ty, tx))
+    feature, tx, ty = feature[order], tx[order], ty[order]
+    starts = np.flatnonzero(np.r_[True, (tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])])
+    tiles = {}
+    for start, stop in zip(starts, np.r_[starts[1:], len(feature)]):
+        x, y = int(tx[start]), int(ty[start])
+        west, south, east, north = (float(b) for b in tile_bounds(z, x, y))
+        margin_x, margin_y = (east - west) * TILE_BUFFER, (north - south) * TILE_BUFFER
+        members = feature[start:stop]
+        clipped = shapely.clip_by_rect(simplified[members], west - margin_x, south - margin_y,
+                                       east + margin_x, north + margin_y)
+        features = []
+        for f, geometry in zip(members, clipped):
+            if geometry.is_empty:
+                continue
+            mapping = shapely.geometry.mapping(geometry)
+            mapping["coordinates"] = _round(mapping["coordinates"], decimals)
+            features.append((ids[f], mapping))
+        if features:
+            tiles[(x, y)] = features
+    return tiles
+
+
+def _write_tile(path, features, properties):
+    collection = {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "id": key, "geometry": geometry, "properties": properties[key]}
+                     for key, geometry in features],
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(collection, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def _load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    with open(os.path.join(output_dir, TILEJSON), "w") as f:
+        json.dump({"min_zoom": manifest["settings"]["min_zoom"], "max_zoom": manifest["settings"]["max_zoom"],
+                   "bounds": manifest["bounds"], "tiles": "{z}/{x}/{y}.json"}, f)
+
+
+def _visible(gdf):
+    return gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty].to_crs(epsg=4326)
+
+
+def write_pyramid(gdf, output_dir, properties, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    """
+    Write gdf (EPSG:4326, indexed by feature id) as GeoJSON tiles <output_dir>/<z>/<x>/<y>.json.
+
+    When the geometries are the ones of the previous run, only the tiles holding a
+    feature whose properties changed are rewritten (their geometries are reused as
+    they are); otherwise the whole pyramid is rebuilt. Returns the number of tiles written.
+    """
+    gdf = _visible(gdf)
+    properties = list(properties)
+    previous = _load_manifest(output_dir)
+
+    geometries = _geometry_digests(gdf)
+    attributes = _attribute_digests(gdf, properties)
+    values = _properties(gdf, properties)
+    settings = {"min_zoom": min_zoom, "max_zoom": max_zoom, "properties": properties}
+
+    if previous and previous.get("geometries") == geometries and previous["settings"] == settings:
+        # Same geometries: patch the properties of the tiles holding changed features
+        changed = {key for key, digest in attributes.items() if previous["attributes"].get(key) != digest}
+        written = 0
+        for tile, keys in previous["tiles"].items():
+            if changed.isdisjoint(keys):
+                continue
+            path = os.path.join(output_dir, tile + ".json")
+            with open(path) as f:
+                collection = json.load(f)
+            _write_tile(path, [(feature["id"], feature["geometry"]) for feature in collection["features"]], values)
+            written += 1
+        tiles = previous["tiles"]
+    else:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        tiles, written = {}, 0
+        for z in range(min_zoom, max_zoom + 1):
+            for (x, y), features in _tile_features(gdf, z).items():
+                tile = f"{z}/{x}/{y}"
+                _write_tile(os.path.join(output_dir, tile + ".json"), features, values)
+                tiles[tile] = [key for key, _ in features]
+                written += 1
+
+    _save_manifest(output_dir, {
+        "geometries": geometries, "settings": settings, "attributes": attributes, "tiles": tiles,
+        "bounds": list(gdf.total_bounds) if len(gdf) else None,
+    })
+    return written
+
+
+def patch_pyramid(gdf, keys, output_dir, properties, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    """
+    Bring the pyramid of write_pyramid up to date for the features keys only, without
+    reading the others: gdf holds those of them still there (None if none is), the rest
+    are removed. Only the tiles holding one of them, before or after, are rewritten.
+
+    Returns the number of tiles written, or None when there is no pyramid written with
+    these settings to patch. The bounds only grow: they may be larger than the features.
+    """
+    properties = list(properties)
+    settings = {"min_zoom": min_zoom, "max_zoom": max_zoom, "properties": properties}
+    manifest = _load_manifest(output_dir)
+    if not manifest or "geometries" not in manifest or manifest["settings"] != settings:
+        return None
+
+    keys = {str(key) for key in keys}
+    if gdf is not None:
+        gdf = _visible(gdf)
+        gdf = gdf[gdf.index.astype(str).isin(keys)]
+    geometries = _geometry_digests(gdf) if gdf is not None else {}
+    attributes = _attribute_digests(gdf, properties) if gdf is not None else {}
+    values = _properties(gdf, properties) if gdf is not None else {}
+
+    # Features that moved, appeared or went away are cut again; the others keep their geometries
+    moved = {key for key in keys if manifest["geometries"].get(key) != geometries.get(key)}
+    changed = {key for key in keys - moved if manifest["attributes"].get(key) != attributes.get(key)}
+    dirty = {tile for tile, members in manifest["tiles"].items() if not (moved | changed).isdisjoint(members)}
+    added = {}
+    if gdf is not None and moved:
+        placed = gdf[gdf.index.astype(str).isin(moved)]
+        for z in range(min_zoom, max_zoom + 1):
+            for (x, y), features in _tile_features(placed, z).items():
+                added[f"{z}/{x}/{y}"] = features
+
+    tiles, written = manifest["tiles"], 0
+    for tile in dirty | set(added):
+        path = os.path.join(output_dir, tile + ".json")
+        features, tile_values = [], {}
+        if tile in tiles:
+            with open(path) as f:
+                collection = json.load(f)
+            for feature in collection["features"]:
+                if feature["id"] not in moved:
+                    features.append((feature["id"], feature["geometry"]))
+                    tile_values[feature["id"]] = values.get(feature["id"], feature["properties"])
+        features += added.get(tile, [])
+        tile_values.update(values)
+        if features:
+            _write_tile(path, features, tile_values)
+            tiles[tile] = [key for key, _ in features]
+        else:
+            os.remove(path)
+            del tiles[tile]
+        written += 1
+
+    for key in keys:
+        if key in geometries:
+            manifest["geometries"][key], manifest["attributes"][key] = geometries[key], attributes[key]
+        else:
+            manifest["geometries"].pop(key, None)
+            manifest["attributes"].pop(key, None)
+    if gdf is not None and len(gdf):
+        bounds = gdf.total_bounds
+        if manifest["bounds"]:
+            bounds = np.r_[np.minimum(manifest["bounds"][:2], bounds[:2]), np.maximum(manifest["bounds"][2:], bounds[2:])]
+        manifest["bounds"] = [float(b) for b in bounds]
+    if not manifest["geometries"]:
+        manifest["bounds"] = None
+    _save_manifest(output_dir, manifest)
+    return written
@@ -0,0 +1,174 @@
+import os
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely
+
+from geoprocessing.cache import CACHE_DIR_NAME
+from geoprocessing.saturation import haversine_km
+
+# Saturation mode measuring distances along the roads instead of straight lines
+NETWORK_MODE = "network"
+
+# Road vertices closer than this (in degrees, ~1 cm) are the same graph node
+SNAP_DECIMALS = 7
+
+GRAPH_ARRAYS = ("indptr", "indices", "weights", "nodes", "lines")
+
+
+class RoadGraph:
+    """
+    Undirected road graph in CSR form: the neighbours of node i are
+    indices[indptr[i]:indptr[i + 1]], at weights (km) in the same positions, and
+    lines holds the position of the road line each of those edges comes from;
+    nodes holds the longitude/latitude of every node.
+    """
+
+    def __init__(self, indptr, indices, weights, nodes, lines):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.nodes = nodes
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def matrix(self, size=None):
+        from scipy.sparse import csr_matrix
+
+        n = len(self) if size is None else size
+        indptr = np.concatenate([self.indptr, np.full(n - len(self), self.indptr[-1])])
+        return csr_matrix((self.weights, self.indices, indptr), shape=(n, n))
+
+    def save(self, directory):
+        # Written to a temporary directory first, so a reader never sees half a graph
+        tmp = directory + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in GRAPH_ARRAYS:
+            np.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        return cls(*[np.load(os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap else None)
+                     for name in GRAPH_ARRAYS])
+
+
+def build_road_graph(lines):
+    """
+    Build the graph of an array of (Multi)LineStrings: every vertex is a node (snapped
+    to SNAP_DECIMALS) and every segment an edge weighted by its great-circle length.
+    A segment shared by several lines belongs to the first of them.
+    """
+    parts, owner = shapely.get_parts(np.asarray(lines), return_index=True)
+    coords, part = shapely.get_coordinates(parts, return_index=True)
+    nodes, node_of = np.unique(np.round(coords, SNAP_DECIMALS), axis=0, return_inverse=True)
+    node_of = node_of.ravel()
+
+    # Consecutive vertices of the same line, each segment once whatever its direction
+    same_line = part[1:] == part[:-1]
+    u, v = node_of[:-1][same_line], node_of[1:][same_line]
+    edges, first = np.unique(np.column_stack([np.minimum(u, v), np.maximum(u, v)]), axis=0, return_index=True)
+    edge_lines = owner[part[:-1][same_line][first]]
+    loops = edges[:, 0] == edges[:, 1]
+    edges, edge_lines = edges[~loops], edge_lines[~loops]
+    weights = haversine_km(nodes[edges[:, 0], 0], nodes[edges[:, 0], 1], nodes[edges[:, 1], 0], nodes[edges[:, 1], 1])
+
+    # Both directions (walking ignores oneway), sorted by source node for CSR
+    source = np.concatenate([edges[:, 0], edges[:, 1]])
+    target = np.concatenate([edges[:, 1], edges[:, 0]])
+    weights = np.concatenate([weights, weights])
+    edge_lines = np.concatenate([edge_lines, edge_lines])
+    order = np.lexsort((target, source))
+    indptr = np.zeros(len(nodes) + 1, dtype="int64")
+    np.cumsum(np.bincount(source, minlength=len(nodes)), out=indptr[1:])
+    return RoadGraph(indptr, target[order].astype("int32"), weights[order], nodes, edge_lines[order].astype("int32"))
+
+
+def road_graph(lines, cache_dir=None):
+    """
+    Graph of the given road geometries, built once and then reloaded memory-mapped from
+    .geocache/graphs/<hash of the geometries>; any change to the roads rebuilds it.
+    """
+    cache_dir = cache_dir or os.path.join(CACHE_DIR_NAME, "graphs")
+    lines = np.asarray(lines)
+    digest = hashlib.sha256(f"{SNAP_DECIMALS}:{','.join(GRAPH_ARRAYS)}".encode())
+    for wkb in shapely.to_wkb(lines):
+        digest.update(wkb if wkb is not None else b"")
+    directory = os.path.join(cache_dir, digest.hexdigest()[:16])
+
+    if os.path.exists(os.path.join(directory, "nodes.npy")):
+        return RoadGraph.load(directory)
+    graph = build_road_graph(lines)
+    graph.save(directory)
+    return graph
+
+
+def nearest_point_network_distance(graph, x, y, groups=None):
+    """
+    Distance in km along the roads from every point to the nearest other point
+    (of the same group, when every point has a group label).
+
+    Points are linked to their nearest graph node by a virtual node at their straight-line
+    distance, then a single multi-source Dijkstra per group labels every node with its
+    nearest point. The nearest other point of p is reached through an edge whose two ends
+    carry different labels, one of them p, so one pass over the edges gives all of them.
+    Points that cannot reach another one get inf.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import dijkstra
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n_points, n_nodes = len(x), len(graph)
+    result = np.full(n_points, np.inf)
+    if n_points < 2 or n_nodes == 0:
+        return result
+
+    nodes = np.asarray(graph.nodes)
+    tree = shapely.STRtree(shapely.points(nodes))
+    _, snapped = tree.query_nearest(shapely.points(x, y), all_matches=False)
+    offsets = haversine_km(x, y, nodes[snapped, 0], nodes[snapped, 1])
+    base = graph.matrix().tocoo()
+
+    codes = np.zeros(n_points, dtype="int64") if groups is None else pd.factorize(np.asarray(groups))[0]
+    for code in np.unique(codes):
+        members = np.flatnonzero(codes == code)
+        if len(members) < 2:
+            continue
+
+        # Road graph plus one virtual node per point of the group, linked to its snapped node
+        virtual = n_nodes + np.arange(len(members))
+        rows = np.concatenate([base.row, virtual, snapped[members]])
+        cols = np.concatenate([base.col, snapped[members], virtual])
+        weights = np.concatenate([base.data, offsets[members], offsets[members]])
+        matrix = coo_matrix((weights, (rows, cols)), shape=(n_nodes + len(members),) * 2).tocsr()
+
+        distances, _, sources = dijkstra(matrix, indices=virtual, min_only=True, return_predecessors=True)
+
+        boundary = (sources[rows] >= 0) & (sources[cols] >= 0) & (sources[rows] != sources[cols])
+        a, b = rows[boundary], cols[boundary]
+        candidates = distances[a] + weights[boundary] + distances[b]
+        nearest = np.full(len(members), np.inf)
+        np.minimum.at(nearest, sources[a] - n_nodes, candidates)
+        result[members] = nearest
+    return result
+
+
+def network_distance_by_group(frame, group_column, x_column, y_column, graph):
+    """
+    Mean network distance (km) from each point to its nearest other point of the same
+    group, as a Series indexed like saturation.average_distance_by_group. Points cut off
+    from the others of their group are left out of the mean; a group with none reachable
+    gets inf.
+    """
+    frame = frame[frame[group_column].notna()]
+    nearest = nearest_point_network_distance(graph, frame[x_column].to_numpy(), frame[y_column].to_numpy(),
+                                             frame[group_column].to_numpy())
+    nearest = pd.Series(np.where(np.isfinite(nearest), nearest, np.nan), index=frame.index)
+    means = nearest.groupby(frame[group_column], sort=False).mean()
+    return means.fillna(np.inf).astype("float64")
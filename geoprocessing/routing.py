@@ -0,0 +1,260 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+from geoprocessing.saturation import MAX_BLOCK_ELEMENTS, haversine_km
+
+# 2-opt / Or-opt moves must shorten the tour by more than this (km) to be applied
+MIN_GAIN_KM = 1e-9
+
+# Longest run of consecutive stops Or-opt tries to move elsewhere in the tour
+OR_OPT_SEGMENT = 3
+
+
+class ContractedGraph:
+    """
+    Road graph reduced to its intersections, dead ends and stops: every chain of
+    degree-2 nodes between them is one edge. matrix is the CSR adjacency between
+    the kept nodes (positions in nodes), and chains maps an edge (a, b), a < b, to
+    the road lines it runs along.
+    """
+
+    def __init__(self, nodes, matrix, chains):
+        self.nodes = nodes
+        self.matrix = matrix
+        self.chains = chains
+
+    def lines(self, a, b):
+        return self.chains[(a, b) if a < b else (b, a)]
+
+
+def contract(graph, keep):
+    """
+    ContractedGraph of graph keeping the nodes flagged in keep plus every node
+    whose degree is not 2. A chain of degree-2 nodes is walked once from each end;
+    of parallel chains between the same two nodes only the shortest is kept, and
+    chains coming back to their start are dropped.
+    """
+    from scipy.sparse import csr_matrix
+
+    indptr, indices = np.asarray(graph.indptr), np.asarray(graph.indices)
+    weights, lines = np.asarray(graph.weights), np.asarray(graph.lines)
+    keep = np.asarray(keep, dtype=bool) | (np.diff(indptr) != 2)
+    nodes = np.flatnonzero(keep)
+    position = np.full(len(keep), -1, dtype="int64")
+    position[nodes] = np.arange(len(nodes))
+
+    best = {}
+    for start in nodes:
+        a = position[start]
+        for edge in range(indptr[start], indptr[start + 1]):
+            previous, node, length, used = start, indices[edge], weights[edge], {lines[edge]}
+            while not keep[node]:
+                edge = indptr[node] if indices[indptr[node]] != previous else indptr[node] + 1
+                previous, node = node, indices[edge]
+                length += weights[edge]
+                used.add(lines[edge])
+            b = position[node]
+            if a < b and ((a, b) not in best or length < best[(a, b)][0]):
+                best[(a, b)] = (length, used)
+
+    pairs = np.array(list(best), dtype="int64").reshape(-1, 2)
+    lengths = np.fromiter((length for length, _ in best.values()), dtype="float64", count=len(best))
+    matrix = csr_matrix(
+        (np.concatenate([lengths, lengths]), (np.concatenate([pairs[:, 0], pairs[:, 1]]),
+                                              np.concatenate([pairs[:, 1], pairs[:, 0]]))),
+        shape=(len(nodes), len(nodes)),
+    )
+    chains = {pair: np.array(sorted(used), dtype="int64") for pair, (_, used) in best.items()}
+    return ContractedGraph(nodes, matrix, chains)
+
+
+def snap_stops(graph, x, y):
+    """
+    Nearest graph node of every stop, and the straight-line distance (km) to it.
+    """
+    nodes = np.asarray(graph.nodes)
+    _, snapped = shapely.STRtree(shapely.points(nodes)).query_nearest(shapely.points(x, y), all_matches=False)
+    return snapped, haversine_km(x, y, nodes[snapped, 0], nodes[snapped, 1])
+
+
+def stop_distances(contracted, sources, max_block_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Network distance (km) between every pair of the given nodes of a ContractedGraph,
+    from one multi-source Dijkstra per block of sources, so that at most about
+    max_block_elements node distances are held at once.
+    """
+    from scipy.sparse.csgraph import dijkstra
+
+    step = max(1, max_block_elements // max(len(contracted.nodes), 1))
+    blocks = [dijkstra(contracted.matrix, indices=sources[start:start + step])[:, sources]
+              for start in range(0, len(sources), step)]
+    return np.vstack(blocks) if blocks else np.empty((0, 0))
+
+
+def leg_lines(contracted, origin, target, length):
+    """
+    Road lines along a shortest path between two nodes of a ContractedGraph that are
+    length km apart; the search stops at that distance from origin.
+    """
+    from scipy.sparse.csgraph import dijkstra
+
+    _, predecessors = dijkstra(contracted.matrix, indices=origin, return_predecessors=True,
+                               limit=length * (1 + 1e-9) + MIN_GAIN_KM)
+    lines, node = set(), target
+    while node != origin:
+        parent = predecessors[node]
+        lines.update(contracted.lines(parent, node).tolist())
+        node = parent
+    return lines
+
+
+def nearest_neighbour_tour(matrix, start=0):
+    """
+    Open tour from start always going to the closest stop not visited yet.
+    """
+    n = len(matrix)
+    tour = np.empty(n, dtype="int64")
+    visited = np.zeros(n, dtype=bool)
+    tour[0], visited[start] = start, True
+    for i in range(1, n):
+        tour[i] = np.argmin(np.where(visited, np.inf, matrix[tour[i - 1]]))
+        visited[tour[i]] = True
+    return tour
+
+
+def two_opt(matrix, tour):
+    """
+    Reverse tour segments as long as one shortens the tour. The first stop stays first;
+    the last one may change, since the tour does not come back.
+    """
+    tour = tour.copy()
+    n = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            # Reversing tour[i:j + 1] replaces (i - 1, i) and (j, j + 1) by (i - 1, j) and (i, j + 1)
+            a, b = tour[i - 1], tour[i]
+            c, d = tour[i + 1:], tour[i + 2:]
+            delta = matrix[a, c] - matrix[a, b]
+            delta[:-1] += matrix[b, d] - matrix[c[:-1], d]
+            j = np.argmin(delta)
+            if delta[j] < -MIN_GAIN_KM:
+                tour[i:i + j + 2] = tour[i:i + j + 2][::-1].copy()
+                improved = True
+    return tour
+
+
+def or_opt(matrix, tour, max_segment=OR_OPT_SEGMENT):
+    """
+    Move runs of up to max_segment consecutive stops, possibly reversed, to the place
+    in the tour where they cost least, as long as one such move shortens the tour.
+    """
+    tour = tour.copy()
+    n = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for size in range(1, min(max_segment, n - 2) + 1):
+            i = 1
+            while i + size <= n:
+                segment = tour[i:i + size]
+                first, last, before = segment[0], segment[-1], tour[i - 1]
+                saved = matrix[before, first]
+                if i + size < n:
+                    after = tour[i + size]
+                    saved += matrix[last, after] - matrix[before, after]
+
+                # Cost of putting the segment after rest[k], forwards or reversed
+                rest = np.concatenate([tour[:i], tour[i + size:]])
+                following = rest[1:]
+                forwards = matrix[rest, first]
+                backwards = matrix[rest, last]
+                forwards[:-1] += matrix[last, following] - matrix[rest[:-1], following]
+                backwards[:-1] += matrix[first, following] - matrix[rest[:-1], following]
+                cost = np.minimum(forwards, backwards)
+                k = np.argmin(cost)
+                if cost[k] < saved - MIN_GAIN_KM:
+                    moved = segment if forwards[k] <= backwards[k] else segment[::-1]
+                    tour = np.concatenate([rest[:k + 1], moved, rest[k + 1:]])
+                    improved = True
+                else:
+                    i += 1
+    return tour
+
+
+def solve_tour(matrix, start=0):
+    """
+    Short open tour through every stop of a distance matrix, from start: nearest
+    neighbour, then 2-opt and Or-opt until neither improves it. Unreachable pairs
+    (inf) cost more than any tour avoiding them, so they are used last.
+    """
+    matrix = np.asarray(matrix, dtype="float64")
+    if len(matrix) < 3:
+        order = np.arange(len(matrix))
+        return np.concatenate([[start], order[order != start]]) if len(matrix) else order
+    finite = np.isfinite(matrix)
+    penalty = (matrix[finite].max() if finite.any() else 1.0) * (len(matrix) + 1)
+    matrix = np.where(finite, matrix, penalty)
+
+    tour = nearest_neighbour_tour(matrix, start)
+    length = np.inf
+    while matrix[tour[:-1], tour[1:]].sum() < length - MIN_GAIN_KM:
+        length = matrix[tour[:-1], tour[1:]].sum()
+        tour = or_opt(matrix, two_opt(matrix, tour))
+    return tour
+
+
+def tour_length(matrix, tour):
+    return float(np.asarray(matrix)[tour[:-1], tour[1:]].sum())
+
+
+def plan_route(graph, x, y, groups=None):
+    """
+    Collection route through the stops at x/y (longitude/latitude) along a RoadGraph.
+
+    Stops are snapped to their nearest node, the graph is contracted around them and
+    multi-source Dijkstra gives the network distance matrix between the stops of a tour.
+    With groups (e.g. the quartier of every stop), every group gets its own tour and
+    only its own distance matrix.
+    Returns a DataFrame with one row per stop in visiting order (stop: position in
+    x/y, group, tour: tour number, leg_km: network distance from the previous stop
+    of the same tour, inf when it cannot be reached), and the positions of the road
+    lines the route runs along.
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    groups = np.zeros(len(x), dtype="int64") if groups is None else np.asarray(groups)
+    columns = {"stop": [], "group": [], "tour": [], "leg_km": []}
+    if len(x) == 0 or len(graph) == 0:
+        return pd.DataFrame(columns), np.empty(0, dtype="int64")
+
+    snapped, _ = snap_stops(graph, x, y)
+    keep = np.zeros(len(graph), dtype=bool)
+    keep[snapped] = True
+    contracted = contract(graph, keep)
+    stop_nodes = np.searchsorted(contracted.nodes, snapped)
+
+    lines = set()
+    codes, names = pd.factorize(pd.Series(groups), use_na_sentinel=False)
+    for code, name in enumerate(names):
+        # Only the distances between the stops of the group, O(group size²)
+        stops = np.flatnonzero(codes == code)
+        sources, rows = np.unique(stop_nodes[stops], return_inverse=True)
+        distances = stop_distances(contracted, sources)
+        order = solve_tour(distances[np.ix_(rows, rows)])
+        tour = stops[order]
+
+        legs = np.concatenate([[0.0], distances[rows[order[:-1]], rows[order[1:]]]])
+        columns["stop"].append(tour)
+        columns["group"].append(np.full(len(tour), name, dtype=object))
+        columns["tour"].append(np.full(len(tour), code))
+        columns["leg_km"].append(legs)
+
+        for previous, current, leg in zip(order[:-1], order[1:], legs[1:]):
+            if np.isfinite(leg):
+                lines |= leg_lines(contracted, sources[rows[previous]], sources[rows[current]], leg)
+
+    route = pd.DataFrame({name: np.concatenate(values) for name, values in columns.items()})
+    return route, np.array(sorted(lines), dtype="int64")
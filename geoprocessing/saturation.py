@@ -0,0 +1,152 @@
+import math
+import numpy as np
+import pandas as pd
+import shapely
+
+# Upper bound on the number of pairwise distances held in memory at once
+# (4M float64 values ~ 32 MB), whatever the size of the quartier.
+MAX_BLOCK_ELEMENTS = 4_000_000
+
+# Mean earth radius used by turf.distance, so that km distances match the backend
+EARTH_RADIUS_KM = 6371.0088
+
+# Weighted saturation of the backend (update_saturation.js): deviations below the
+# thresholds (in %) are tolerated, the number of points weighs more than the spacing
+THRESHOLD_POINTS = 10
+THRESHOLD_DISTANCE = 10
+WEIGHT_POINTS = 0.85
+WEIGHT_DISTANCE = 0.15
+
+
+def _block_rows(n, max_block_elements=MAX_BLOCK_ELEMENTS):
+    return max(1, max_block_elements // max(n, 1))
+
+
+def mean_pairwise_distance(x, y, max_block_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Average distance between every ordered pair (i, j), i != j, of points.
+
+    Distances are computed block by block with NumPy broadcasting so that
+    memory stays bounded for quartiers with tens of thousands of points.
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n = len(x)
+    if n < 2:
+        return float('inf')  # If only one point, return infinity
+
+    step = _block_rows(n, max_block_elements)
+    block_sums = []
+    for start in range(0, n, step):
+        dx = x[start:start + step, None] - x[None, :]
+        dy = y[start:start + step, None] - y[None, :]
+        # Same formula as GEOS Point.distance; the diagonal contributes 0
+        block_sums.append(np.sqrt(dx * dx + dy * dy).sum())
+
+    return math.fsum(block_sums) / (n * (n - 1))
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """
+    Element-wise great-circle distance in km between two sets of longitude/latitude degrees.
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype="float64")) for v in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.sin((lon2 - lon1) / 2) ** 2 * np.cos(lat1) * np.cos(lat2)
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def pairwise_haversine_sum(lon, lat, max_block_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Sum of the great-circle distances (km) between every unordered pair of points
+    given in longitude/latitude degrees, block by block like mean_pairwise_distance.
+    """
+    lon = np.radians(np.asarray(lon, dtype="float64"))
+    lat = np.radians(np.asarray(lat, dtype="float64"))
+    n = len(lon)
+    if n < 2:
+        return 0.0
+
+    cos_lat = np.cos(lat)
+    step = _block_rows(n, max_block_elements)
+    block_sums = []
+    for start in range(0, n, step):
+        rows = slice(start, start + step)
+        a = (np.sin((lat[None, :] - lat[rows, None]) / 2) ** 2
+             + np.sin((lon[None, :] - lon[rows, None]) / 2) ** 2 * cos_lat[rows, None] * cos_lat[None, :])
+        block_sums.append((2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).sum())
+
+    # Every pair was counted in both directions
+    return EARTH_RADIUS_KM * math.fsum(block_sums) / 2
+
+
+def mean_pairwise_haversine(lon, lat, max_block_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Same as mean_pairwise_distance for longitude/latitude degrees, with great-circle
+    distances in km (the haversine formula of turf.distance).
+    """
+    n = len(lon)
+    if n < 2:
+        return float('inf')
+    return 2 * pairwise_haversine_sum(lon, lat, max_block_elements) / (n * (n - 1))
+
+
+def mean_nearest_neighbour_distance(x, y):
+    """
+    Average distance from each point to its nearest other point, using an STRtree.
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    if len(x) < 2:
+        return float('inf')
+
+    points = shapely.points(x, y)
+    tree = shapely.STRtree(points)
+    (source, _), distances = tree.query_nearest(
+        points, return_distance=True, exclusive=True, all_matches=False
+    )
+    nearest = np.zeros(len(points))
+    nearest[source] = distances
+    # `exclusive` also skips equal geometries, so duplicated locations are set back to 0
+    _, inverse, counts = np.unique(
+        np.column_stack([x, y]), axis=0, return_inverse=True, return_counts=True
+    )
+    nearest[counts[inverse.ravel()] > 1] = 0.0
+    return float(nearest.mean())
+
+
+DISTANCE_MODES = {
+    "pairwise": mean_pairwise_distance,
+    "nearest": mean_nearest_neighbour_distance,
+    "haversine": mean_pairwise_haversine,
+}
+
+
+def weighted_saturation(ideal_pts, actual_pts, ideal_dist, actual_dist):
+    """
+    Degree of saturation (0-100) and etat ("T" above 50) of the backend, from the
+    deviation of the number of points and of their average distance to the ideal ones.
+    Works on scalars as well as on whole columns.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        points_deviation = np.abs(actual_pts - ideal_pts) / ideal_pts * 100
+        distance_deviation = np.abs(actual_dist - ideal_dist) / ideal_dist * 100
+
+        normalized_points = np.maximum(0, points_deviation - THRESHOLD_POINTS) / (100 - THRESHOLD_POINTS)
+        normalized_distance = np.maximum(0, distance_deviation - THRESHOLD_DISTANCE) / (100 - THRESHOLD_DISTANCE)
+
+        degree = np.minimum((WEIGHT_POINTS * normalized_points + WEIGHT_DISTANCE * normalized_distance) * 100, 100)
+    return degree, np.where(degree > 50, "T", "F")
+
+
+def average_distance_by_group(frame, group_column, x_column, y_column, mode="pairwise"):
+    """
+    Actual average distance of every group (quartier) in a single groupby pass.
+
+    Returns a Series indexed by group value; rows whose group is missing are ignored.
+    """
+    distance = DISTANCE_MODES[mode]
+    groups = frame.groupby(group_column, sort=False)[[x_column, y_column]]
+    return pd.Series(
+        {name: distance(g[x_column].to_numpy(), g[y_column].to_numpy()) for name, g in groups},
+        dtype="float64",
+    )
@@ -0,0 +1,258 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from geoprocessing.parallel import default_workers
+from geoprocessing.saturation import MAX_BLOCK_ELEMENTS, haversine_km, weighted_saturation
+
+# Name of the unchanged layout in the ranking
+BASELINE = "(base)"
+
+# Columns of a batch of scenario changes: "add" rows give longitude, latitude and the
+# quartier (Cartier) of a new point, "remove" rows the id of an existing point
+CHANGE_COLUMNS = ["scenario", "action", "id", "longitude", "latitude", "Cartier"]
+
+# Ranking order: lowest mean saturation first, then fewest saturated quartiers,
+# then smallest gap between actual and ideal numbers of points
+RANK_BY = ["mean_dsatur", "saturated", "points_gap"]
+
+
+def _row_sums(lon, lat, other_lon, other_lat, max_block_elements=MAX_BLOCK_ELEMENTS):
+    # Sum of the great-circle distances (km) from every point to all the other points
+    sums = np.zeros(len(lon))
+    if len(other_lon) == 0:
+        return sums
+    step = max(1, max_block_elements // len(other_lon))
+    for start in range(0, len(lon), step):
+        rows = slice(start, start + step)
+        sums[rows] = haversine_km(lon[rows, None], lat[rows, None], other_lon[None, :], other_lat[None, :]).sum(axis=1)
+    return sums
+
+
+def _contributions(dsatur, etat, count, ideal_pts):
+    # What every quartier adds to the totals of a layout (dsatur is NaN without ideal values)
+    valid = ~np.isnan(dsatur)
+    gap = np.abs(count - ideal_pts)
+    return pd.DataFrame({
+        "dsatur_total": np.where(valid, dsatur, 0),
+        "valid": valid.astype("float64"),
+        "saturated": (etat == "T").astype("float64"),
+        "points_gap": np.where(np.isnan(gap), 0, gap),
+    })
+
+
+def _pairs_within(groups):
+    # Every (i, j), i < j, of positions sharing a group; positions sorted by group
+    sizes = np.bincount(groups)
+    position = np.arange(len(groups)) - (np.cumsum(sizes) - sizes)[groups]
+    after = sizes[groups] - 1 - position
+    i = np.repeat(np.arange(len(groups)), after)
+    j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(after) - after, after)
+    return i, j
+
+
+class ScenarioBase:
+    """
+    Collecting-point layout every scenario starts from, loaded once.
+
+    points: id, longitude, latitude and Cartier (quartier; points outside every quartier
+    do not count); quartiers: name, ideal_pts, ideal_dist. Every quartier keeps its
+    number of points and the sum of the distances between every pair of them, and every
+    point the sum of its distances to the others of its quartier, so that a scenario
+    only costs the distances from its new points to the points of their quartiers.
+
+    The saturation is the backend's weighted_saturation with great-circle distances
+    in km, over every quartier of the table, including those without any point.
+    """
+
+    def __init__(self, points, quartiers):
+        # First definition of a duplicated name, as the CSV pipeline's lookups keep
+        quartiers = quartiers.drop_duplicates("name")
+        self.names = pd.Index(quartiers["name"])
+        self.ideal_pts = quartiers["ideal_pts"].to_numpy(dtype="float64")
+        self.ideal_dist = quartiers["ideal_dist"].to_numpy(dtype="float64")
+
+        if points["id"].duplicated().any():
+            raise ValueError("Point ids must be unique to be removed by scenarios")
+        self.known = pd.Index(points["id"])
+        code = self.names.get_indexer(points["Cartier"])
+        counted = np.flatnonzero(code >= 0)
+        order = counted[np.argsort(code[counted], kind="stable")]
+        self.ids = pd.Index(points["id"].to_numpy()[order])
+        self.code = code[order]
+        self.lon = points["longitude"].to_numpy(dtype="float64")[order]
+        self.lat = points["latitude"].to_numpy(dtype="float64")[order]
+
+        self.count = np.bincount(self.code, minlength=len(self.names))
+        stops = np.cumsum(self.count)
+        self.starts = stops - self.count
+        self.row_sum = np.concatenate([np.zeros(0)] + [
+            _row_sums(self.lon[a:b], self.lat[a:b], self.lon[a:b], self.lat[a:b]) for a, b in zip(self.starts, stops)
+        ])
+        self.distance_sum = np.bincount(self.code, weights=self.row_sum, minlength=len(self.names)) / 2
+        self.dsatur, self.etat = self.saturation(np.arange(len(self.names)), self.count, self.distance_sum)
+        self.totals = _contributions(self.dsatur, self.etat, self.count, self.ideal_pts).sum()
+
+    def saturation(self, quartiers, count, distance_sum):
+        """
+        dsatur and etat of quartiers (positions) holding count points distance_sum km apart.
+        """
+        count = np.asarray(count, dtype="float64")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(count >= 2, 2 * distance_sum / (count * (count - 1)), np.inf)
+        return weighted_saturation(self.ideal_pts[quartiers], count, self.ideal_dist[quartiers], mean)
+
+    def _distance_to_base(self, quartiers, lon, lat):
+        # Sum of the distances from new points to the base points of their quartier
+        sums = np.zeros(len(lon))
+        for q in np.unique(quartiers):
+            rows = np.flatnonzero(quartiers == q)
+            members = slice(self.starts[q], self.starts[q] + self.count[q])
+            sums[rows] = _row_sums(lon[rows], lat[rows], self.lon[members], self.lat[members])
+        return sums
+
+    def evaluate(self, changes):
+        """
+        Saturation of every scenario of a batch of changes (CHANGE_COLUMNS), in one pass
+        over the stacked changes of all of them.
+
+        Returns (summary, details): one row per scenario (added / removed points that
+        count, mean dsatur, saturated quartiers, points_gap: sum over the quartiers of
+        |actual - ideal points|), and one row per quartier a scenario changes. Removing
+        an unknown id raises a ValueError.
+        """
+        changes = changes.reset_index(drop=True)
+        scenarios = pd.Index(pd.unique(changes["scenario"]))
+        scenario = scenarios.get_indexer(changes["scenario"])
+
+        remove = (changes["action"] == "remove").to_numpy()
+        add = (changes["action"] == "add").to_numpy()
+        unknown = ~changes.loc[remove, "id"].isin(self.known)
+        if unknown.any():
+            raise ValueError(f"Unknown points removed: {', '.join(map(str, changes.loc[remove, 'id'][unknown].unique()))}")
+
+        # Removals of counted points (each once per scenario) and additions inside a quartier
+        removed = pd.DataFrame({"scenario": scenario[remove],
+                                "point": self.ids.get_indexer(changes.loc[remove, "id"])}).drop_duplicates()
+        removed = removed[removed["point"] >= 0]
+        point = removed["point"].to_numpy()
+        added_quartier = self.names.get_indexer(changes.loc[add, "Cartier"])
+        placed = added_quartier >= 0
+        added_lon = changes.loc[add, "longitude"].to_numpy(dtype="float64")[placed]
+        added_lat = changes.loc[add, "latitude"].to_numpy(dtype="float64")[placed]
+        added_quartier = added_quartier[placed]
+
+        # Every change is a point with a sign: its first-order effect on its quartier's
+        # distance sum is sign * (distances to the base points), and every pair of changes
+        # of the same scenario and quartier adds back sign_i * sign_j * their distance
+        s = np.concatenate([removed["scenario"].to_numpy(), scenario[add][placed]])
+        q = np.concatenate([self.code[point], added_quartier])
+        lon = np.concatenate([self.lon[point], added_lon])
+        lat = np.concatenate([self.lat[point], added_lat])
+        sign = np.concatenate([-np.ones(len(point)), np.ones(len(added_lon))])
+        first = np.concatenate([self.row_sum[point], self._distance_to_base(added_quartier, added_lon, added_lat)])
+
+        keys, group = np.unique(s.astype("int64") * len(self.names) + q, return_inverse=True)
+        order = np.argsort(group, kind="stable")
+        s, group, lon, lat, sign, first = s[order], group[order], lon[order], lat[order], sign[order], first[order]
+        i, j = _pairs_within(group)
+        pair = sign[i] * sign[j] * haversine_km(lon[i], lat[i], lon[j], lat[j])
+
+        group_scenario, group_quartier = keys // len(self.names), keys % len(self.names)
+        count = self.count[group_quartier] + np.bincount(group, weights=sign, minlength=len(keys))
+        distance_sum = (self.distance_sum[group_quartier] + np.bincount(group, weights=sign * first, minlength=len(keys))
+                        + np.bincount(group[i], weights=pair, minlength=len(keys)))
+        dsatur, etat = self.saturation(group_quartier, count, distance_sum)
+
+        details = pd.DataFrame({
+            "scenario": scenarios.to_numpy()[group_scenario],
+            "quartier": self.names.to_numpy()[group_quartier],
+            "ideal_pts": self.ideal_pts[group_quartier],
+            "actual_pts": count.astype("int64"),
+            "ideal_dist": self.ideal_dist[group_quartier],
+            "actual_dist": np.where(count >= 2, 2 * distance_sum / np.maximum(count * (count - 1), 1), np.inf),
+            "dsatur": dsatur,
+            "etat": etat,
+            "dsatur_change": dsatur - self.dsatur[group_quartier],
+        })
+        return self._summary(scenarios, details, s, sign), details
+
+
+    def _summary(self, scenarios, details, s, sign):
+        # Base totals, corrected by the quartiers every scenario changes
+        quartier = self.names.get_indexer(details["quartier"])
+        before = _contributions(self.dsatur[quartier], self.etat[quartier], self.count[quartier],
+                                self.ideal_pts[quartier])
+        after = _contributions(details["dsatur"].to_numpy(), details["etat"].to_numpy(),
+                               details["actual_pts"].to_numpy(), details["ideal_pts"].to_numpy())
+        change = (after - before).groupby(details["scenario"].to_numpy()).sum().reindex(scenarios, fill_value=0)
+        totals = change + self.totals
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_dsatur = totals["dsatur_total"].to_numpy() / totals["valid"].to_numpy()
+        return pd.DataFrame({
+            "scenario": scenarios,
+            "added": np.bincount(s[sign > 0], minlength=len(scenarios)),
+            "removed": np.bincount(s[sign < 0], minlength=len(scenarios)),
+            "mean_dsatur": mean_dsatur,
+            "saturated": totals["saturated"].round().astype("int64").to_numpy(),
+            "points_gap": totals["points_gap"].to_numpy(),
+        })
+
+    def baseline(self):
+        """
+        Summary row of the layout without any change.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_dsatur = self.totals["dsatur_total"] / self.totals["valid"]
+        return pd.DataFrame({"scenario": [BASELINE], "added": [0], "removed": [0], "mean_dsatur": [mean_dsatur],
+                             "saturated": [int(round(self.totals["saturated"]))],
+                             "points_gap": [self.totals["points_gap"]]})
+
+
+def rank_scenarios(summary):
+    """
+    Sort scenario summaries best first (RANK_BY) and number them.
+    """
+    ranked = summary.sort_values(RANK_BY, kind="stable", na_position="last").reset_index(drop=True)
+    ranked.insert(0, "rank", np.arange(1, len(ranked) + 1))
+    return ranked
+
+
+_worker_base = None
+
+
+def _set_worker_base(base):
+    # Runs once in every worker process: the base is pickled once per worker, not per chunk
+    global _worker_base
+    _worker_base = base
+
+
+def _evaluate_chunk(changes):
+    return _worker_base.evaluate(changes)
+
+
+def evaluate_scenarios(base, changes, workers=None, chunks_per_worker=4):
+    """
+    Evaluate a batch of scenarios against a ScenarioBase and rank them, the base layout
+    included. Scenarios are split into chunks (whole scenarios each) spread over a
+    ProcessPoolExecutor; each chunk is one vectorized pass, so the values do not depend
+    on the number of workers. Returns (ranking, details).
+    """
+    workers = default_workers() if workers is None else workers
+    names = pd.unique(changes["scenario"])
+    if BASELINE in set(names):
+        raise ValueError(f"{BASELINE!r} is the name of the base layout, not of a scenario")
+
+    if workers <= 1 or len(names) <= 1:
+        summary, details = base.evaluate(changes)
+    else:
+        chunk = np.array_split(np.arange(len(names)), min(len(names), workers * chunks_per_worker))
+        position = pd.Index(names).get_indexer(changes["scenario"])
+        parts = [changes[np.isin(position, scenarios)] for scenarios in chunk]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_base, initargs=(base,)) as executor:
+            results = list(executor.map(_evaluate_chunk, parts))
+        summary = pd.concat([result[0] for result in results], ignore_index=True)
+        details = pd.concat([result[1] for result in results], ignore_index=True)
+
+    return rank_scenarios(pd.concat([base.baseline(), summary], ignore_index=True)), details
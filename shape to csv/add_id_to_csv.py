@@ -1,22 +1,37 @@
-import csv
+import os
+import sys
+import pandas as pd
 
-def add_id_to_csv(input_file, output_file):
-    with open(input_file, mode='r', newline='', encoding='utf-8') as infile:
-        reader = csv.reader(infile)
-        rows = list(reader)
-        
-    if not rows:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.chunked import CHUNK_ROWS, atomic_csv, read_csv_chunks
+
+def add_id(frame):
+    """
+    Same as add_id_to_csv for a DataFrame: "id" becomes the first column, numbered from 0.
+    An existing "id" column is renumbered, so the step can be re-run safely.
+    """
+    frame = frame.drop(columns=["id"], errors="ignore")
+    frame.insert(0, "id", range(len(frame)))
+    return frame
+
+def add_id_to_csv(input_file, output_file, chunk_rows=CHUNK_ROWS):
+    """
+    Number the rows of a CSV in a new first "id" column, chunk_rows rows at a time.
+    Values are copied as text, untouched. The output is written to a temporary file
+    and renamed once complete, so input_file can also be the output.
+    """
+    if os.path.getsize(input_file) == 0:
         print("The file is empty.")
         return
 
-    header = ["id"] + rows[0]  # Add "id" column to the header
-    updated_rows = [header] + [[i] + row for i, row in enumerate(rows[1:], start=0)]
+    header = pd.read_csv(input_file, nrows=0).columns
+    columns = ["id"] + [column for column in header if column != "id"]
+    with atomic_csv(output_file, columns) as writer:
+        for chunk in read_csv_chunks(input_file, chunk_rows=chunk_rows, dtype=str, keep_default_na=False):
+            writer.write(chunk.assign(id=range(writer.rows, writer.rows + len(chunk))))
 
-    with open(output_file, mode='w', newline='', encoding='utf-8') as outfile:
-        writer = csv.writer(outfile)
-        writer.writerows(updated_rows)
-    
     print(f"Updated CSV saved to {output_file}")
 
-# Example usage
-add_id_to_csv("routes_bab_ezzouar.csv", "routes_bab_ezzouar.csv")
+if __name__ == "__main__":
+    # Example usage
+    add_id_to_csv("routes_bab_ezzouar.csv", "routes_bab_ezzouar.csv")
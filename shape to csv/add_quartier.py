@@ -1,11 +1,13 @@
+import os
+import sys
 import geopandas as gpd
 import pandas as pd
 import numpy as np
 from shapely.geometry import Polygon
 
-# Load existing quartiers data
-quartiers_file = "quartiers_bab_ezzouar.csv"
-quartiers = gpd.read_file(quartiers_file)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.cache import load_csv, save_csv
+from geoprocessing.metrics import area_and_centroid
 
 # Define the coordinates for Cité Smail Yefsah (Cité 324 lgts)
 coords = [
@@ -34,41 +36,51 @@ coords = [
     (3.188413646679244, 36.72072118464823)  # Close the polygon
 ]
 
-# Create the polygon
-geometry = Polygon(coords)
+def add_smail_yefsah(quartiers):
+    """
+    Append Cité Smail Yefsah, with its area, centroid and population, to the quartiers.
+    """
+    # Create the polygon
+    geometry = Polygon(coords)
 
-# Create a GeoDataFrame for the new quartier
-yefsah = gpd.GeoDataFrame(
-    {
-        "name": ["Cité Smail Yefsah"],
-        "geometry": [geometry]
-    },
-    crs="EPSG:4326"
-)
+    # Create a GeoDataFrame for the new quartier
+    yefsah = gpd.GeoDataFrame(
+        {
+            "name": ["Cité Smail Yefsah"],
+            "geometry": [geometry]
+        },
+        crs="EPSG:4326"
+    )
 
-# Convert to metric CRS (EPSG:3857) for accurate area calculation
-yefsah = yefsah.to_crs(epsg=3857)
+    # Area on the ellipsoid (km²) and centroid, straight from the longitude/latitude
+    superficie, longitude, latitude = area_and_centroid(yefsah.geometry.values)
+    yefsah["superficie"] = superficie
+    yefsah["longitude"] = longitude
+    yefsah["latitude"] = latitude
 
-# Calculate area in km²
-yefsah["superficie"] = yefsah["geometry"].area / 1e6  
+    # Approximate population using a density between 10,000 - 20,000 hab/km²
+    # (kept from a previous run so that re-running does not change the data)
+    existing = quartiers.loc[quartiers["name"] == "Cité Smail Yefsah", "population"]
+    if len(existing):
+        yefsah["population"] = int(existing.iloc[0])
+    else:
+        yefsah["population"] = (yefsah["superficie"] * np.random.randint(10000, 20000)).astype(int)
 
-# Convert back to geographic CRS (EPSG:4326)
-yefsah = yefsah.to_crs(epsg=4326)
+    # Keep only necessary columns
+    yefsah = yefsah[["name", "geometry", "superficie", "longitude", "latitude", "population"]]
 
-# Extract centroid for coordinates
-yefsah["longitude"] = yefsah["geometry"].centroid.x
-yefsah["latitude"] = yefsah["geometry"].centroid.y
+    # Append the new quartier to the existing dataset (replacing it if it is already there)
+    quartiers = quartiers[quartiers["name"] != "Cité Smail Yefsah"]
+    quartiers = pd.concat([quartiers, yefsah], ignore_index=True)
 
-# Approximate population using a density between 10,000 - 20,000 hab/km²
-yefsah["population"] = (yefsah["superficie"] * np.random.randint(10000, 20000)).astype(int)
+    return quartiers
 
-# Keep only necessary columns
-yefsah = yefsah[["name", "geometry", "superficie", "longitude", "latitude", "population"]]
+if __name__ == "__main__":
+    # Load existing quartiers data
+    quartiers_file = "quartiers_bab_ezzouar.csv"
+    quartiers = add_smail_yefsah(load_csv(quartiers_file))
 
-# Append the new quartier to the existing dataset
-quartiers = pd.concat([quartiers, yefsah], ignore_index=True)
+    # Save updated data back to CSV
+    save_csv(quartiers, quartiers_file)
 
-# Save updated data back to CSV
-quartiers.to_csv(quartiers_file, index=False)
-
-print(f"Cité Smail Yefsah added successfully to {quartiers_file}!")
+    print(f"Cité Smail Yefsah added successfully to {quartiers_file}!")
@@ -0,0 +1,68 @@
+import os
+import sys
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.cache import load_csv
+from geoprocessing.instrumentation import span
+from geoprocessing.scenarios import CHANGE_COLUMNS, ScenarioBase, evaluate_scenarios
+
+def with_quartier(frame, routes):
+    """
+    Quartier (Cartier) of every row through its route, unless the row already gives one.
+    """
+    cartier = frame["route"].map(routes.drop_duplicates("id").set_index("id")["Cartier"]) \
+        if "route" in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+    if "Cartier" in frame.columns:
+        cartier = frame["Cartier"].where(frame["Cartier"].notna(), cartier)
+    return frame.assign(Cartier=cartier)
+
+def load_scenarios(scenarios_file, routes):
+    """
+    Scenario changes CSV: scenario, action (add / remove), id of the removed points,
+    longitude, latitude and route or Cartier of the added ones.
+    """
+    changes = with_quartier(load_csv(scenarios_file, geometry=None), routes)
+    unknown = set(changes["action"]) - {"add", "remove"}
+    if unknown:
+        raise ValueError(f"Unknown scenario actions: {', '.join(map(str, unknown))}")
+    unplaced = (changes["action"] == "add") & changes["Cartier"].isna()
+    if unplaced.any():
+        print(f"Warning: {unplaced.sum()} added points have no quartier and are not counted")
+    return changes.reindex(columns=CHANGE_COLUMNS)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare candidate layouts of points de ramassage.")
+    parser.add_argument("--scenarios", default="scenarios.csv",
+                        help="CSV of the changes of every scenario (scenario, action, id, longitude, latitude, route)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes the scenarios are spread over (0: one per CPU core)")
+    parser.add_argument("--output", default="scenarios_ranking.csv", help="CSV of the ranked scenarios")
+    parser.add_argument("--details", default="",
+                        help="also write the saturation of every quartier each scenario changes to this CSV")
+    parser.add_argument("--top", type=int, default=10, help="number of ranked scenarios to print")
+    args = parser.parse_args()
+
+    # Example usage
+    point_ramassage_file = "point_ramassage.csv"
+    routes_file = "routes_bab_ezzouar.csv"
+    quartiers_file = "quartiers_bab_ezzouar.csv"
+
+    # Load the base layout once, then every scenario only costs its own changes
+    with span("load_csv") as s:
+        routes = load_csv(routes_file, geometry=None)
+        points = with_quartier(load_csv(point_ramassage_file, geometry=None), routes)
+        quartiers = load_csv(quartiers_file, geometry=None)
+        changes = load_scenarios(args.scenarios, routes)
+        s.rows = len(changes)
+    with span("scenario_base", rows=len(points)):
+        base = ScenarioBase(points, quartiers)
+    with span("scenarios", rows=len(changes)):
+        ranking, details = evaluate_scenarios(base, changes, workers=args.workers or None)
+
+    print(ranking.head(args.top).to_string(index=False))
+    ranking.to_csv(args.output, index=False)
+    if args.details:
+        details.to_csv(args.details, index=False)
+    print(f"{len(ranking) - 1} scenarios ranked in {args.output}")
@@ -1,35 +1,68 @@
+import os
+import sys
+import argparse
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.wkt import loads
+import shapely
 
-# Load quartiers CSV (ensure it has a geometry column)
-quartiers = pd.read_csv("quartiers_bab_ezzouar.csv")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.cache import load_csv, save_csv
+from geoprocessing.formats import FORMATS, with_format, write_layer
+from geoprocessing.instrumentation import span
 
-# Convert quartiers to GeoDataFrame
-quartiers["geometry"] = quartiers["geometry"].apply(loads)
-quartiers_gdf = gpd.GeoDataFrame(quartiers, geometry="geometry", crs="EPSG:4326")
+def assign_quartiers(routes_gdf, quartiers_gdf, default=" "):
+    """
+    Find the quartier every route belongs to with a single STRtree query.
 
-# Load routes CSV
-routes = pd.read_csv("routes_bab_ezzouar.csv")
+    When a route crosses several quartiers it goes to the one holding the longest
+    part of it; equal overlaps keep the quartier that comes first in quartiers_gdf.
+    """
+    routes = routes_gdf.geometry.values
+    quartiers = quartiers_gdf.geometry.values
 
-# Convert the geometry column (LINESTRING) to real geometries
-routes["geometry"] = routes["geometry"].apply(loads)
-routes_gdf = gpd.GeoDataFrame(routes, geometry="geometry", crs="EPSG:4326")
+    # Candidate (route, quartier) pairs that really intersect
+    tree = shapely.STRtree(quartiers)
+    route_idx, quartier_idx = tree.query(routes, predicate="intersects")
 
-# Function to find the quartier a route belongs to
-def find_quartier(route_geom):
-    for _, quartier in quartiers_gdf.iterrows():
-        if route_geom.intersects(quartier.geometry):  # Check intersection
-            return quartier["name"]
-    return " "
+    # Length of each route inside each candidate quartier
+    overlap = shapely.length(shapely.intersection(routes[route_idx], quartiers[quartier_idx]))
 
-# Assign quartier names to each route
-routes_gdf["Cartier"] = routes_gdf["geometry"].apply(find_quartier)
+    # Sort by route, then longest overlap, then quartier order and keep the first pair per route
+    order = np.lexsort((quartier_idx, -overlap, route_idx))
+    route_idx, quartier_idx = route_idx[order], quartier_idx[order]
+    routes_found, first = np.unique(route_idx, return_index=True)
 
-# Save updated routes to a new CSV file
-routes_gdf.to_csv("routes_bab_ezzouar.csv", index=False)
-routes_gdf.to_file("routes_bab_ezzouar.shp", driver="ESRI Shapefile")
+    names = np.full(len(routes), default, dtype=object)
+    names[routes_found] = quartiers_gdf["name"].to_numpy()[quartier_idx[first]]
+    return pd.Series(names, index=routes_gdf.index, name="Cartier")
 
+def relate_routes(routes_gdf, quartiers_gdf):
+    """
+    Copy of the routes with their quartier name in the "Cartier" column.
+    """
+    routes_gdf = routes_gdf.copy()
+    with span("spatial_join", rows=len(routes_gdf)):
+        routes_gdf["Cartier"] = assign_quartiers(routes_gdf, quartiers_gdf)
+    return routes_gdf
 
-print("Routes updated with Cartier names successfully!")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assign every route to its quartier.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile",
+                        help="format of the geometry outputs written next to the CSV")
+    args = parser.parse_args()
 
+    # Load quartiers CSV (ensure it has a geometry column)
+    quartiers_gdf = load_csv("quartiers_bab_ezzouar.csv")
+
+    # Load routes CSV, with the LINESTRING geometries already parsed
+    routes_gdf = load_csv("routes_bab_ezzouar.csv")
+
+    # Assign quartier names to each route
+    routes_gdf = relate_routes(routes_gdf, quartiers_gdf)
+
+    # Save updated routes to a new CSV file
+    save_csv(routes_gdf, "routes_bab_ezzouar.csv")
+    write_layer(routes_gdf, with_format("routes_bab_ezzouar.shp", args.format), args.format)
+
+
+    print("Routes updated with Cartier names successfully!")
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.cache import file_digest, load_csv, read_frame, save_csv, write_frame
+from geoprocessing.instrumentation import span
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The stages import this package: a change to any of its modules re-runs them
+PACKAGE_DIR = os.path.join(SCRIPTS_DIR, "..", "geoprocessing")
+
+# Intermediate results and the state of the last run are kept here
+WORK_DIR = ".pipeline"
+
+# Files read by the pipeline: artifact -> (CSV file, geometry column)
+SOURCES = {
+    "routes_source": ("routes_bab_ezzouar.csv", "geometry"),
+    "points": ("point_ramassage.csv", None),
+}
+
+# Preprocessing chain: every stage calls one function of one script of this folder
+# (with its input artifacts as arguments and its "options", if any, as keywords);
+# "files", if any, lists other files it reads, whose content is part of its key
+STAGES = [
+    {"name": "modify_cartier_data", "script": "modify_cartier_data", "function": "build_quartiers",
+     "inputs": [], "output": "quartiers_osm"},
+    {"name": "add_quartier", "script": "add_quartier", "function": "add_smail_yefsah",
+     "inputs": ["quartiers_osm"], "output": "quartiers"},
+    {"name": "add_id_to_csv", "script": "add_id_to_csv", "function": "add_id",
+     "inputs": ["routes_source"], "output": "routes_ids"},
+    {"name": "relate_routes_quartiers", "script": "relate_routes_quartiers", "function": "relate_routes",
+     "inputs": ["routes_ids", "quartiers"], "output": "routes"},
+    {"name": "update_ideal_distance", "script": "update_ideal_distance-number_pointspy",
+     "function": "compute_ideal_points", "inputs": ["quartiers"], "output": "quartiers_ideal"},
+    {"name": "update_saturation", "script": "update_saturation", "function": "compute_saturation",
+     "inputs": ["points", "routes", "quartiers_ideal"], "output": "saturation"},
+]
+
+
+def _export_saturation(result):
+    result[result["etat"] == "saturé"].to_csv("point_ramassage_sature.csv", index=False)
+    result[result["etat"] == "non saturé"].to_csv("point_ramassage_non_sature.csv", index=False)
+
+
+# Artifacts written back to the files the individual scripts use
+EXPORTS = {
+    "quartiers_ideal": lambda frame: save_csv(frame, "quartiers_bab_ezzouar.csv"),
+    "routes": lambda frame: save_csv(frame, "routes_bab_ezzouar.csv"),
+    "saturation": _export_saturation,
+}
+
+
+def load_script(name):
+    """
+    Import a script of this folder as a module (some file names are not valid module names).
+    """
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(SCRIPTS_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Pipeline:
+    """
+    Runs the stages in dependency order, passing DataFrames in memory.
+
+    A stage is skipped when the content hashes of its inputs, of its script and of the
+    geoprocessing package are the ones recorded at its last run; stages whose inputs
+    are ready run concurrently.
+    """
+
+    def __init__(self, stages=STAGES, sources=SOURCES, exports=EXPORTS, work_dir=WORK_DIR, workers=4):
+        self.stages = stages
+        self.sources = sources
+        self.exports = exports
+        self.work_dir = work_dir
+        self.workers = workers
+        self.state_path = os.path.join(work_dir, "state.json")
+        self.frames = {}
+        self.digests = {}
+        self.package_digest = None
+
+    def _artifact_path(self, name):
+        return os.path.join(self.work_dir, name + ".arrow")
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _stage_key(self, stage):
+        script_path = os.path.join(SCRIPTS_DIR, stage["script"] + ".py")
+        key = [
+            file_digest(script_path), self.package_digest, stage["function"], stage.get("options", {}),
+            [(name, self.digests[name]) for name in stage["inputs"]],
+            [(path, file_digest(path)) for path in stage.get("files", [])],
+        ]
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+    def _frame(self, name):
+        # Results of this run are in memory; skipped stages and sources are read from disk
+        if name not in self.frames:
+            if name in self.sources:
+                path, geometry = self.sources[name]
+                self.frames[name] = load_csv(path, geometry=geometry)
+            else:
+                self.frames[name] = read_frame(self._artifact_path(name))
+        return self.frames[name]
+
+    def _run_stage(self, stage):
+        start = time.perf_counter()
+        with span(stage["name"]) as s:
+            function = getattr(load_script(stage["script"]), stage["function"])
+            result = function(*[self._frame(name) for name in stage["inputs"]], **stage.get("options", {}))
+            write_frame(result, self._artifact_path(stage["output"]))
+            s.rows = len(result)
+        return result, time.perf_counter() - start
+
+    def run(self, force=()):
+        """
+        Run the pipeline; force lists stage names to re-run anyway ("all" for every stage).
+        Returns the names of the stages that ran.
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        state = self._load_state()
+        modules = sorted(f for f in os.listdir(PACKAGE_DIR) if f.endswith(".py"))
+        self.package_digest = hashlib.sha256(json.dumps(
+            [(f, file_digest(os.path.join(PACKAGE_DIR, f))) for f in modules]).encode()).hexdigest()
+        exported = state.get("exported", {})
+        for name, (path, _) in self.sources.items():
+            self.digests[name] = file_digest(path)
+            # A source the last run wrote back to stands for the source it was computed from
+            if name in exported and exported[name]["written"] == self.digests[name]:
+                self.digests[name] = exported[name]["source"]
+
+        pending = list(self.stages)
+        running = {}
+        ran, produced = [], set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                # A skipped stage makes its output ready at once, which may unblock others
+                ready = [s for s in pending if all(name in self.digests for name in s["inputs"])]
+                while ready:
+                    stage = ready.pop(0)
+                    pending.remove(stage)
+                    key = self._stage_key(stage)
+                    previous = state.get(stage["name"], {})
+                    forced = "all" in force or stage["name"] in force
+                    if not forced and previous.get("key") == key and os.path.exists(self._artifact_path(stage["output"])):
+                        print(f"[skip] {stage['name']}: inputs unchanged")
+                        self.digests[stage["output"]] = previous["output"]
+                        ready = [s for s in pending if all(name in self.digests for name in s["inputs"])]
+                        continue
+                    running[executor.submit(self._run_stage, stage)] = (stage, key)
+
+                if not running:
+                    if pending:
+                        missing = sorted({n for s in pending for n in s["inputs"] if n not in self.digests})
+                        raise ValueError(f"No stage produces: {', '.join(missing)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, key = running.pop(future)
+                    result, seconds = future.result()
+                    output = stage["output"]
+                    self.frames[output] = result
+                    self.digests[output] = file_digest(self._artifact_path(output))
+                    state[stage["name"]] = {"key": key, "output": self.digests[output]}
+                    self._save_state(state)
+                    ran.append(stage["name"])
+                    produced.add(output)
+                    print(f"[run] {stage['name']}: {len(result)} rows in {seconds:.2f}s")
+
+        # Write back only what changed in this run
+        for name, export in self.exports.items():
+            if name in produced:
+                export(self.frames[name])
+
+        # Some exports overwrite sources: remember what they wrote so that the next run
+        # does not take it for an edit of the source
+        for name, (path, _) in self.sources.items():
+            written = file_digest(path)
+            if written != self.digests[name]:
+                state.setdefault("exported", {})[name] = {"written": written, "source": self.digests[name]}
+        self._save_state(state)
+        return ran
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the preprocessing chain, skipping unchanged stages.")
+    parser.add_argument("--force", action="append", default=[],
+                        help="stage to re-run even if its inputs did not change (repeatable, or 'all')")
+    parser.add_argument("--workers", type=int, default=4, help="stages run at the same time")
+    quartiers = parser.add_mutually_exclusive_group()
+    quartiers.add_argument("--quartiers-from-csv", action="store_true",
+                           help="start from quartiers_bab_ezzouar.csv instead of downloading them from OpenStreetMap")
+    quartiers.add_argument("--osm-source", default=None,
+                           help="local .osm.pbf, .osm or GeoPackage extract used by modify_cartier_data")
+    args = parser.parse_args()
+
+    stages, sources = STAGES, dict(SOURCES)
+    if args.osm_source:
+        # The extract may be edited in place: its content, not only its path, is in the key
+        osm_source = os.path.abspath(args.osm_source)
+        stages = [dict(s, options={"osm_source": osm_source}, files=[osm_source])
+                  if s["name"] == "modify_cartier_data" else s for s in stages]
+    if args.quartiers_from_csv:
+        stages = [s for s in stages if s["name"] != "modify_cartier_data"]
+        sources["quartiers_osm"] = ("quartiers_bab_ezzouar.csv", "geometry")
+
+    ran = Pipeline(stages, sources, workers=args.workers).run(force=args.force)
+    print(f"Pipeline finished: {len(ran)} stage(s) run")
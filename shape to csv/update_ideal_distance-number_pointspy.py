@@ -1,40 +1,55 @@
+import os
+import sys
+import argparse
+import numpy as np
 import pandas as pd
-import math
 import geopandas as gpd
-from shapely.wkt import loads
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.cache import load_csv, save_csv
+from geoprocessing.formats import FORMATS, with_format, write_layer
 
 # Constants
 SERVICE_CAPACITY = 500  # Number of people one point de ramassage can serve
 DENSITY_FACTOR = 1  # Can be adjusted based on location
 ACCESSIBILITY_FACTOR = 1  # Can be adjusted based on location
 
-# Load quartiers data
-quartiers = pd.read_csv("quartiers_bab_ezzouar.csv")
+def compute_ideal_points(quartiers):
+    """
+    Add the ideal number of points (ideal_pts) and ideal distance between points (ideal_dist) to the quartiers.
+    """
+    quartiers = quartiers.drop(columns=["ideal_points"], errors="ignore")
 
-quartiers = quartiers.drop(columns=["ideal_points"], errors="ignore")
+    # Ensure population and area are numeric
+    quartiers["population"] = pd.to_numeric(quartiers["population"], errors="coerce")
+    quartiers["superficie"] = pd.to_numeric(quartiers["superficie"], errors="coerce")
 
-# Ensure population and area are numeric
-quartiers["population"] = pd.to_numeric(quartiers["population"], errors="coerce")
-quartiers["superficie"] = pd.to_numeric(quartiers["superficie"], errors="coerce")
+    # Calculate the ideal number of collection points
+    quartiers["ideal_pts"] = (quartiers["population"] / SERVICE_CAPACITY) * DENSITY_FACTOR * ACCESSIBILITY_FACTOR
+    quartiers["ideal_pts"] = np.maximum(1, np.ceil(quartiers["ideal_pts"])).astype("int64")  # At least 1 point per quartier
 
-# Convert geometry column from WKT to Shapely objects
-quartiers["geometry"] = quartiers["geometry"].apply(loads)
+    # Calculate ideal distance between points
+    quartiers["ideal_dist"] = (quartiers["superficie"] / quartiers["ideal_pts"]) ** 0.5  # Square root of area per point
 
-# Calculate the ideal number of collection points
-quartiers["ideal_pts"] = (quartiers["population"] / SERVICE_CAPACITY) * DENSITY_FACTOR * ACCESSIBILITY_FACTOR
-quartiers["ideal_pts"] = quartiers["ideal_pts"].apply(lambda x: max(1, math.ceil(x)))  # At least 1 point per quartier
+    # Convert to GeoDataFrame
+    quartiers_gdf = gpd.GeoDataFrame(quartiers, geometry="geometry")
 
-# Calculate ideal distance between points
-quartiers["ideal_dist"] = (quartiers["superficie"] / quartiers["ideal_pts"]) ** 0.5  # Square root of area per point
+    # Set Coordinate Reference System (CRS) to WGS 84
+    quartiers_gdf.set_crs(epsg=4326, inplace=True, allow_override=True)
+    return quartiers_gdf
 
-# Convert to GeoDataFrame
-quartiers_gdf = gpd.GeoDataFrame(quartiers, geometry="geometry")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the ideal number of points and distance per quartier.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile",
+                        help="format of the geometry output written next to the CSV")
+    args = parser.parse_args()
 
-# Set Coordinate Reference System (CRS) to WGS 84
-quartiers_gdf.set_crs(epsg=4326, inplace=True)
+    # Load quartiers data (geometries come back already parsed from the cache)
+    quartiers_gdf = compute_ideal_points(load_csv("quartiers_bab_ezzouar.csv"))
 
-# Save to shapefile in the correct folder
-quartiers_gdf.to_csv("quartiers_bab_ezzouar.csv", index=False)
-quartiers_gdf.to_file("region files/quartiers_bab_ezzouar.shp", driver="ESRI Shapefile")
+    # Save to shapefile in the correct folder
+    save_csv(quartiers_gdf, "quartiers_bab_ezzouar.csv")
+    output_path = with_format("region files/quartiers_bab_ezzouar.shp", args.format)
+    write_layer(quartiers_gdf, output_path, args.format)
 
-print("Updated shapefile saved as 'region_files/quartiers_bab_ezzouar.shp'")
+    print(f"Updated shapefile saved as '{output_path}'")
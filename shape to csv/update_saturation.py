@@ -1,101 +1,242 @@
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
 import pandas as pd
-import math
 import geopandas as gpd
-from shapely.geometry import Point
-from shapely.ops import nearest_points
 
-def calculate_actual_average_distance(points_in_quartier):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from geoprocessing.cache import load_csv
+from geoprocessing.chunked import CHUNK_ROWS, Partitions, atomic_csv, lookup, read_csv_chunks
+from geoprocessing.formats import FORMATS, with_format, write_layer, write_layer_chunks
+from geoprocessing.instrumentation import span
+from geoprocessing.parallel import parallel_distance_by_group
+from geoprocessing.road_graph import NETWORK_MODE, network_distance_by_group, road_graph
+from geoprocessing.saturation import DISTANCE_MODES
+
+# Columns of the points CSV that end up in the outputs, and the outputs' columns
+POINT_COLUMNS = ["id", "longitude", "latitude", "amenity", "route"]
+OUTPUT_COLUMNS = POINT_COLUMNS + ["degre_de_saturation", "etat"]
+
+def calculate_actual_average_distance(points_in_quartier, mode="pairwise"):
     """
     Calculate the average distance between points de ramassage in a quartier.
     """
-    if len(points_in_quartier) < 2:
-        return float('inf')  # If only one point, return infinity
-    
-    distances = []
-    for i, point in points_in_quartier.iterrows():
-        p1 = Point(point["longitude_x"], point["latitude_x"])
-        for j, other_point in points_in_quartier.iterrows():
-            if i != j:
-                p2 = Point(other_point["longitude_x"], other_point["latitude_x"])
-                distances.append(p1.distance(p2))
-    
-    return sum(distances) / len(distances)
-
-def calculate_saturation_and_etat(point, ideal_distance, actual_avg_distance):
+    return DISTANCE_MODES[mode](
+        points_in_quartier["longitude"].to_numpy(), points_in_quartier["latitude"].to_numpy()
+    )
+
+def calculate_saturation_and_etat(ideal_distance, actual_avg_distance):
     """
     Calculate the degree of saturation based on the difference between actual and ideal distances.
+    Works on scalars as well as on whole columns.
     """
-    saturation_deviation = abs(actual_avg_distance - ideal_distance) / ideal_distance * 100
-    
-    degree_of_saturation = min(saturation_deviation, 100)  # Ensure it doesn't exceed 100%
-    etat = "saturé" if degree_of_saturation > 50 else "non saturé"
-    
+    saturation_deviation = np.abs(actual_avg_distance - ideal_distance) / ideal_distance * 100
+
+    degree_of_saturation = np.minimum(saturation_deviation, 100)  # Ensure it doesn't exceed 100%
+    etat = np.where(degree_of_saturation > 50, "saturé", "non saturé")
+
     return degree_of_saturation, etat
 
-def add_saturation_and_etat_to_points(point_ramassage_file, routes_file, quartiers_file):
-    # Load the CSV files
-    points = pd.read_csv(point_ramassage_file)
-    routes = pd.read_csv(routes_file)
-    quartiers = pd.read_csv(quartiers_file)
-    
-    # Merge points with routes
-    points = points.merge(routes, how="left", left_on="route", right_on="id")
-    
-    # Merge with quartiers to get ideal_pts and ideal_dist
-    points = points.merge(quartiers, how="left", left_on="Cartier", right_on="name")
-    
-    # Debugging: Print columns after merging to check if longitude and latitude have changed names
-    print("Columns after merging with quartiers_info:", points.columns)
-
-    saturation_results = []
-    for quartier_name in points["Cartier"].unique():
-        quartier_points = points[points["Cartier"] == quartier_name]
-        ideal_distance = quartier_points["ideal_dist"].iloc[0]  # Ideal distance for this quartier
-        actual_avg_distance = calculate_actual_average_distance(quartier_points)
-        
-        for _, point in quartier_points.iterrows():
-            # Update the column names for longitude and latitude based on the merge output
-            longitude_column = 'longitude_x'  # Adjust if it is 'longitude_x' or 'longitude_y'
-            latitude_column = 'latitude_x'    # Adjust if it is 'latitude_x' or 'latitude_y'
-            
-            degree_of_saturation, etat = calculate_saturation_and_etat(point, ideal_distance, actual_avg_distance)
-            
-            saturation_results.append({
-                "id": point["id_x"],
-                "longitude": point[longitude_column],
-                "latitude": point[latitude_column],
-                "amenity": point["amenity"],
-                "route": point["route"],
-                "degre_de_saturation": degree_of_saturation,
-                "etat": etat
-            })
-    
-    return pd.DataFrame(saturation_results)
-
-# Example usage
-point_ramassage_file = "point_ramassage.csv"
-routes_file = "routes_bab_ezzouar.csv"
-quartiers_file = "quartiers_bab_ezzouar.csv"
-
-result = add_saturation_and_etat_to_points(point_ramassage_file, routes_file, quartiers_file)
-print(result)
-
-# Save results
-sature_points = result[result["etat"] == "saturé"]
-non_sature_points = result[result["etat"] == "non saturé"]
-
-sature_points.to_csv("point_ramassage_sature.csv", index=False)
-non_sature_points.to_csv("point_ramassage_non_sature.csv", index=False)
-
-# Convert to GeoDataFrame and save shapefiles
-sature_points_gdf = gpd.GeoDataFrame(
-    sature_points, geometry=gpd.points_from_xy(sature_points["longitude"], sature_points["latitude"])
-)
-non_sature_points_gdf = gpd.GeoDataFrame(
-    non_sature_points, geometry=gpd.points_from_xy(non_sature_points["longitude"], non_sature_points["latitude"])
-)
-
-sature_points_gdf.to_file("region files/point_ramassage_sature_bab_ezzouar.shp", driver="ESRI Shapefile")
-non_sature_points_gdf.to_file("region files/point_ramassage_non_sature_bab_ezzouar.shp", driver="ESRI Shapefile")
-
-print("Shapefiles saved successfully!")
+def add_saturation_and_etat_to_points(point_ramassage_file, routes_file, quartiers_file, mode="pairwise", workers=1):
+    # Load the CSV files (geometries are only needed to route along the roads)
+    with span("load_csv") as s:
+        points = load_csv(point_ramassage_file, geometry=None)
+        routes = load_csv(routes_file, geometry="geometry" if mode == NETWORK_MODE else None)
+        quartiers = load_csv(quartiers_file, geometry=None)
+        s.rows = len(points)
+    return compute_saturation(points, routes, quartiers, mode, workers)
+
+def compute_saturation(points, routes, quartiers, mode="pairwise", workers=1):
+    """
+    Saturation degree and etat of every point de ramassage, from already loaded tables.
+    With workers > 1 the quartiers are spread over that many processes. The network mode
+    needs the routes geometries, to build (or reload) the road graph.
+    """
+    if mode == NETWORK_MODE:
+        if "geometry" not in routes.columns:
+            raise ValueError("The network mode needs the routes geometries")
+        with span("road_graph", rows=len(routes)):
+            graph = road_graph(routes["geometry"].to_numpy())
+        routes = routes.drop(columns="geometry")
+
+    with span("lookup", rows=len(points)):
+        # Quartier of every point through its route, and ideal distance of that quartier
+        # (first definition of a duplicated id or name; unlike a left merge, which would
+        # repeat the point once per duplicate, every point stays a single row)
+        cartier = routes.drop_duplicates("id").set_index("id")["Cartier"]
+        ideal_dist = quartiers.drop_duplicates("name").set_index("name")["ideal_dist"]
+        points = points.assign(Cartier=points["route"].map(cartier))
+
+        # Points without a quartier are not part of any saturation group
+        points = points[points["Cartier"].notna()]
+
+        # Keep the points grouped by quartier, in order of first appearance
+        quartier_order = pd.Categorical(points["Cartier"], categories=points["Cartier"].unique())
+        points = points.iloc[np.argsort(quartier_order.codes, kind="stable")]
+
+    # One vectorized pass: average distance per quartier, broadcast back to its points
+    with span("distance", rows=len(points), mode=mode):
+        if mode == NETWORK_MODE:
+            actual_avg_distance = network_distance_by_group(points, "Cartier", "longitude", "latitude", graph)
+        else:
+            actual_avg_distance = parallel_distance_by_group(
+                points, "Cartier", "longitude", "latitude", mode=mode, workers=workers
+            )
+    degree_of_saturation, etat = calculate_saturation_and_etat(
+        points["Cartier"].map(ideal_dist).to_numpy(dtype="float64"),
+        points["Cartier"].map(actual_avg_distance).to_numpy(dtype="float64"),
+    )
+
+    return pd.DataFrame({
+        "id": points["id"].to_numpy(),
+        "longitude": points["longitude"].to_numpy(),
+        "latitude": points["latitude"].to_numpy(),
+        "amenity": points["amenity"].to_numpy(),
+        "route": points["route"].to_numpy(),
+        "degre_de_saturation": degree_of_saturation,
+        "etat": etat
+    })
+
+def _with_quartier(chunk, cartier):
+    # Rows of a points chunk that have a quartier, and that quartier
+    quartier = chunk["route"].map(cartier)
+    known = quartier.notna().to_numpy()
+    return chunk[known], quartier[known]
+
+def stream_saturation(point_ramassage_file, routes_file, quartiers_file, sature_file, non_sature_file,
+                      mode="pairwise", workers=1, chunk_rows=CHUNK_ROWS):
+    """
+    Chunked add_saturation_and_etat_to_points for points CSVs too large for memory,
+    writing the saturated / non saturated points straight to their CSVs.
+
+    Only the needed columns are read, chunk_rows rows at a time; routes and quartiers
+    are reduced to two lookups (route id -> Cartier, Cartier -> ideal_dist). The points'
+    coordinates are spilled to disk by quartier, so the average distances are computed
+    one partition at a time. Each output is written to a temporary file and only renamed
+    over the previous one once complete. Rows come in the same order as from
+    compute_saturation: by quartier, in order of first appearance.
+    Returns the number of saturated and non saturated points.
+    """
+    if mode == NETWORK_MODE:
+        raise ValueError("The network mode needs the whole road graph and has no chunked version")
+
+    with span("lookup"):
+        cartier = lookup(routes_file, "id", "Cartier", chunk_rows)
+        ideal_dist = lookup(quartiers_file, "name", "ideal_dist", chunk_rows)
+
+    with Partitions(["longitude", "latitude"]) as partitions:
+        # Pass 1: coordinates of every point, spilled by quartier
+        codes, rows = {}, 0
+        with span("partition") as s:
+            for chunk in read_csv_chunks(point_ramassage_file, ["route", "longitude", "latitude"], chunk_rows):
+                chunk, quartier = _with_quartier(chunk, cartier)
+                for name in quartier.unique():
+                    codes.setdefault(name, len(codes))
+                partitions.append(quartier.map(codes).to_numpy(), chunk)
+                rows += len(chunk)
+            s.rows = rows
+
+        # Pass 2: average distance of every quartier, one partition in memory at a time
+        with span("distance", mode=mode):
+            distances = [
+                parallel_distance_by_group(part, "group", "longitude", "latitude", mode=mode, workers=workers)
+                for part in partitions
+            ]
+    actual_avg_distance = pd.concat(distances) if distances else pd.Series(dtype="float64")
+    actual_avg_distance.index = np.array(list(codes), dtype=object)[actual_avg_distance.index.to_numpy(dtype="int64")]
+
+    # Pass 3: saturation of every point, spilled by quartier: a quartier is saturé or
+    # not as a whole, and the outputs list the quartiers in order of first appearance,
+    # each with its points in the order of the points CSV, as compute_saturation does
+    etats, rows = {}, {}
+    with span("saturation") as s, tempfile.TemporaryDirectory(prefix="saturation_") as spill:
+        for chunk in read_csv_chunks(point_ramassage_file, POINT_COLUMNS, chunk_rows):
+            chunk, quartier = _with_quartier(chunk, cartier)
+            degree_of_saturation, etat = calculate_saturation_and_etat(
+                quartier.map(ideal_dist).to_numpy(dtype="float64"),
+                quartier.map(actual_avg_distance).to_numpy(dtype="float64"),
+            )
+            chunk = chunk.assign(degre_de_saturation=degree_of_saturation, etat=etat)
+            for code, group in chunk.groupby(quartier.map(codes).to_numpy(), sort=False):
+                with open(os.path.join(spill, f"{code}.csv"), "a", newline="", encoding="utf-8") as f:
+                    group[OUTPUT_COLUMNS].to_csv(f, header=False, index=False)
+                etats[code] = group["etat"].iloc[0]
+                rows[code] = rows.get(code, 0) + len(group)
+
+        with atomic_csv(sature_file, OUTPUT_COLUMNS) as sature, atomic_csv(non_sature_file, OUTPUT_COLUMNS) as non_sature:
+            for code in sorted(etats):
+                output = sature if etats[code] == "saturé" else non_sature
+                output.append_csv(os.path.join(spill, f"{code}.csv"), rows[code])
+        s.rows = sature.rows + non_sature.rows
+    return sature.rows, non_sature.rows
+
+def write_point_layer_chunks(csv_file, output_path, fmt, chunk_rows=CHUNK_ROWS):
+    # Points layer of a saturation CSV, converted and written chunk by chunk
+    chunks = (
+        gpd.GeoDataFrame(chunk, geometry=gpd.points_from_xy(chunk["longitude"], chunk["latitude"]), crs="EPSG:4326")
+        for chunk in read_csv_chunks(csv_file, chunk_rows=chunk_rows)
+    )
+    return write_layer_chunks(chunks, output_path, fmt)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the saturation of every point de ramassage.")
+    parser.add_argument("--mode", choices=sorted(DISTANCE_MODES) + [NETWORK_MODE], default="pairwise",
+                        help="pairwise: mean distance between all points, nearest: mean nearest-neighbour distance, "
+                             "haversine: pairwise in km, the unit of ideal_dist, "
+                             "network: km along the roads to the nearest other point")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes the quartiers are spread over (0: one per CPU core)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="shapefile",
+                        help="format of the geometry outputs written next to the CSV")
+    parser.add_argument("--chunk-rows", type=int, default=0,
+                        help="stream the CSVs this many rows at a time instead of loading them whole "
+                             "(for region-wide files; not available with --mode network)")
+    args = parser.parse_args()
+
+    # Example usage
+    point_ramassage_file = "point_ramassage.csv"
+    routes_file = "routes_bab_ezzouar.csv"
+    quartiers_file = "quartiers_bab_ezzouar.csv"
+    sature_file = "point_ramassage_sature.csv"
+    non_sature_file = "point_ramassage_non_sature.csv"
+    sature_shapefile = with_format("region files/point_ramassage_sature_bab_ezzouar.shp", args.format)
+    non_sature_shapefile = with_format("region files/point_ramassage_non_sature_bab_ezzouar.shp", args.format)
+
+    if args.chunk_rows:
+        if args.mode == NETWORK_MODE:
+            parser.error("--chunk-rows is not available with --mode network")
+        sature_count, non_sature_count = stream_saturation(
+            point_ramassage_file, routes_file, quartiers_file, sature_file, non_sature_file,
+            mode=args.mode, workers=args.workers or None, chunk_rows=args.chunk_rows,
+        )
+        print(f"{sature_count} saturated and {non_sature_count} non saturated points")
+        write_point_layer_chunks(sature_file, sature_shapefile, args.format, args.chunk_rows)
+        write_point_layer_chunks(non_sature_file, non_sature_shapefile, args.format, args.chunk_rows)
+        print("Shapefiles saved successfully!")
+        sys.exit()
+
+    result = add_saturation_and_etat_to_points(point_ramassage_file, routes_file, quartiers_file,
+                                               mode=args.mode, workers=args.workers or None)
+    print(result)
+
+    # Save results
+    sature_points = result[result["etat"] == "saturé"]
+    non_sature_points = result[result["etat"] == "non saturé"]
+
+    sature_points.to_csv(sature_file, index=False)
+    non_sature_points.to_csv(non_sature_file, index=False)
+
+    # Convert to GeoDataFrame and save shapefiles
+    sature_points_gdf = gpd.GeoDataFrame(
+        sature_points, geometry=gpd.points_from_xy(sature_points["longitude"], sature_points["latitude"])
+    )
+    non_sature_points_gdf = gpd.GeoDataFrame(
+        non_sature_points, geometry=gpd.points_from_xy(non_sature_points["longitude"], non_sature_points["latitude"])
+    )
+
+    write_layer(sature_points_gdf, sature_shapefile, args.format)
+    write_layer(non_sature_points_gdf, non_sature_shapefile, args.format)
+
+    print("Shapefiles saved successfully!")